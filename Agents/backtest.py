@@ -0,0 +1,222 @@
+"""
+Historical backtest of the strategic planner's trading rules and the position manager's allocation.
+Markov features come from the walk-forward engine, the planner's BUY/SELL/HOLD rules are evaluated
+as array expressions over time x asset, and only the portfolio bookkeeping steps through time.
+No agents are needed: prices are read from the local price cache.
+Usage: python backtest.py [years] TICKER [TICKER ...]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from markov_kernels import momentum_from_sma
+from walk_forward import walk_forward
+from plan_scoring import HOLD, BUY, SELL, SIGNAL_NAMES, planner_signals
+
+# Thresholds mirror perform_enhanced_analysis and make_portfolio_allocation_decision
+DEFAULT_PARAMS = {
+    'window': 365,                  # Bars of history behind every refit
+    'alpha': 0.1,                   # Laplace smoothing of the transition counts
+    'min_volatility_multiplier': 0.5,  # Clamp on recent / long-run volatility when setting regime thresholds
+    'max_volatility_multiplier': 2.0,
+    'horizon_days': 30,             # Horizon of expected_return_30d
+    'buy_momentum': 0.3,            # BUY needs momentum above this ...
+    'buy_expected_return': 0.02,    # ... and expected return above this
+    'sell_momentum': -0.3,          # SELL below this momentum
+    'concentrated_strength': 0.7,   # CONCENTRATED_BUY above this signal strength
+    'rebalance_strength': 0.55,     # REBALANCE above this signal strength
+    'swap_fraction': 0.1,           # Share of the sold asset's position moved per swap
+    'cost_bps': 10.0,               # Transaction cost on traded notional
+    'hit_horizon_days': 30,         # Forward window used to score signals and trades
+}
+
+# Portfolio decisions per bar
+DECISION_HOLD, DECISION_REBALANCE, DECISION_CONCENTRATED_BUY = 0, 1, 2
+
+
+def load_closes(tickers, years=10, cache=None):
+    """Close prices from the price cache as a (time, asset) array aligned on dates, NaN where an asset has no bar."""
+    if cache is None:
+        from price_cache import cache_from_env
+        cache = cache_from_env()
+    end = datetime.now()
+    start = end - timedelta(days=int(365.25 * years))
+    frames = cache.history_many(list(tickers), start, end)
+    closes = pd.concat({ticker: frames[ticker]['Close'] for ticker in tickers}, axis=1).sort_index()
+    return closes.index.values, closes.to_numpy(dtype=float)
+
+
+def rolling_sma(closes, window):
+    """Trailing simple moving average per column; NaN until `window` bars exist or when the window has a gap."""
+    valid = ~np.isnan(closes)
+    prefix = np.zeros((len(closes) + 1,) + closes.shape[1:])
+    counts = np.zeros((len(closes) + 1,) + closes.shape[1:])
+    np.cumsum(np.where(valid, closes, 0.0), axis=0, out=prefix[1:])
+    np.cumsum(valid, axis=0, out=counts[1:])
+    sma = np.full(closes.shape, np.nan)
+    full = (counts[window:] - counts[:-window]) == window
+    sma[window - 1:] = np.where(full, (prefix[window:] - prefix[:-window]) / window, np.nan)
+    return sma
+
+
+def markov_features(closes, params):
+    """Walk-forward momentum, expected return and confidence for every (time, asset), NaN before the first full window."""
+    n_bars, n_assets = closes.shape
+    window = params['window']
+    expected_return = np.full(closes.shape, np.nan)
+    confidence = np.full(closes.shape, np.nan)
+    for asset in range(n_assets):
+        if n_bars >= window:
+            result = walk_forward(closes[:, asset], window, params['alpha'], params['horizon_days'],
+                                  params['min_volatility_multiplier'], params['max_volatility_multiplier'])
+            expected_return[window - 1:, asset] = result['expected_return']
+            confidence[window - 1:, asset] = result['confidence_score']
+    momentum = momentum_from_sma(rolling_sma(closes, 20), rolling_sma(closes, 50))
+    # Bars without a price carry no signal
+    missing = np.isnan(closes)
+    expected_return[missing] = np.nan
+    return momentum, expected_return, confidence
+
+
+def allocation_decisions(signal, strength, score, params):
+    """make_portfolio_allocation_decision for every bar: (decision code, asset to buy, asset to sell) per bar.
+
+    The top asset is the highest risk-adjusted score among assets with data; the asset to sell is the
+    lowest-scored other asset, as in execute_portfolio_decision. Assets are -1 where nothing trades.
+    """
+    ranked = np.where(np.isnan(score), -np.inf, score)
+    top = np.argmax(ranked, axis=1)
+    rows = np.arange(len(score))
+    top_valid = np.isfinite(ranked[rows, top])
+
+    top_signal = signal[rows, top]
+    top_strength = strength[rows, top]
+    decision = np.select(
+        [top_valid & (top_signal == BUY) & (top_strength > params['concentrated_strength']),
+         top_valid & (top_strength > params['rebalance_strength'])],
+        [DECISION_CONCENTRATED_BUY, DECISION_REBALANCE],
+        DECISION_HOLD
+    )
+
+    sell_rank = np.where(np.isnan(score), np.inf, score)
+    sell_rank[rows, top] = np.inf
+    bottom = np.argmin(sell_rank, axis=1)
+    can_sell = np.isfinite(sell_rank[rows, bottom])
+    trades = (decision != DECISION_HOLD) & can_sell
+    buy_asset = np.where(trades, top, -1)
+    sell_asset = np.where(trades, bottom, -1)
+    return decision, buy_asset, sell_asset
+
+
+def forward_returns(closes, horizon):
+    """Simple return from each bar to `horizon` bars later (NaN where either price is missing)."""
+    forward = np.full(closes.shape, np.nan)
+    if len(closes) > horizon:
+        forward[:-horizon] = closes[horizon:] / closes[:-horizon] - 1
+    return forward
+
+
+def max_drawdown(equity):
+    peaks = np.maximum.accumulate(equity)
+    return float(np.max(1 - equity / peaks)) if len(equity) else 0.0
+
+
+def simulate_portfolio(closes, buy_asset, sell_asset, params):
+    """Equal-weight start, then at each close move `swap_fraction` of the sold asset into the bought one.
+
+    Trades decided at bar t are filled at the close of t and earn returns from t + 1, so no bar
+    uses information from its own future. Returns (equity curve, traded notional per bar).
+    """
+    n_bars, n_assets = closes.shape
+    returns = np.zeros(closes.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[1:] = closes[1:] / closes[:-1] - 1
+    returns = np.nan_to_num(returns)  # Assets without a bar are flat for that bar
+
+    holdings = np.full(n_assets, 1.0 / n_assets)
+    equity = np.empty(n_bars)
+    traded = np.zeros(n_bars)
+    cost_rate = params['cost_bps'] / 10_000
+
+    for t in range(n_bars):
+        holdings *= 1.0 + returns[t]
+        if buy_asset[t] >= 0:
+            amount = holdings[sell_asset[t]] * params['swap_fraction']
+            holdings[sell_asset[t]] -= amount
+            holdings[buy_asset[t]] += amount * (1 - cost_rate)
+            traded[t] = amount
+        equity[t] = holdings.sum()
+    return equity, traded
+
+
+FEATURE_PARAMS = ('window', 'alpha', 'horizon_days', 'min_volatility_multiplier', 'max_volatility_multiplier')
+
+
+def run_backtest(closes, params=None, dates=None, features=None):
+    """Replay the planner and allocation rules over a (time, asset) close array and report performance.
+
+    `features` may carry a precomputed markov_features() result for the same FEATURE_PARAMS,
+    so runs that only change trading thresholds skip the walk-forward refit.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    closes = np.asarray(closes, dtype=float)
+    momentum, expected_return, confidence = features if features is not None else markov_features(closes, params)
+    signal, strength, score = planner_signals(momentum, expected_return, confidence, params)
+    decision, buy_asset, sell_asset = allocation_decisions(signal, strength, score, params)
+    equity, traded = simulate_portfolio(closes, buy_asset, sell_asset, params)
+
+    # Signals are hits when the asset moved in the signalled direction over the hit horizon
+    forward = forward_returns(closes, params['hit_horizon_days'])
+    scored = ~np.isnan(forward) & (signal != HOLD)
+    hits = ((signal == BUY) & (forward > 0)) | ((signal == SELL) & (forward < 0))
+
+    # Swaps are hits when the bought asset then beat the sold one
+    trade_rows = np.flatnonzero(buy_asset >= 0)
+    trade_edge = forward[trade_rows, buy_asset[trade_rows]] - forward[trade_rows, sell_asset[trade_rows]]
+    trade_edge = trade_edge[~np.isnan(trade_edge)]
+
+    years = len(closes) / 365.0
+    peaks = np.maximum.accumulate(equity)
+    return {
+        'params': params,
+        'start': str(dates[0]) if dates is not None and len(dates) else None,
+        'end': str(dates[-1]) if dates is not None and len(dates) else None,
+        'n_bars': int(len(closes)),
+        'n_assets': int(closes.shape[1]),
+        'final_equity': float(equity[-1]) if len(equity) else 1.0,
+        'total_return': float(equity[-1] - 1.0) if len(equity) else 0.0,
+        'pnl': np.diff(equity, prepend=1.0),
+        'equity': equity,
+        'drawdown': 1 - equity / peaks,
+        'max_drawdown': max_drawdown(equity),
+        'n_trades': int(len(trade_rows)),
+        'turnover': float(traded.sum() / equity.mean() / years) if len(equity) else 0.0,  # Per year
+        'signal_counts': {name: int((signal == code).sum()) for code, name in enumerate(SIGNAL_NAMES)},
+        'signal_hit_rate': float(hits[scored].mean()) if scored.any() else 0.0,
+        'trade_hit_rate': float((trade_edge > 0).mean()) if len(trade_edge) else 0.0,
+        'decisions': decision,
+    }
+
+
+def print_report(report):
+    print(f"Backtest over {report['n_bars']} bars x {report['n_assets']} assets"
+          + (f" ({report['start'][:10]} to {report['end'][:10]})" if report['start'] else ""))
+    print(f"  Total return:    {report['total_return']:.2%}")
+    print(f"  Max drawdown:    {report['max_drawdown']:.2%}")
+    print(f"  Trades:          {report['n_trades']}")
+    print(f"  Turnover / year: {report['turnover']:.2f}x")
+    print(f"  Signal hit rate: {report['signal_hit_rate']:.1%} ({report['signal_counts']})")
+    print(f"  Trade hit rate:  {report['trade_hit_rate']:.1%}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    years = float(args.pop(0)) if args and args[0].replace('.', '', 1).isdigit() else 10
+    tickers = args or ['BTC-USD', 'ETH-USD', 'LTC-USD']
+    started = time.perf_counter()
+    dates, closes = load_closes(tickers, years)
+    loaded = time.perf_counter()
+    report = run_backtest(closes, dates=dates)
+    print_report(report)
+    print(f"  Loaded prices in {loaded - started:.2f}s, backtest ran in {time.perf_counter() - loaded:.2f}s")
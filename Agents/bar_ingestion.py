@@ -0,0 +1,168 @@
+"""
+Chunked ingestion of intraday and multi-resolution bars into the online Markov model.
+Raw bars are read a block at a time from a memory-mapped price-cache file or a CSV, resampled to
+the requested resolution with array reductions, and fed to OnlineMarkovModel.update_chunk. Only
+one chunk plus the still-open bucket is ever held in memory, so peak memory does not grow with
+the length of the history.
+Usage: python bar_ingestion.py SOURCE INTERVAL [TICKER]   (SOURCE is a .npy/.csv file or 'cache')
+"""
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+from price_cache import BAR_DTYPE, PRICE_COLUMNS
+from online_markov import OnlineMarkovModel
+
+CHUNK_ROWS = 250_000  # Raw bars per chunk (about 12 MB of BAR_DTYPE rows)
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'min': 60, 'h': 3600, 'd': 86400, 'wk': 7 * 86400}
+
+
+def interval_seconds(interval):
+    """Length of a bar interval such as '1m', '5m', '1h' or '1d' in seconds."""
+    match = re.fullmatch(r'(\d+)(s|min|m|h|d|wk)', str(interval).strip())
+    if not match:
+        raise ValueError(f"Unsupported bar interval: {interval!r}")
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+# --- Chunk Sources ---
+
+def iter_npy_bars(path, chunk_rows=CHUNK_ROWS):
+    """Yield BAR_DTYPE chunks of a structured .npy file through a read-only memory map."""
+    bars = np.load(path, mmap_mode='r')
+    for start in range(0, len(bars), chunk_rows):
+        yield np.array(bars[start:start + chunk_rows])
+
+
+def iter_cached_bars(cache, ticker, interval='1m', chunk_rows=CHUNK_ROWS):
+    """Yield chunks of a ticker's cached bars without loading the whole file."""
+    path = cache.path_for(ticker, interval)
+    if os.path.exists(path):
+        yield from iter_npy_bars(path, chunk_rows)
+
+
+def iter_csv_bars(path, chunk_rows=CHUNK_ROWS, time_column=None):
+    """Yield BAR_DTYPE chunks of an OHLCV CSV; the time column defaults to the first column.
+
+    Column names are matched case-insensitively; timestamps with an offset are converted to
+    tz-naive UTC like the price cache. Missing price columns are NaN.
+    """
+    for frame in pd.read_csv(path, chunksize=chunk_rows):
+        columns = {column.lower(): column for column in frame.columns}
+        time_name = time_column or frame.columns[0]
+        times = pd.to_datetime(frame[time_name], utc=True).dt.tz_localize(None)
+        bars = np.empty(len(frame), dtype=BAR_DTYPE)
+        bars['time'] = times.to_numpy().astype('datetime64[s]')
+        for column in PRICE_COLUMNS:
+            source = columns.get(column.lower())
+            bars[column] = frame[source].to_numpy(dtype=float) if source else np.nan
+        yield bars
+
+
+# --- Resampling ---
+
+class BarResampler:
+    """Aggregates time-sorted bars into fixed buckets across chunk boundaries.
+
+    Buckets are aligned to the Unix epoch (so '1d' buckets start at UTC midnight). The last bucket
+    of every chunk may still receive bars from the next chunk, so it is held back until a later
+    bar closes it or flush() is called.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.seconds = interval_seconds(interval)
+        self.pending = np.empty(0, dtype=BAR_DTYPE)
+
+    def push(self, bars):
+        """Add a chunk of raw bars; returns the buckets it completed as BAR_DTYPE rows."""
+        bars = bars[~np.isnan(bars['Close'])]
+        if not len(bars):
+            return np.empty(0, dtype=BAR_DTYPE)
+        # The pending row is already an aggregate of its bucket, and every reduction is associative
+        bars = np.concatenate([self.pending, bars])
+        buckets = bars['time'].astype(np.int64) // self.seconds
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        ends = np.append(starts[1:], len(bars)) - 1
+
+        resampled = np.empty(len(starts), dtype=BAR_DTYPE)
+        resampled['time'] = (buckets[starts] * self.seconds).astype('datetime64[s]')
+        resampled['Open'] = bars['Open'][starts]
+        resampled['High'] = np.fmax.reduceat(bars['High'], starts)
+        resampled['Low'] = np.fmin.reduceat(bars['Low'], starts)
+        resampled['Close'] = bars['Close'][ends]
+        resampled['Volume'] = np.add.reduceat(np.nan_to_num(bars['Volume']), starts)
+
+        self.pending = resampled[-1:].copy()
+        return resampled[:-1]
+
+    def flush(self):
+        """Return the open bucket (possibly incomplete) and reset."""
+        pending, self.pending = self.pending, np.empty(0, dtype=BAR_DTYPE)
+        return pending
+
+
+def resample_chunks(chunks, interval, include_partial=False):
+    """Yield resampled BAR_DTYPE chunks; the trailing open bucket is only emitted if include_partial."""
+    resampler = BarResampler(interval)
+    for chunk in chunks:
+        bars = resampler.push(chunk)
+        if len(bars):
+            yield bars
+    if include_partial:
+        bars = resampler.flush()
+        if len(bars):
+            yield bars
+
+
+# --- Ingestion ---
+
+def ingest(chunks, interval, model=None, include_partial=False, on_bars=None):
+    """Feed resampled bars into an OnlineMarkovModel chunk by chunk and return the model.
+
+    Bars at or before the model's last_bar_time are skipped, so a saved model can be resumed
+    from the same source. `on_bars` is called with every resampled chunk (e.g. to persist it).
+    """
+    model = model if model is not None else OnlineMarkovModel()
+    for bars in resample_chunks(chunks, interval, include_partial):
+        if model.last_bar_time is not None:
+            bars = bars[bars['time'] > np.datetime64(model.last_bar_time)]
+            if not len(bars):
+                continue
+        model.update_chunk(bars['Close'], bars['time'])
+        if on_bars is not None:
+            on_bars(bars)
+    return model
+
+
+def open_source(source, interval='1m', ticker=None, chunk_rows=CHUNK_ROWS):
+    """Chunk iterator for a .npy or .csv path, or the price cache when source == 'cache'."""
+    if source == 'cache':
+        from price_cache import cache_from_env
+        return iter_cached_bars(cache_from_env(), ticker, interval, chunk_rows)
+    if source.endswith('.csv'):
+        return iter_csv_bars(source, chunk_rows)
+    return iter_npy_bars(source, chunk_rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    source, interval = sys.argv[1], sys.argv[2]
+    ticker = sys.argv[3] if len(sys.argv) > 3 else 'BTC-USD'
+    # Cached raw bars are stored at their own resolution; read the finest one by default
+    raw_interval = os.getenv("RAW_BAR_INTERVAL", "1m")
+    started = time.perf_counter()
+    n_bars = [0]
+    model = ingest(open_source(source, raw_interval, ticker), interval,
+                   on_bars=lambda bars: n_bars.__setitem__(0, n_bars[0] + len(bars)))
+    metrics = model.metrics()
+    print(f"Ingested {n_bars[0]} {interval} bars in {time.perf_counter() - started:.2f}s "
+          f"(last bar {model.last_bar_time})")
+    if metrics[0] is not None:
+        print(f"  Current state: {metrics[2]}")
+        print(f"  Expected return over 30 bars: {metrics[7]:.4f}")
+        print(f"  Transition matrix:\n{np.round(metrics[1], 3)}")
@@ -0,0 +1,55 @@
+"""
+Benchmark of the Monte Carlo variance-reduction strategies.
+For every strategy, runs the adaptive simulator until the 95% confidence interval of each statistic
+is narrower than the target width and reports how many paths (and seconds) that took.
+Usage: python benchmark_variance_reduction.py [horizon_days] [seed]
+"""
+import sys
+import time
+import numpy as np
+from monte_carlo import VARIANCE_REDUCTION, run_variance_reduced_simulation
+
+# Mock-mode BTC chain from simplified_markov_model.py, started in the Neutral state
+TRANSITION_MATRIX = np.array([
+    [0.7, 0.2, 0.1],
+    [0.4, 0.5, 0.1],
+    [0.3, 0.4, 0.3]
+])
+STATE_MEANS = np.array([0.02, 0.003, -0.015])
+STATE_VOLS = np.array([0.04, 0.02, 0.05])
+START_STATE = 1
+TARGET_WEALTH = 1.1
+
+# Confidence-interval widths to reach for each statistic
+TARGET_WIDTHS = {'expected_return': 0.001, 'var': 0.002, 'prob_hit_target': 0.002}
+PATH_BUDGET = 20_000_000
+BATCH_PATHS = 4096
+
+
+def main():
+    horizon = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+
+    print(f"Horizon {horizon}d, budget {PATH_BUDGET:,} paths, batches of {BATCH_PATHS}")
+    for statistic, ci_width in TARGET_WIDTHS.items():
+        print(f"\n{statistic}: target 95% CI width {ci_width}")
+        print(f"{'strategy':<16}{'paths':>12}{'seconds':>10}{'estimate':>12}{'vs plain':>10}")
+        baseline = None
+        for strategy in VARIANCE_REDUCTION:
+            started = time.perf_counter()
+            summary = run_variance_reduced_simulation(
+                TRANSITION_MATRIX, STATE_MEANS, STATE_VOLS, START_STATE, horizon, PATH_BUDGET,
+                target_wealth=TARGET_WEALTH, strategy=strategy, ci_width=ci_width, statistic=statistic,
+                seed=seed, batch_paths=BATCH_PATHS)
+            elapsed = time.perf_counter() - started
+
+            # Paths needed scale with the squared CI width, so normalize runs that stopped early or late
+            paths_at_target = summary['n_paths'] * (summary['ci_width'] / ci_width) ** 2
+            baseline = baseline or paths_at_target
+            note = "" if summary['converged'] else " (budget hit)"
+            print(f"{strategy:<16}{summary['n_paths']:>12,}{elapsed:>10.2f}{summary[statistic]:>12.5f}"
+                  f"{baseline / paths_at_target:>9.1f}x{note}")
+
+
+if __name__ == "__main__":
+    main()
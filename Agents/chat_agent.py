@@ -43,6 +43,10 @@ class EnhancedPlanResponse(Model):
     trading_signal: str
     signal_strength: float
     reasoning: str
+    # Expected cumulative return and its standard deviation for holds of 1..time_horizon_days days
+    expected_return_curve: List[float] = []
+    risk_curve: List[float] = []
+    target_probability: float = 0.0  # P(reaching target_return within time_horizon_days)
 
 # --- Configuration ---
 load_dotenv()
@@ -0,0 +1,166 @@
+"""
+Markov chains over k return states with order-m histories, stored sparsely.
+A context is the last m state codes packed into one base-k integer (most recent code last).
+Only observed (context, next state) pairs are kept, as COO triples built with np.unique, so memory
+grows with the observed transitions instead of k^(m+1). Propagation runs over the observed contexts
+plus k first-order backoff states that absorb probability mass entering unseen contexts.
+"""
+import numpy as np
+from markov_kernels import STATES, MISSING, count_transitions, smoothed_transition_matrix
+from markov_uncertainty import POSTERIOR_DRAWS, dirichlet_posterior
+
+MAX_STATES = 127  # State codes are stored as int8
+
+
+def quantile_state_labels(n_states):
+    """State names from the highest return quantile down; 3 states keep the Bull/Neutral/Bear names."""
+    if n_states == len(STATES):
+        return list(STATES)
+    return [f"Q{n_states - i}" for i in range(n_states)]
+
+
+def classify_quantiles(returns, n_states):
+    """Map returns to codes 0..k-1 by empirical quantile, highest quantile first (missing returns -> -1)."""
+    returns = np.asarray(returns, dtype=float)
+    valid = ~np.isnan(returns)
+    edges = np.quantile(returns[valid], np.linspace(0, 1, n_states + 1)[1:-1])
+    codes = (n_states - 1 - np.searchsorted(edges, returns, side='right')).astype(np.int8)
+    codes[~valid] = MISSING
+    return codes
+
+
+def context_ids(codes, n_states, order):
+    """Packed id of the order-m history ending at every bar (-1 where the history has a missing code)."""
+    codes = np.asarray(codes, dtype=np.int64)
+    ids = np.full(len(codes), MISSING, dtype=np.int64)
+    if len(codes) < order:
+        return ids
+    windows = np.lib.stride_tricks.sliding_window_view(codes, order)
+    packed = windows @ (n_states ** np.arange(order - 1, -1, -1, dtype=np.int64))
+    packed[(windows < 0).any(axis=1)] = MISSING
+    ids[order - 1:] = packed
+    return ids
+
+
+class SparseMarkovChain:
+    """Order-m chain over k states with COO transition counts and vectorized horizon propagation."""
+
+    def __init__(self, n_states=len(STATES), order=1, alpha=0.1):
+        if not 2 <= n_states <= MAX_STATES:
+            raise ValueError(f"n_states must be between 2 and {MAX_STATES}")
+        if order < 1 or order * np.log2(n_states) >= 62:
+            raise ValueError(f"order {order} is out of range for {n_states} states")
+        self.n_states = n_states
+        self.order = order
+        self.alpha = alpha
+        self.n_contexts = n_states ** order  # Size of the full context space (never allocated)
+
+        # COO triples: one entry per observed (context, next state) pair
+        self.pair_contexts = np.zeros(0, dtype=np.int64)
+        self.pair_next = np.zeros(0, dtype=np.int64)
+        self.pair_counts = np.zeros(0)
+        self.contexts = np.zeros(0, dtype=np.int64)  # Sorted observed contexts (compact row index)
+        self.first_order_counts = np.zeros((n_states, n_states))
+        self.last_context = MISSING
+
+    def fit(self, codes):
+        """Count every (context, next state) pair in one np.unique pass."""
+        codes = np.asarray(codes, dtype=np.int64)
+        k = self.n_states
+        ids = context_ids(codes, k, self.order)
+        from_contexts, to_states = ids[:-1], codes[1:]
+        valid = (from_contexts >= 0) & (to_states >= 0)
+
+        keys, counts = np.unique(from_contexts[valid] * k + to_states[valid], return_counts=True)
+        self.pair_contexts = keys // k
+        self.pair_next = keys % k
+        self.pair_counts = counts.astype(float)
+        self.contexts = np.unique(self.pair_contexts)
+        self.first_order_counts = count_transitions(codes, k)
+
+        observed = ids[ids >= 0]
+        self.last_context = int(observed[-1]) if len(observed) else MISSING
+        return self
+
+    # --- Compact transition structure ---
+
+    @property
+    def n_observed(self):
+        return len(self.contexts)
+
+    def first_order_matrix(self):
+        return smoothed_transition_matrix(self.first_order_counts, self.alpha)
+
+    def state_index(self, context):
+        """Row of `context` in the compact structure; unseen contexts map to their last state's backoff row."""
+        context = np.asarray(context, dtype=np.int64)
+        position = np.searchsorted(self.contexts, context)
+        clipped = np.minimum(position, max(self.n_observed - 1, 0))
+        found = (position < self.n_observed) & (self.contexts[clipped] == context) if self.n_observed else False
+        return np.where(found, clipped, self.n_observed + context % self.n_states)
+
+    def row_counts(self):
+        """Next-state counts, shape (observed contexts + k backoff states, k)."""
+        counts = np.zeros((self.n_observed, self.n_states))
+        counts[np.searchsorted(self.contexts, self.pair_contexts), self.pair_next] = self.pair_counts
+        return np.vstack([counts, self.first_order_counts])
+
+    def transition_rows(self):
+        """Smoothed next-state probabilities, shape (observed contexts + k backoff states, k)."""
+        return smoothed_transition_matrix(self.row_counts(), self.alpha)
+
+    def successor_rows(self):
+        """Row reached after each next state, shape (observed contexts + k, k).
+
+        Observed contexts shift in the new code; backoff states only remember the last code,
+        so they stay in the backoff chain.
+        """
+        k = self.n_states
+        shifted = (self.contexts[:, None] * k + np.arange(k)) % self.n_contexts
+        backoff = np.broadcast_to(self.n_observed + np.arange(k), (k, k))
+        return np.vstack([self.state_index(shifted).reshape(-1, k), backoff])
+
+    # --- Prediction ---
+
+    def predict(self, context=None):
+        """Next-state distribution after `context` (default: the last observed history)."""
+        context = self.last_context if context is None else context
+        if context == MISSING:
+            return np.full(self.n_states, 1.0 / self.n_states)
+        return self.transition_rows()[self.state_index(context)]
+
+    def expected_cumulative_returns(self, state_return_values, horizon, probabilities=None):
+        """Expected sum of returns over `horizon` steps from every compact row at once.
+
+        Backward recursion v_h = r_bar + sum_s p(s) v_{h-1}[successor(s)], one gather per step.
+        `probabilities` may be a stack (..., rows, k) of alternative transition rows, e.g. posterior draws.
+        """
+        probabilities = self.transition_rows() if probabilities is None else probabilities
+        successors = self.successor_rows()
+        step_return = probabilities @ np.asarray(state_return_values, dtype=float)
+        values = np.zeros(probabilities.shape[:-1])
+        for _ in range(int(horizon)):
+            values = step_return + (probabilities * values[..., successors]).sum(axis=-1)
+        return values
+
+    def expected_return(self, state_return_values, horizon, context=None):
+        """Expected cumulative return over `horizon` steps from `context` (default: the last observed history)."""
+        context = self.last_context if context is None else context
+        values = self.expected_cumulative_returns(state_return_values, horizon)
+        if context == MISSING:
+            return float(values[self.n_observed:].mean())
+        return float(values[self.state_index(context)])
+
+    def expected_return_interval(self, state_return_values, horizon, n_draws=POSTERIOR_DRAWS,
+                                 confidence=0.95, context=None, rng=None):
+        """Posterior (mean, lower, upper) of the expected return from Dirichlet draws of every compact row."""
+        context = self.last_context if context is None else context
+        draws = dirichlet_posterior(self.row_counts(), n_draws, self.alpha, rng)
+        values = self.expected_cumulative_returns(state_return_values, horizon, draws)
+        if context == MISSING:
+            values = values[:, self.n_observed:].mean(axis=1)
+        else:
+            values = values[:, self.state_index(context)]
+        tail = (1 - confidence) / 2
+        lower, upper = np.quantile(values, [tail, 1 - tail])
+        return float(values.mean()), float(lower), float(upper)
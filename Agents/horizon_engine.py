@@ -0,0 +1,132 @@
+"""
+Closed-form multi-horizon expected returns for Markov regime chains.
+For a transition matrix P and per-state daily returns r, the expected cumulative return over
+H days from every starting state is S_H r with S_H = P + P^2 + ... + P^H. Because P is stochastic
+(I - P) is singular, so the geometric series is taken on the deviation P - Pi from the stationary
+projector Pi:
+
+    S_H = H Pi + (P - Pi) Z (I - P^H + Pi),   Z = (I - P + Pi)^-1   (the fundamental matrix)
+
+Every function accepts one chain (k, k) or a stack of chains (..., k, k) and returns values for
+all starting states at once.
+"""
+import numpy as np
+
+
+def stationary_distribution(transition_matrix):
+    """Stationary distribution pi (pi P = pi, sum(pi) = 1) for one or many ergodic chains."""
+    P = np.asarray(transition_matrix, dtype=float)
+    k = P.shape[-1]
+    # Solve (P^T - I) pi = 0 with the last equation replaced by the normalization constraint
+    A = np.swapaxes(P, -1, -2) - np.eye(k)
+    A[..., -1, :] = 1.0
+    b = np.zeros(P.shape[:-1])
+    b[..., -1] = 1.0
+    return np.linalg.solve(A, b[..., None])[..., 0]
+
+
+def fundamental_matrix(transition_matrix):
+    """Return (Pi, Z) where Pi has pi in every row and Z = (I - P + Pi)^-1."""
+    P = np.asarray(transition_matrix, dtype=float)
+    k = P.shape[-1]
+    pi = stationary_distribution(P)
+    Pi = np.broadcast_to(pi[..., None, :], P.shape)
+    Z = np.linalg.inv(np.eye(k) - P + Pi)
+    return Pi, Z
+
+
+def expected_return_at_horizon(transition_matrix, state_return_values, horizon):
+    """Expected cumulative return after `horizon` steps from each starting state, in O(log H).
+
+    Returns shape (..., k). Falls back to step-by-step propagation for non-ergodic chains.
+    """
+    P = np.asarray(transition_matrix, dtype=float)
+    r = np.asarray(state_return_values, dtype=float)
+    horizon = int(horizon)
+    if horizon <= 0:
+        return np.zeros(r.shape)
+
+    try:
+        Pi, Z = fundamental_matrix(P)
+    except np.linalg.LinAlgError:
+        return expected_return_curve(P, r, horizon)[..., -1, :]
+
+    k = P.shape[-1]
+    P_H = np.linalg.matrix_power(P, horizon)
+    deviation = (P - Pi) @ Z @ (np.eye(k) - P_H + Pi)
+    gain = (Pi @ r[..., None])[..., 0]
+    return horizon * gain + (deviation @ r[..., None])[..., 0]
+
+
+def expected_return_curve(transition_matrix, state_return_values, max_horizon):
+    """Expected cumulative return for every horizon 1..max_horizon and every starting state.
+
+    Returns shape (..., max_horizon, k): entry [h - 1, i] is the expected sum of returns over h days
+    starting in state i. Uses one batched mat-vec per horizon (cached powers P^h r).
+    """
+    P = np.asarray(transition_matrix, dtype=float)
+    r = np.asarray(state_return_values, dtype=float)
+    step = r
+    daily = np.empty(r.shape[:-1] + (max_horizon, r.shape[-1]))
+    for h in range(max_horizon):
+        step = (P @ step[..., None])[..., 0]  # P^(h+1) r
+        daily[..., h, :] = step
+    return np.cumsum(daily, axis=-2)
+
+
+def expected_return_for_state(transition_matrix, state_return_values, start_state, horizon):
+    """Expected cumulative return from given starting state(s); batched over leading axes."""
+    per_state = expected_return_at_horizon(transition_matrix, state_return_values, horizon)
+    start_state = np.asarray(start_state)
+    return np.take_along_axis(per_state, start_state[..., None], axis=-1)[..., 0]
+
+
+def return_moments_curve(transition_matrix, state_return_values, state_variances, start_state, max_horizon):
+    """Mean and variance of the cumulative return for every horizon 1..max_horizon from given start state(s).
+
+    Daily returns are r_j plus independent noise of variance v_j in state j. With d_h the state
+    distribution after h days and a_h[j] = E[S_h; X_h = j], the row vector (d, a, E[S], E[S^2])
+    evolves by one fixed (2k+2)-square matrix B:
+
+        d_h = d P,   a_h = a P + d P diag(r),   E[S_h] += d P r,   E[S_h^2] += 2 a P r + d P (r^2 + v)
+
+    Horizons are blocked as h = aL + b with L ~ sqrt(H): B^1..B^L and the block starts z_0 (B^L)^a
+    take about 2 sqrt(H) small matmuls, then one batched product yields every horizon.
+    Returns two arrays of shape (..., max_horizon).
+    """
+    P = np.asarray(transition_matrix, dtype=float)
+    r = np.asarray(state_return_values, dtype=float)
+    v = np.asarray(state_variances, dtype=float)
+    k = P.shape[-1]
+    lead = P.shape[:-2]
+    n = 2 * k + 2
+    Pr = (P @ r[..., None])[..., 0]
+    Pq = (P @ (r * r + v)[..., None])[..., 0]
+    B = np.zeros(lead + (n, n))
+    B[..., :k, :k] = P
+    B[..., :k, k:2 * k] = P * r[..., None, :]
+    B[..., k:2 * k, k:2 * k] = P
+    B[..., :k, 2 * k] = Pr
+    B[..., :k, 2 * k + 1] = Pq
+    B[..., k:2 * k, 2 * k + 1] = 2 * Pr
+    B[..., 2 * k, 2 * k] = B[..., 2 * k + 1, 2 * k + 1] = 1.0
+
+    # Only the two moment columns of B^b are needed to read off horizon aL + b
+    L = max(1, int(np.ceil(np.sqrt(max_horizon))))
+    moment_columns = np.empty(lead + (n, L, 2))
+    power = B
+    for b in range(L):
+        moment_columns[..., b, :] = power[..., 2 * k:]
+        if b < L - 1:
+            power = power @ B
+    n_blocks = -(-max_horizon // L)
+    block_starts = np.empty(lead + (n_blocks, n))
+    z = np.zeros(lead + (1, n))
+    np.put_along_axis(z[..., 0, :], np.asarray(start_state)[..., None], 1.0, axis=-1)
+    for a in range(n_blocks):
+        block_starts[..., a, :] = z[..., 0, :]
+        z = z @ power  # power is B^L after the loop above
+
+    moments = (block_starts @ moment_columns.reshape(lead + (n, 2 * L))).reshape(lead + (n_blocks * L, 2))
+    mean = moments[..., :max_horizon, 0]
+    return mean, np.maximum(moments[..., :max_horizon, 1] - mean * mean, 0.0)
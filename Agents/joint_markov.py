@@ -0,0 +1,193 @@
+"""
+Joint regime chain over a basket of assets, so correlated moves such as BTC and ETH entering
+Bear together are modelled instead of treating each asset's chain as independent.
+A joint state packs every asset's code into one base-k integer (first asset most significant),
+giving k^A states. Only observed (joint state, next joint state) pairs are stored, as COO triples,
+and smoothing is applied arithmetically, so no k^A x k^A matrix is ever built. Every row gets the
+same total prior mass as one asset's chain (alpha * k), spread evenly over the k^A successors, so
+large baskets are not swamped by pseudo-counts. Forecasts propagate
+a k^A probability vector; marginal and conditional queries sum it over the other assets' axes.
+"""
+import numpy as np
+from markov_kernels import STATES, MISSING
+
+MAX_FORECAST_STATES = 3 ** 15  # Largest joint space whose probability vector forecasts may allocate
+
+
+def joint_ids(codes, n_states):
+    """Packed joint state of every bar for an (assets, time) code block (-1 where any asset is missing)."""
+    codes = np.atleast_2d(np.asarray(codes, dtype=np.int64))
+    weights = n_states ** np.arange(len(codes) - 1, -1, -1, dtype=np.int64)
+    ids = weights @ codes
+    ids[(codes < 0).any(axis=0)] = MISSING
+    return ids
+
+
+def decode_joint(ids, n_assets, n_states):
+    """Per-asset codes of packed joint states: shape ids.shape + (n_assets,), int8."""
+    ids = np.asarray(ids, dtype=np.int64)
+    weights = n_states ** np.arange(n_assets - 1, -1, -1, dtype=np.int64)
+    return ((ids[..., None] // weights) % n_states).astype(np.int8)
+
+
+class JointMarkovChain:
+    """First-order chain over the product state space of a basket, with sparse counts."""
+
+    def __init__(self, n_assets, n_states=len(STATES), alpha=0.1):
+        if n_assets < 1 or 2 * n_assets * np.log2(n_states) >= 62:
+            raise ValueError(f"{n_assets} assets with {n_states} states is out of range")
+        self.n_assets = n_assets
+        self.n_states = n_states
+        self.alpha = alpha
+        self.n_joint = n_states ** n_assets
+        self.row_prior = alpha * n_states
+        self.cell_prior = self.row_prior / self.n_joint
+
+        # COO triples sorted by source state, plus the per-source totals of the observed rows
+        self.pair_from = np.zeros(0, dtype=np.int64)
+        self.pair_to = np.zeros(0, dtype=np.int64)
+        self.pair_counts = np.zeros(0)
+        self.row_states = np.zeros(0, dtype=np.int64)
+        self.row_totals = np.zeros(0)  # Times each observed source state was left
+        self.row_starts = np.zeros(0, dtype=np.int64)
+        self.last_state = MISSING
+
+    def fit(self, codes):
+        """Count joint transitions of an (assets, time) code block in one np.unique pass."""
+        codes = np.atleast_2d(np.asarray(codes))
+        if len(codes) != self.n_assets:
+            raise ValueError(f"expected {self.n_assets} assets, got {len(codes)}")
+        ids = joint_ids(codes, self.n_states)
+        from_ids, to_ids = ids[:-1], ids[1:]
+        valid = (from_ids >= 0) & (to_ids >= 0)
+
+        keys, counts = np.unique(from_ids[valid] * self.n_joint + to_ids[valid], return_counts=True)
+        self.pair_from = keys // self.n_joint
+        self.pair_to = keys % self.n_joint
+        self.pair_counts = counts.astype(float)
+        self.row_states, self.row_starts = np.unique(self.pair_from, return_index=True)
+        self.row_totals = np.add.reduceat(self.pair_counts, self.row_starts) if len(keys) else np.zeros(0)
+        observed = ids[ids >= 0]
+        self.last_state = int(observed[-1]) if len(observed) else MISSING
+        return self
+
+    @property
+    def n_observed_states(self):
+        return len(self.row_states)
+
+    @property
+    def n_observed_transitions(self):
+        return len(self.pair_counts)
+
+    def encode(self, codes):
+        """Packed id of one joint state given its per-asset codes."""
+        return int(joint_ids(np.asarray(codes).reshape(-1, 1), self.n_states)[0])
+
+    # --- Transition Probabilities ---
+
+    def _lookup_rows(self, states):
+        """(observed row total, row position, observed?) for each source state."""
+        states = np.asarray(states, dtype=np.int64)
+        if not len(self.row_states):
+            return np.zeros(states.shape), np.zeros(states.shape, dtype=np.int64), np.zeros(states.shape, dtype=bool)
+        position = np.minimum(np.searchsorted(self.row_states, states), len(self.row_states) - 1)
+        found = self.row_states[position] == states
+        return np.where(found, self.row_totals[position], 0.0), position, found
+
+    def transition_probability(self, from_state, to_state):
+        """Smoothed P(next joint state | joint state): (count + cell prior) / (row total + row prior)."""
+        totals, _, _ = self._lookup_rows([from_state])
+        key = from_state * self.n_joint + to_state
+        keys = self.pair_from * self.n_joint + self.pair_to
+        i = np.searchsorted(keys, key)
+        count = self.pair_counts[i] if i < len(keys) and keys[i] == key else 0.0
+        return float((count + self.cell_prior) / (totals[0] + self.row_prior))
+
+    def marginal_transition_counts(self, asset):
+        """k x k transition counts of one asset, summed over the others (bars where every asset has data)."""
+        k = self.n_states
+        digits_from = decode_joint(self.pair_from, self.n_assets, k)[:, asset]
+        digits_to = decode_joint(self.pair_to, self.n_assets, k)[:, asset]
+        flat = np.bincount(digits_from.astype(np.int64) * k + digits_to, weights=self.pair_counts, minlength=k * k)
+        return flat.reshape(k, k)
+
+    # --- Forecasts And Queries ---
+
+    def step(self, distribution):
+        """One step of p' = p P for a dense k^A probability vector, using only the observed pairs.
+
+        Row i of P is (c_i + a / K) / (n_i + a), so p P = (p / (n + a)) C + sum(p / (n + a)) / K * a.
+        """
+        totals = np.zeros(self.n_joint)
+        totals[self.row_states] = self.row_totals
+        scaled = distribution / (totals + self.row_prior)
+        nxt = np.bincount(self.pair_to, weights=scaled[self.pair_from] * self.pair_counts, minlength=self.n_joint)
+        return nxt + self.cell_prior * scaled.sum()
+
+    def forecast(self, start, horizon=1):
+        """Joint state distribution after `horizon` steps from a joint state id or a probability vector."""
+        if self.n_joint > MAX_FORECAST_STATES:
+            raise ValueError(f"joint space of {self.n_joint} states is too large to forecast")
+        if np.ndim(start) == 0:
+            distribution = np.zeros(self.n_joint)
+            distribution[int(start)] = 1.0
+        else:
+            distribution = np.asarray(start, dtype=float)
+        for _ in range(horizon):
+            distribution = self.step(distribution)
+        return distribution
+
+    def marginal(self, distribution, assets):
+        """Distribution over the states of `assets` (in the given order): shape (k,) * len(assets)."""
+        assets = [assets] if np.ndim(assets) == 0 else list(assets)
+        grid = np.asarray(distribution).reshape((self.n_states,) * self.n_assets)
+        others = tuple(a for a in range(self.n_assets) if a not in assets)
+        kept = sorted(assets)
+        return np.moveaxis(grid.sum(axis=others), [kept.index(a) for a in assets], range(len(assets)))
+
+    def occupancy_distribution(self, given=None):
+        """Empirical distribution of joint states, optionally restricted to those matching {asset: code}."""
+        weights = self.row_totals.copy()
+        if given:
+            digits = decode_joint(self.row_states, self.n_assets, self.n_states)
+            for asset, code in given.items():
+                weights[digits[:, asset] != code] = 0.0
+        distribution = np.zeros(self.n_joint)
+        distribution[self.row_states] = weights
+        total = distribution.sum()
+        return distribution / total if total > 0 else None
+
+    def conditional_probability(self, target_asset, target_code, given, horizon=1):
+        """P(target asset in target_code after `horizon` steps | given {asset: code} today).
+
+        Joint states consistent with `given` are weighted by how often they were observed; returns
+        None if no such state was ever observed.
+        """
+        start = self.occupancy_distribution(given)
+        if start is None:
+            return None
+        return float(self.marginal(self.forecast(start, horizon), [target_asset])[target_code])
+
+    # --- Simulation ---
+
+    def simulate(self, start, horizon, n_paths, rng=None):
+        """Sample joint state paths, shape (n_paths, horizon), all paths advanced together per step.
+
+        Each step picks an observed successor with probability n_i / (n_i + row prior), located by a
+        searchsorted over the cumulative pair counts, and otherwise a uniformly random joint state.
+        """
+        rng = np.random.default_rng(rng)
+        cumulative = np.cumsum(self.pair_counts)
+        row_base = np.concatenate([[0.0], cumulative])[self.row_starts] if len(self.row_starts) else np.zeros(0)
+        paths = np.empty((n_paths, horizon), dtype=np.int64)
+        current = np.full(n_paths, int(start), dtype=np.int64)
+        for t in range(horizon):
+            totals, position, found = self._lookup_rows(current)
+            draw = rng.random(n_paths) * (totals + self.row_prior)
+            observed = found & (draw < totals)
+            nxt = rng.integers(0, self.n_joint, size=n_paths)
+            if observed.any():
+                pair = np.searchsorted(cumulative, row_base[position[observed]] + draw[observed], side='right')
+                nxt[observed] = self.pair_to[pair]
+            paths[:, t] = current = nxt
+        return paths
@@ -0,0 +1,224 @@
+"""
+Vectorized NumPy kernels shared by the Markov model agent and the markovChain research script.
+States are stored as small integer codes; every kernel accepts a single return series
+or a 2-D block of series (one row per asset) so many assets can be processed in one call.
+"""
+import warnings
+import numpy as np
+from horizon_engine import expected_return_for_state
+from markov_uncertainty import transition_confidence, expected_return_interval
+
+# --- State Definitions ---
+STATES = ['Bull', 'Neutral', 'Bear']
+BULL, NEUTRAL, BEAR = 0, 1, 2
+MISSING = -1  # Code used for days without a return (e.g. the first bar)
+
+
+def classify_returns(returns, bull_threshold, bear_threshold):
+    """Map returns to integer state codes (Bull=0, Neutral=1, Bear=2, missing=-1).
+
+    `returns` may be 1-D or 2-D (assets x time). Thresholds are scalars or one value per row.
+    A return equal to a threshold is Neutral, exactly like the original per-day rule.
+    """
+    returns = np.asarray(returns, dtype=float)
+    squeeze = returns.ndim == 1
+    block = np.atleast_2d(returns)
+
+    bull = np.asarray(bull_threshold, dtype=float).reshape(-1, 1)
+    bear = np.asarray(bear_threshold, dtype=float).reshape(-1, 1)
+
+    # Rank each return against the (bear, bull) edges: 0 below bear, 1 inside, 2 above bull
+    rank = (block >= bear).astype(np.int8) + (block > bull)
+    codes = (BEAR - rank).astype(np.int8)
+    codes[np.isnan(block)] = MISSING
+
+    return codes[0] if squeeze else codes
+
+
+def count_transitions(codes, n_states=len(STATES)):
+    """Count state-to-state transitions with a single bincount.
+
+    `codes` is 1-D (returns an n_states x n_states matrix) or 2-D assets x time
+    (returns an assets x n_states x n_states block). Pairs touching a missing code are skipped.
+    """
+    codes = np.asarray(codes)
+    squeeze = codes.ndim == 1
+    block = np.atleast_2d(codes).astype(np.int64)
+    n_assets = block.shape[0]
+
+    from_states = block[:, :-1]
+    to_states = block[:, 1:]
+    valid = (from_states >= 0) & (to_states >= 0)
+
+    asset_offset = (np.arange(n_assets, dtype=np.int64) * n_states * n_states)[:, None]
+    flat_index = asset_offset + from_states * n_states + to_states
+
+    counts = np.bincount(flat_index[valid], minlength=n_assets * n_states * n_states)
+    counts = counts.reshape(n_assets, n_states, n_states).astype(float)
+
+    return counts[0] if squeeze else counts
+
+
+def state_return_stats(codes, returns, n_states=len(STATES)):
+    """Per-state mean and sample standard deviation of returns, computed with weighted bincounts.
+
+    Returns (counts, means, stds) shaped (n_states,) for 1-D input or (assets, n_states) for 2-D.
+    States that never occur get NaN means; states with fewer than two samples get NaN stds.
+    """
+    codes = np.asarray(codes)
+    squeeze = codes.ndim == 1
+    block_codes = np.atleast_2d(codes).astype(np.int64)
+    block_returns = np.atleast_2d(np.asarray(returns, dtype=float))
+    n_assets = block_codes.shape[0]
+
+    valid = (block_codes >= 0) & ~np.isnan(block_returns)
+    flat_index = (np.arange(n_assets, dtype=np.int64)[:, None] * n_states + block_codes)[valid]
+    values = block_returns[valid]
+    size = n_assets * n_states
+
+    counts = np.bincount(flat_index, minlength=size).astype(float)
+    sums = np.bincount(flat_index, weights=values, minlength=size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        deviations = values - means[flat_index]
+        sq_dev = np.bincount(flat_index, weights=deviations * deviations, minlength=size)
+        stds = np.sqrt(sq_dev / (counts - 1))
+    stds[counts < 2] = np.nan
+
+    shape = (n_assets, n_states)
+    counts, means, stds = counts.reshape(shape), means.reshape(shape), stds.reshape(shape)
+    if squeeze:
+        return counts[0], means[0], stds[0]
+    return counts, means, stds
+
+
+def smoothed_transition_matrix(transition_counts, alpha=0.1):
+    """Row-normalize counts with additive (Laplace) smoothing; works on stacked matrices too."""
+    transition_counts = np.asarray(transition_counts, dtype=float)
+    n_states = transition_counts.shape[-1]
+    row_sums = transition_counts.sum(axis=-1, keepdims=True)
+    return (transition_counts + alpha) / (row_sums + alpha * n_states)
+
+
+# --- Shared Metric Formulas ---
+
+def regime_thresholds(returns_mean, returns_std, recent_volatility, min_multiplier=0.5, max_multiplier=2.0):
+    """Bull/bear return thresholds widened or narrowed by recent volatility (scalars or arrays)."""
+    volatility_multiplier = np.clip(np.asarray(recent_volatility) / returns_std, min_multiplier, max_multiplier)
+    bull_threshold = returns_mean + (returns_std * volatility_multiplier)
+    bear_threshold = returns_mean - (returns_std * volatility_multiplier)
+    return bull_threshold, bear_threshold
+
+
+def momentum_from_sma(sma_20, sma_50):
+    """Trend momentum in [-1, 1] from the SMA-20/SMA-50 spread (0 while either average is undefined)."""
+    sma_20 = np.asarray(sma_20, dtype=float)
+    sma_50 = np.asarray(sma_50, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spread = sma_20 / sma_50 - 1
+        momentum = np.select(
+            [sma_20 > sma_50 * 1.02,   # Strong uptrend
+             sma_20 < sma_50 * 0.98],  # Strong downtrend
+            [np.minimum(1.0, spread * 10), np.maximum(-1.0, spread * 10)],
+            spread * 5                 # Sideways
+        )
+    momentum = np.where(np.isnan(spread), 0.0, momentum)
+    return float(momentum) if momentum.ndim == 0 else momentum
+
+
+def expected_cumulative_return(transition_matrix, state_return_values, start_state, days=30):
+    """Expected sum of daily returns over `days` steps when starting from `start_state`.
+
+    Accepts one chain or stacked chains: matrices (assets, k, k), returns (assets, k), starts (assets,).
+    Evaluated in closed form by the horizon engine, so the cost does not grow with `days`.
+    """
+    transition_matrix = np.asarray(transition_matrix, dtype=float)
+    expected_return = expected_return_for_state(transition_matrix, state_return_values, start_state, days)
+    return float(expected_return) if transition_matrix.ndim == 2 else expected_return
+
+
+# --- Multi-Asset Block Analysis ---
+
+def right_align(series_list, length=None):
+    """Stack 1-D series into an (assets, length) block aligned on their last value, NaN-padded on the left."""
+    length = length or max((len(series) for series in series_list), default=0)
+    block = np.full((len(series_list), length), np.nan)
+    for row, series in enumerate(series_list):
+        values = np.asarray(series, dtype=float)[-length:]
+        if len(values):
+            block[row, length - len(values):] = values
+    return block
+
+
+def _last_valid(block):
+    """Last non-missing code per row (MISSING if a row has none)."""
+    valid = block >= 0
+    last_idx = block.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    last = block[np.arange(len(block)), last_idx]
+    return np.where(valid.any(axis=1), last, MISSING)
+
+
+def enhanced_metrics_block(closes, alpha=0.1, horizon_days=30):
+    """Compute every EnhancedMatrixResponse metric for an (assets, time) block of right-aligned closes.
+
+    Returns a dict of arrays indexed by asset row. Rows with fewer than 30 returns are flagged in 'valid'.
+    """
+    closes = np.atleast_2d(np.asarray(closes, dtype=float))
+    n_assets, length = closes.shape
+    n_states = len(STATES)
+
+    returns = np.full(closes.shape, np.nan)
+    returns[:, 1:] = closes[:, 1:] / closes[:, :-1] - 1
+    n_returns = (~np.isnan(returns)).sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        returns_mean = np.nanmean(returns, axis=1)
+        returns_std = np.nanstd(returns, axis=1, ddof=1)
+
+        # Rolling SMA-20/50 at the last bar and Volatility_20 over the last 20 bars
+        sma_20 = closes[:, -20:].mean(axis=1) if length >= 20 else np.full(n_assets, np.nan)
+        sma_50 = closes[:, -50:].mean(axis=1) if length >= 50 else np.full(n_assets, np.nan)
+        tail = returns[:, -39:]
+        if tail.shape[1] >= 20:
+            windows = np.lib.stride_tricks.sliding_window_view(tail, 20, axis=1)
+            rolling_vol = windows.std(axis=-1, ddof=1)
+            recent_volatility = np.nanmean(rolling_vol, axis=1)
+        else:
+            recent_volatility = np.full(n_assets, np.nan)
+
+        bull_threshold, bear_threshold = regime_thresholds(returns_mean, returns_std, recent_volatility)
+        codes = classify_returns(returns, bull_threshold, bear_threshold)
+        transition_counts = count_transitions(codes, n_states)
+        transition_matrix = smoothed_transition_matrix(transition_counts, alpha)
+
+        state_counts, state_means, state_stds = state_return_stats(codes, returns, n_states)
+        state_means = np.where(state_counts > 0, state_means, 0.0)
+        state_stds = np.where(state_counts > 1, state_stds, returns_std[:, None])
+
+        last_state = _last_valid(codes)
+        start_state = np.where(last_state == MISSING, NEUTRAL, last_state)
+        expected_return = expected_cumulative_return(transition_matrix, state_means, start_state, horizon_days)
+        _, expected_return_low, expected_return_high = expected_return_interval(
+            transition_counts, state_means, start_state, horizon_days, alpha=alpha)
+
+        risk_score = np.minimum(1.0, recent_volatility / (returns_std * 2))
+        recent_returns = np.nanmean(returns[:, -30:], axis=1)
+        relative_strength = np.where(returns_mean != 0, recent_returns / np.abs(returns_mean), 0.0)
+
+    return {
+        'valid': n_returns >= 30,
+        'state_codes': codes,
+        'transition_counts': transition_counts,
+        'transition_matrix': transition_matrix,
+        'state_returns': state_means,
+        'state_volatility': state_stds,
+        'last_state': start_state,
+        'trend_momentum': momentum_from_sma(sma_20, sma_50),
+        'confidence_score': transition_confidence(transition_counts),
+        'expected_return': expected_return,
+        'expected_return_interval': np.stack([expected_return_low, expected_return_high], axis=-1),
+        'risk_score': risk_score,
+        'relative_strength': relative_strength,
+    }
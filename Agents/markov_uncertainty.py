@@ -0,0 +1,73 @@
+"""
+Parameter uncertainty for estimated transition matrices.
+Wilson score intervals are computed for every cell of one matrix or a stack of matrices in a single
+array expression, and Dirichlet posterior draws propagate the counting noise into multi-day expected returns.
+"""
+import numpy as np
+from statistics import NormalDist
+from horizon_engine import expected_return_for_state
+
+POSTERIOR_DRAWS = 2000
+
+
+def wilson_intervals(transition_counts, confidence=0.95):
+    """Wilson score interval for every transition probability.
+
+    `transition_counts` is (..., k, k); returns (..., k, k, 2) with lower and upper bounds.
+    Rows without any observed transition get the uninformative interval [0, 1].
+    """
+    counts = np.asarray(transition_counts, dtype=float)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    n = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = counts / n
+        denominator = 1 + z * z / n
+        centre = (p + z * z / (2 * n)) / denominator
+        delta = z * np.sqrt((p * (1 - p) + z * z / (4 * n)) / n) / denominator
+    lower = np.where(n > 0, np.clip(centre - delta, 0.0, 1.0), 0.0)
+    upper = np.where(n > 0, np.clip(centre + delta, 0.0, 1.0), 1.0)
+    return np.stack([lower, upper], axis=-1)
+
+
+def transition_confidence(transition_counts, confidence=0.95):
+    """Confidence in [0, 1]: one minus the mean Wilson interval width, weighted by transitions observed per row."""
+    counts = np.asarray(transition_counts, dtype=float)
+    intervals = wilson_intervals(counts, confidence)
+    widths = intervals[..., 1] - intervals[..., 0]
+    row_weights = np.broadcast_to(counts.sum(axis=-1, keepdims=True), widths.shape)
+    total = row_weights.sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_width = (widths * row_weights).sum(axis=(-2, -1)) / total
+    score = np.where(total > 0, 1.0 - mean_width, 0.0)
+    return float(score) if score.ndim == 0 else score
+
+
+def dirichlet_posterior(transition_counts, n_draws=POSTERIOR_DRAWS, alpha=0.1, rng=None):
+    """Draw transition matrices from the Dirichlet(counts + alpha) posterior of every row.
+
+    Returns (n_draws, ..., k, k); the draws use normalized Gamma variates, so all rows of all
+    assets are sampled in one call.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    counts = np.asarray(transition_counts, dtype=float)
+    gammas = rng.standard_gamma(counts + alpha, size=(n_draws,) + counts.shape)
+    return gammas / gammas.sum(axis=-1, keepdims=True)
+
+
+def expected_return_interval(transition_counts, state_return_values, start_state, horizon=30,
+                             n_draws=POSTERIOR_DRAWS, alpha=0.1, confidence=0.95, rng=None):
+    """Posterior mean and equal-tailed interval of the expected cumulative return over `horizon` days.
+
+    Accepts one chain or a batch: counts (..., k, k), returns (..., k), starts (...).
+    Returns (mean, lower, upper), each a float for one chain or an array for a batch.
+    """
+    draws = dirichlet_posterior(transition_counts, n_draws, alpha, rng)
+    state_return_values = np.broadcast_to(state_return_values, draws.shape[:-1])
+    start_state = np.broadcast_to(start_state, draws.shape[:-2])
+    values = expected_return_for_state(draws, state_return_values, start_state, horizon)
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(values, [tail, 1 - tail], axis=0)
+    mean = values.mean(axis=0)
+    if np.ndim(mean) == 0:
+        return float(mean), float(lower), float(upper)
+    return mean, lower, upper
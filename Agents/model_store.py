@@ -0,0 +1,124 @@
+"""
+Compact array-backed store of fitted regime chains for large asset universes.
+One store holds every asset of a batch in contiguous arrays: float32 (assets, k, k) transition
+matrices and counts, float32 (assets, k) state returns and volatilities, int8 state codes and one
+structured array of scalar metrics. AssetRow records map tickers to rows; per-asset dicts and
+lists are only built by result() when a message is sent.
+"""
+import numpy as np
+from markov_kernels import STATES, MISSING
+
+# Scalar metrics per asset, in EnhancedMatrixResponse field order
+METRIC_DTYPE = np.dtype([
+    ('trend_momentum', 'f4'),
+    ('confidence_score', 'f4'),
+    ('expected_return_30d', 'f4'),
+    ('expected_return_30d_low', 'f4'),
+    ('expected_return_30d_high', 'f4'),
+    ('risk_score', 'f4'),
+    ('relative_strength', 'f4'),
+])
+
+
+class AssetRow:
+    """Reference to one asset's row of a ModelStore; cheap to cache and share."""
+    __slots__ = ('store', 'row', 'ticker', 'name')
+
+    def __init__(self, store, row, ticker, name):
+        self.store = store
+        self.row = row
+        self.ticker = ticker
+        self.name = name
+
+    def result(self):
+        return self.store.result(self.row)
+
+    def __repr__(self):
+        return f"AssetRow({self.ticker!r}, row={self.row})"
+
+
+class ModelStore:
+    """Fixed-capacity columnar store; rows are filled from an enhanced_metrics_block or analysis tuples."""
+
+    def __init__(self, capacity, states=STATES, history=0):
+        n_states = len(states)
+        self.states = list(states)
+        self.transition_matrix = np.zeros((capacity, n_states, n_states), dtype=np.float32)
+        self.transition_counts = np.zeros((capacity, n_states, n_states), dtype=np.float32)
+        self.state_returns = np.zeros((capacity, n_states), dtype=np.float32)
+        self.state_volatility = np.zeros((capacity, n_states), dtype=np.float32)
+        self.last_state = np.full(capacity, MISSING, dtype=np.int8)
+        self.metrics = np.zeros(capacity, dtype=METRIC_DTYPE)
+        self.state_codes = np.full((capacity, history), MISSING, dtype=np.int8)  # Right-aligned history
+        self.index = {}  # ticker -> AssetRow
+        self.size = 0
+
+    @classmethod
+    def from_block(cls, tickers, names, block, rows=None):
+        """Store the given rows (default: the valid ones) of an enhanced_metrics_block."""
+        rows = np.flatnonzero(block['valid']) if rows is None else np.asarray(rows)
+        codes = block.get('state_codes')
+        store = cls(len(rows), history=0 if codes is None else codes.shape[1])
+        n = len(rows)
+        store.transition_matrix[:n] = block['transition_matrix'][rows]
+        store.transition_counts[:n] = block['transition_counts'][rows]
+        store.state_returns[:n] = block['state_returns'][rows]
+        store.state_volatility[:n] = block['state_volatility'][rows]
+        store.last_state[:n] = block['last_state'][rows]
+        if codes is not None:
+            store.state_codes[:n] = codes[rows]
+        metrics = store.metrics[:n]
+        metrics['trend_momentum'] = block['trend_momentum'][rows]
+        metrics['confidence_score'] = block['confidence_score'][rows]
+        metrics['expected_return_30d'] = block['expected_return'][rows]
+        metrics['expected_return_30d_low'] = block['expected_return_interval'][rows, 0]
+        metrics['expected_return_30d_high'] = block['expected_return_interval'][rows, 1]
+        metrics['risk_score'] = block['risk_score'][rows]
+        metrics['relative_strength'] = block['relative_strength'][rows]
+        for i, row in enumerate(rows):
+            store.index[tickers[row]] = AssetRow(store, i, tickers[row], names[row])
+        store.size = n
+        return store
+
+    def add(self, ticker, name, result):
+        """Append one analysis tuple (as returned by get_enhanced_transition_matrix) and return its AssetRow."""
+        (states, matrix, last_state, state_returns, state_volatility, trend_momentum, confidence_score,
+         expected_return_30d, risk_score, relative_strength, (low_30d, high_30d)) = result
+        i = self.size
+        self.transition_matrix[i] = matrix
+        self.state_returns[i] = [state_returns[state] for state in self.states]
+        self.state_volatility[i] = [state_volatility[state] for state in self.states]
+        self.last_state[i] = self.states.index(last_state)
+        self.metrics[i] = (trend_momentum, confidence_score, expected_return_30d, low_30d, high_30d,
+                           risk_score, relative_strength)
+        self.index[ticker] = AssetRow(self, i, ticker, name)
+        self.size += 1
+        return self.index[ticker]
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, ticker):
+        return ticker in self.index
+
+    def __getitem__(self, ticker):
+        return self.index[ticker]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.transition_matrix, self.transition_counts, self.state_returns,
+                                              self.state_volatility, self.last_state, self.metrics, self.state_codes))
+
+    # --- Message Boundary ---
+
+    def result(self, row):
+        """The analysis tuple for one row, with Python floats and per-state dicts for the message models."""
+        metrics = self.metrics[row]
+        states = list(self.states)
+        return (states, self.transition_matrix[row].astype(float), states[self.last_state[row]],
+                dict(zip(states, self.state_returns[row].tolist())),
+                dict(zip(states, self.state_volatility[row].tolist())),
+                float(metrics['trend_momentum']), float(metrics['confidence_score']),
+                float(metrics['expected_return_30d']), float(metrics['risk_score']),
+                float(metrics['relative_strength']),
+                (float(metrics['expected_return_30d_low']), float(metrics['expected_return_30d_high'])))
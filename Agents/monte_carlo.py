@@ -0,0 +1,384 @@
+"""
+Vectorized Monte Carlo simulation of Markov regime paths.
+Paths are generated in chunks: each chunk pre-draws all of its uniforms and normals, and every
+step advances all paths at once with a cumulative-probability lookup instead of per-path
+np.random.choice. Only terminal wealth and target hits are kept, so memory stays bounded.
+Risk estimates can also be run in batches under antithetic, control-variate or scrambled Sobol
+sampling, optionally stopping once a requested confidence-interval width is reached.
+"""
+import threading
+import numpy as np
+from statistics import NormalDist
+from horizon_engine import expected_return_for_state
+
+QUANTILE_LEVELS = {'p01': 0.01, 'p05': 0.05, 'p25': 0.25, 'p50': 0.50, 'p75': 0.75, 'p95': 0.95, 'p99': 0.99}
+MAX_CHUNK_ELEMENTS = 4_000_000  # Pre-drawn random numbers per chunk (~64 MB for uniforms + normals)
+
+
+def cumulative_rows(transition_matrix):
+    """Row-wise CDF of a transition matrix with the last column pinned to exactly 1."""
+    cdf = np.cumsum(np.asarray(transition_matrix, dtype=float), axis=-1)
+    cdf[..., -1] = 1.0
+    return cdf
+
+
+def next_states(cdf, states, uniforms):
+    """Advance every path one step: the next state is the number of CDF entries below its uniform."""
+    return (uniforms[:, None] >= cdf[states]).sum(axis=1)
+
+
+def simulate_chunk(cdf, state_means, state_vols, start_state, uniforms, normals, target_wealth=None):
+    """Simulate one chunk of paths from pre-drawn (paths, horizon) uniforms and normals.
+
+    Returns (terminal_returns, hit_target, return_sums) where hit_target marks paths whose wealth
+    reached `target_wealth` (a gross multiple such as 1.1) at any step and return_sums is the
+    arithmetic sum of daily returns, the control variate used by variance reduction.
+    """
+    n_paths, horizon = uniforms.shape
+    states = np.full(n_paths, start_state, dtype=np.int64)
+    wealth = np.ones(n_paths)
+    return_sums = np.zeros(n_paths)
+    hit = np.zeros(n_paths, dtype=bool)
+
+    for step in range(horizon):
+        states = next_states(cdf, states, uniforms[:, step])
+        daily_returns = state_means[states] + state_vols[states] * normals[:, step]
+        return_sums += daily_returns
+        wealth *= 1.0 + np.maximum(daily_returns, -1.0)
+        if target_wealth is not None:
+            hit |= wealth >= target_wealth
+
+    return wealth - 1.0, hit, return_sums
+
+
+def simulate_paths(transition_matrix, state_means, state_vols, start_state, horizon, n_paths,
+                   target_wealth=None, rng=None, chunk_size=None):
+    """Simulate `n_paths` regime/return paths; returns (terminal_returns, hit_target) arrays."""
+    rng = rng if rng is not None else np.random.default_rng()
+    cdf = cumulative_rows(transition_matrix)
+    state_means = np.asarray(state_means, dtype=float)
+    state_vols = np.asarray(state_vols, dtype=float)
+
+    chunk_size = chunk_size or max(1, MAX_CHUNK_ELEMENTS // max(horizon, 1))
+    terminal = np.empty(n_paths)
+    hit = np.zeros(n_paths, dtype=bool)
+
+    for start in range(0, n_paths, chunk_size):
+        size = min(chunk_size, n_paths - start)
+        uniforms = rng.random((size, horizon))
+        normals = rng.standard_normal((size, horizon))
+        terminal[start:start + size], hit[start:start + size], _ = simulate_chunk(
+            cdf, state_means, state_vols, start_state, uniforms, normals, target_wealth)
+
+    return terminal, hit
+
+
+def summarize_terminal_returns(terminal, hit=None, var_level=0.95):
+    """Distribution summary: moments, quantiles, VaR/CVaR (as positive losses) and target hit probability."""
+    quantiles = np.quantile(terminal, list(QUANTILE_LEVELS.values()))
+    tail_cutoff = np.quantile(terminal, 1 - var_level)
+    tail = terminal[terminal <= tail_cutoff]
+    return {
+        'n_paths': int(len(terminal)),
+        'expected_return': float(terminal.mean()),
+        'return_std': float(terminal.std(ddof=1)) if len(terminal) > 1 else 0.0,
+        'quantiles': dict(zip(QUANTILE_LEVELS, quantiles.tolist())),
+        'var': float(-tail_cutoff),
+        'cvar': float(-tail.mean()) if len(tail) else float(-tail_cutoff),
+        'prob_hit_target': float(hit.mean()) if hit is not None else 0.0,
+    }
+
+
+def run_simulation(transition_matrix, state_means, state_vols, start_state, horizon, n_paths,
+                   target_wealth=None, seed=None, var_level=0.95):
+    """Simulate and summarize in one call."""
+    terminal, hit = simulate_paths(transition_matrix, state_means, state_vols, start_state, horizon,
+                                   n_paths, target_wealth, rng=np.random.default_rng(seed))
+    return summarize_terminal_returns(terminal, hit if target_wealth is not None else None, var_level)
+
+
+# --- Sharded Multi-Core Simulation ---
+
+SHARD_PATHS = 32_768    # Fixed shard size: results depend on the seed, never on the worker count
+HISTOGRAM_BINS = 4096
+_shard_pool = None
+_shard_pool_workers = 0
+_shard_pool_lock = threading.Lock()
+
+
+def log_wealth_range(state_means, state_vols, horizon, width=8.0):
+    """Deterministic histogram range for log(1 + terminal return), wide enough for any realistic path."""
+    log_means = np.log1p(np.clip(state_means, -0.99, None))
+    spread = width * float(np.max(state_vols)) * np.sqrt(horizon) + 1e-6
+    return horizon * float(np.min(log_means)) - spread, horizon * float(np.max(log_means)) + spread
+
+
+class SimulationStats:
+    """Mergeable sufficient statistics of terminal returns: moments, a fixed-edge histogram and hit counts.
+
+    The histogram is kept on log-wealth with per-bin value sums, which acts as the quantile
+    sketch for quantiles, VaR and CVaR. Merging is order-sensitive only in floating point, so
+    shards are always merged in shard order.
+    """
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.hits = 0
+        self.bin_counts = np.zeros(len(edges) + 1, dtype=np.int64)  # Includes under/overflow bins
+        self.bin_sums = np.zeros(len(edges) + 1)
+
+    @classmethod
+    def from_sample(cls, terminal, hit, edges):
+        stats = cls(edges)
+        stats.count = len(terminal)
+        if stats.count:
+            stats.mean = float(terminal.mean())
+            stats.m2 = float(((terminal - stats.mean) ** 2).sum())
+        stats.hits = int(hit.sum())
+        bins = np.searchsorted(edges, np.log(np.maximum(1.0 + terminal, 1e-300)), side='right')
+        stats.bin_counts = np.bincount(bins, minlength=len(edges) + 1).astype(np.int64)
+        stats.bin_sums = np.bincount(bins, weights=terminal, minlength=len(edges) + 1)
+        return stats
+
+    def merge(self, other):
+        """Chan et al. parallel update of the moments plus elementwise histogram addition."""
+        total = self.count + other.count
+        if total:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / total
+            self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.hits += other.hits
+        self.bin_counts += other.bin_counts
+        self.bin_sums += other.bin_sums
+        return self
+
+    def quantile(self, level):
+        """Quantile interpolated linearly in log-wealth inside the bin that contains it."""
+        target = level * self.count
+        cumulative = np.cumsum(self.bin_counts)
+        b = int(np.searchsorted(cumulative, target, side='left'))
+        b = min(b, len(self.bin_counts) - 1)
+        if b == 0 or b == len(self.edges):
+            # Out-of-range bins have no width; fall back to their mean value
+            return float(self.bin_sums[b] / max(self.bin_counts[b], 1))
+        before = cumulative[b - 1]
+        fraction = (target - before) / max(self.bin_counts[b], 1)
+        log_value = self.edges[b - 1] + fraction * (self.edges[b] - self.edges[b - 1])
+        return float(np.expm1(log_value))
+
+    def tail_mean(self, level):
+        """Mean of the worst `level` fraction of outcomes (whole bins plus a pro-rata share of the boundary bin)."""
+        target = level * self.count
+        cumulative = np.cumsum(self.bin_counts)
+        b = int(min(np.searchsorted(cumulative, target, side='left'), len(self.bin_counts) - 1))
+        before = cumulative[b - 1] if b > 0 else 0
+        tail_sum = self.bin_sums[:b].sum()
+        if self.bin_counts[b]:
+            tail_sum += (target - before) * self.bin_sums[b] / self.bin_counts[b]
+        return float(tail_sum / target) if target else 0.0
+
+    def summary(self, var_level=0.95):
+        return {
+            'n_paths': int(self.count),
+            'expected_return': float(self.mean),
+            'return_std': float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else 0.0,
+            'quantiles': {name: self.quantile(level) for name, level in QUANTILE_LEVELS.items()},
+            'var': -self.quantile(1 - var_level),
+            'cvar': -self.tail_mean(1 - var_level),
+            'prob_hit_target': self.hits / self.count if self.count else 0.0,
+        }
+
+
+def simulate_shard(args):
+    """Worker entry point: simulate one shard with its own spawned seed and return its statistics."""
+    transition_matrix, state_means, state_vols, start_state, horizon, n_paths, target_wealth, seed, edges = args
+    terminal, hit = simulate_paths(transition_matrix, state_means, state_vols, start_state, horizon,
+                                   n_paths, target_wealth, rng=np.random.default_rng(seed))
+    return SimulationStats.from_sample(terminal, hit, edges)
+
+
+def get_shard_pool(n_workers):
+    """Reuse one process pool across simulations (recreated only when the worker count changes).
+
+    Callers must hold _shard_pool_lock until their shards are submitted, so no other thread can
+    shut the pool down in between.
+    """
+    global _shard_pool, _shard_pool_workers
+    from concurrent.futures import ProcessPoolExecutor
+    if _shard_pool is None or _shard_pool_workers != n_workers:
+        if _shard_pool is not None:
+            _shard_pool.shutdown(wait=False)
+        _shard_pool = ProcessPoolExecutor(max_workers=n_workers)
+        _shard_pool_workers = n_workers
+    return _shard_pool
+
+
+def run_sharded_simulation(transition_matrix, state_means, state_vols, start_state, horizon, n_paths,
+                           target_wealth=None, seed=None, n_workers=1, var_level=0.95, shard_paths=SHARD_PATHS):
+    """Split a simulation into fixed-size shards with independent SeedSequence streams and merge the results.
+
+    For a given seed the output is bit-identical for any `n_workers`, because shard boundaries and
+    streams depend only on `n_paths`, `shard_paths` and the seed, and shards are merged in order.
+    """
+    state_means = np.asarray(state_means, dtype=float)
+    state_vols = np.asarray(state_vols, dtype=float)
+    seed_sequence = np.random.SeedSequence(seed)
+    n_shards = max(1, -(-n_paths // shard_paths))
+    shard_sizes = [min(shard_paths, n_paths - i * shard_paths) for i in range(n_shards)]
+    edges = np.linspace(*log_wealth_range(state_means, state_vols, horizon), HISTOGRAM_BINS + 1)
+
+    jobs = [(transition_matrix, state_means, state_vols, start_state, horizon, size, target_wealth, child, edges)
+            for size, child in zip(shard_sizes, seed_sequence.spawn(n_shards))]
+
+    if n_workers > 1 and n_shards > 1:
+        with _shard_pool_lock:
+            futures = [get_shard_pool(n_workers).submit(simulate_shard, job) for job in jobs]
+        shard_stats = [future.result() for future in futures]
+    else:
+        shard_stats = [simulate_shard(job) for job in jobs]
+
+    merged = SimulationStats(edges)
+    for stats in shard_stats:
+        merged.merge(stats)
+
+    summary = merged.summary(var_level)
+    summary['seed_entropy'] = str(seed_sequence.entropy)
+    summary['n_shards'] = n_shards
+    return summary
+
+
+# --- Variance Reduction ---
+
+VARIANCE_REDUCTION = ('plain', 'antithetic', 'control_variate', 'sobol')
+BATCH_PATHS = 8192    # Paths per independent batch; batches are the replicates behind the standard errors
+MIN_BATCHES = 8
+SOBOL_MAX_DIMENSION = 21201  # Direction numbers shipped with scipy.stats.qmc.Sobol
+_BELOW_ONE = np.nextafter(1.0, 0.0)
+
+
+def draw_inputs(strategy, n_paths, horizon, rng):
+    """Pre-draw (paths, horizon) uniforms and normals for one batch under the given strategy."""
+    if strategy == 'antithetic':
+        # Pair every path with its mirror: u -> 1 - u for regime draws, z -> -z for return shocks
+        half = -(-n_paths // 2)
+        uniforms = rng.random((half, horizon))
+        normals = rng.standard_normal((half, horizon))
+        uniforms = np.concatenate([uniforms, np.minimum(1.0 - uniforms, _BELOW_ONE)])[:n_paths]
+        normals = np.concatenate([normals, -normals])[:n_paths]
+        return uniforms, normals
+    if strategy == 'sobol':
+        from scipy.stats import qmc
+        from scipy.special import ndtri
+        if 2 * horizon > SOBOL_MAX_DIMENSION:
+            raise ValueError(f"Sobol sampling supports horizons up to {SOBOL_MAX_DIMENSION // 2} steps")
+        # One scrambled 2H-dimensional point per path: first H coordinates pick regimes, the rest drive shocks
+        points = qmc.Sobol(d=2 * horizon, scramble=True, seed=rng).random_base2(int(np.log2(n_paths)))
+        return points[:, :horizon], ndtri(np.clip(points[:, horizon:], 1e-12, 1 - 1e-12))
+    return rng.random((n_paths, horizon)), rng.standard_normal((n_paths, horizon))
+
+
+def control_adjusted_mean(values, controls, control_mean):
+    """Mean of `values` corrected with the control variate: mean(Y) - beta (mean(C) - E[C]), beta = cov(Y, C) / var(C)."""
+    control_var = controls.var()
+    if control_var <= 0:
+        return float(values.mean())
+    beta = np.mean((values - values.mean()) * (controls - controls.mean())) / control_var
+    return float(values.mean() - beta * (controls.mean() - control_mean))
+
+
+def simulate_batch(cdf, state_means, state_vols, start_state, horizon, n_paths, strategy, rng,
+                   target_wealth=None, var_level=0.95, control_mean=None):
+    """Simulate one independent batch; returns its point estimates and its terminal-return statistics."""
+    uniforms, normals = draw_inputs(strategy, n_paths, horizon, rng)
+    terminal, hit, return_sums = simulate_chunk(cdf, state_means, state_vols, start_state,
+                                                uniforms, normals, target_wealth)
+    hit = hit.astype(float)
+    if strategy == 'control_variate':
+        expected_return = control_adjusted_mean(terminal, return_sums, control_mean)
+        prob_hit_target = control_adjusted_mean(hit, return_sums, control_mean)
+    else:
+        expected_return = float(terminal.mean())
+        prob_hit_target = float(hit.mean())
+    estimates = {
+        'expected_return': expected_return,
+        'var': float(-np.quantile(terminal, 1 - var_level)),
+        'prob_hit_target': prob_hit_target,
+    }
+    return estimates, terminal, hit
+
+
+def run_variance_reduced_simulation(transition_matrix, state_means, state_vols, start_state, horizon,
+                                    n_paths, target_wealth=None, strategy='antithetic', ci_width=None,
+                                    statistic='expected_return', confidence=0.95, seed=None,
+                                    var_level=0.95, batch_paths=BATCH_PATHS):
+    """Simulate in independent batches under a variance-reduction strategy and report standard errors.
+
+    Standard errors come from the spread of per-batch estimates, which stays valid for antithetic
+    pairs, control-variate corrections and randomized Sobol points alike. With `ci_width` set the run
+    is adaptive: it stops as soon as the `confidence` interval of `statistic` is narrower than
+    `ci_width`, treating `n_paths` as a hard budget (batches shrink so MIN_BATCHES of them fit in it);
+    otherwise it simulates `n_paths` rounded up to whole batches. The summary's n_paths is the number
+    of paths actually simulated.
+    """
+    if strategy not in VARIANCE_REDUCTION:
+        raise ValueError(f"Unknown variance reduction '{strategy}', expected one of {', '.join(VARIANCE_REDUCTION)}")
+    if statistic not in ('expected_return', 'var', 'prob_hit_target'):
+        raise ValueError(f"Unknown statistic '{statistic}'")
+
+    state_means = np.asarray(state_means, dtype=float)
+    state_vols = np.asarray(state_vols, dtype=float)
+    cdf = cumulative_rows(transition_matrix)
+    batch_paths = max(2, min(batch_paths, MAX_CHUNK_ELEMENTS // max(horizon, 1)))
+    if ci_width is not None:
+        batch_paths = max(2, min(batch_paths, n_paths // MIN_BATCHES))
+    if strategy == 'sobol':
+        batch_paths = 1 << int(np.log2(batch_paths))  # Sobol balance properties need a power of two
+    if ci_width is None:
+        max_batches = max(2, -(-n_paths // batch_paths))
+    else:
+        max_batches = max(2, n_paths // batch_paths)  # Whole batches within the budget
+    control_mean = None
+    if strategy == 'control_variate':
+        # Expected sum of daily returns is known exactly from the chain
+        control_mean = float(expected_return_for_state(transition_matrix, state_means, start_state, horizon))
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    seed_sequence = np.random.SeedSequence(seed)
+    edges = np.linspace(*log_wealth_range(state_means, state_vols, horizon), HISTOGRAM_BINS + 1)
+    merged = SimulationStats(edges)
+    estimates = []
+
+    while len(estimates) < max_batches:
+        rng = np.random.default_rng(seed_sequence.spawn(1)[0])
+        batch, terminal, hit = simulate_batch(cdf, state_means, state_vols, start_state, horizon, batch_paths,
+                                              strategy, rng, target_wealth, var_level, control_mean)
+        estimates.append(batch)
+        merged.merge(SimulationStats.from_sample(terminal, hit, edges))
+        if ci_width is not None and len(estimates) >= MIN_BATCHES:
+            values = np.array([e[statistic] for e in estimates])
+            width = 2 * z * values.std(ddof=1) / np.sqrt(len(values))
+            if width <= ci_width:
+                break
+
+    standard_errors = {}
+    summary = merged.summary(var_level)
+    for name in ('expected_return', 'var', 'prob_hit_target'):
+        values = np.array([e[name] for e in estimates])
+        standard_errors[name] = float(values.std(ddof=1) / np.sqrt(len(values)))
+        if name != 'var':
+            # Batch means carry the control-variate correction; the VaR point estimate keeps the merged histogram
+            summary[name] = float(values.mean())
+    if target_wealth is None:
+        summary['prob_hit_target'] = 0.0
+
+    summary['variance_reduction'] = strategy
+    summary['n_batches'] = len(estimates)
+    summary['standard_errors'] = standard_errors
+    summary['ci_width'] = 2 * z * standard_errors[statistic]
+    summary['converged'] = ci_width is None or summary['ci_width'] <= ci_width
+    summary['seed_entropy'] = str(seed_sequence.entropy)
+    return summary
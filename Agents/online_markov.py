@@ -0,0 +1,337 @@
+"""
+Stateful per-ticker Markov model that absorbs new bars in O(1).
+The model is warm-started once from history with the same vectorized kernels as
+get_enhanced_transition_matrix, then keeps running transition counts, Welford per-state
+moments and rolling-window accumulators so each new bar costs the same regardless of history length.
+"""
+import math
+import numpy as np
+from collections import deque
+from markov_kernels import (STATES, NEUTRAL, MISSING, classify_returns, count_transitions,
+                            state_return_stats, smoothed_transition_matrix, regime_thresholds,
+                            momentum_from_sma, expected_cumulative_return)
+from markov_uncertainty import transition_confidence, expected_return_interval
+
+SHORT_WINDOW = 20   # SMA-20 and Volatility-20
+LONG_WINDOW = 50    # SMA-50
+STRENGTH_WINDOW = 30  # Recent returns used for relative strength
+
+
+class OnlineMarkovModel:
+    """Running Markov statistics for one asset; serializable with to_dict/from_dict."""
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        n_states = len(STATES)
+        self.transition_counts = np.zeros((n_states, n_states))
+
+        # Welford accumulators per state and for all returns
+        self.state_n = np.zeros(n_states)
+        self.state_mean = np.zeros(n_states)
+        self.state_m2 = np.zeros(n_states)
+        self.returns_n = 0
+        self.returns_mean = 0.0
+        self.returns_m2 = 0.0
+
+        # Rolling windows with running sums
+        self.closes = deque(maxlen=LONG_WINDOW)
+        self.close_sum_short = 0.0
+        self.close_sum_long = 0.0
+        self.recent_returns = deque(maxlen=STRENGTH_WINDOW)
+        self.recent_return_sum = 0.0
+        self.return_sum_short = 0.0
+        self.return_sumsq_short = 0.0
+        self.recent_vols = deque(maxlen=SHORT_WINDOW)
+
+        self.last_state = MISSING
+        self.last_bar_time = None
+
+    # --- Warm start ---
+
+    def fit(self, closes, bar_times=None):
+        """Initialize every accumulator from a full close series in one vectorized pass."""
+        closes = np.asarray(closes, dtype=float)
+        self.__init__(self.alpha)
+        if len(closes) < 2:
+            for close in closes:
+                self._push_close(close)
+            return self
+
+        returns = np.empty(len(closes))
+        returns[0] = np.nan
+        returns[1:] = closes[1:] / closes[:-1] - 1
+        valid_returns = returns[1:]
+
+        # Rolling Volatility_20 for the last SHORT_WINDOW bars (pandas ddof=1 semantics)
+        vols = []
+        for end in range(max(SHORT_WINDOW, len(valid_returns) - SHORT_WINDOW + 1), len(valid_returns) + 1):
+            vols.append(float(np.std(valid_returns[end - SHORT_WINDOW:end], ddof=1)))
+        recent_volatility = float(np.mean(vols)) if vols else np.nan
+
+        returns_mean = float(np.mean(valid_returns))
+        returns_std = float(np.std(valid_returns, ddof=1)) if len(valid_returns) > 1 else 0.0
+        bull_threshold, bear_threshold = regime_thresholds(returns_mean, returns_std, recent_volatility)
+        codes = classify_returns(returns, bull_threshold, bear_threshold)
+
+        self.transition_counts = count_transitions(codes, len(STATES))
+        counts, means, stds = state_return_stats(codes, returns, len(STATES))
+        self.state_n = counts
+        self.state_mean = np.nan_to_num(means)
+        self.state_m2 = np.nan_to_num(stds ** 2 * (counts - 1))
+
+        self.returns_n = len(valid_returns)
+        self.returns_mean = returns_mean
+        self.returns_m2 = returns_std ** 2 * (len(valid_returns) - 1)
+
+        for close in closes[-LONG_WINDOW:]:
+            self._push_close(close)
+        for ret in valid_returns[-STRENGTH_WINDOW:]:
+            self._push_return(ret)
+        self.recent_vols.extend(vols)
+
+        observed = codes[codes != MISSING]
+        self.last_state = int(observed[-1]) if len(observed) else MISSING
+        if bar_times is not None and len(bar_times):
+            self.last_bar_time = str(bar_times[-1])
+        return self
+
+    # --- O(1) updates ---
+
+    def _push_close(self, close):
+        if len(self.closes) >= SHORT_WINDOW:
+            self.close_sum_short -= self.closes[-SHORT_WINDOW]
+        if len(self.closes) == LONG_WINDOW:
+            self.close_sum_long -= self.closes[0]
+        self.closes.append(close)
+        self.close_sum_short += close
+        self.close_sum_long += close
+
+    def _push_return(self, ret):
+        if len(self.recent_returns) >= SHORT_WINDOW:
+            leaving = self.recent_returns[-SHORT_WINDOW]
+            self.return_sum_short -= leaving
+            self.return_sumsq_short -= leaving * leaving
+        if len(self.recent_returns) == STRENGTH_WINDOW:
+            self.recent_return_sum -= self.recent_returns[0]
+        self.recent_returns.append(ret)
+        self.recent_return_sum += ret
+        self.return_sum_short += ret
+        self.return_sumsq_short += ret * ret
+
+    def update(self, close, bar_time=None):
+        """Absorb one new bar: update windows, classify its return and extend the chain."""
+        previous_close = self.closes[-1] if self.closes else None
+        self._push_close(float(close))
+        if bar_time is not None:
+            self.last_bar_time = str(bar_time)
+        if previous_close is None:
+            return self.last_state
+
+        ret = float(close) / previous_close - 1
+        self._push_return(ret)
+        if len(self.recent_returns) >= SHORT_WINDOW:
+            self.recent_vols.append(self.short_volatility())
+
+        self.returns_n += 1
+        delta = ret - self.returns_mean
+        self.returns_mean += delta / self.returns_n
+        self.returns_m2 += delta * (ret - self.returns_mean)
+
+        # Classify with the thresholds implied by the statistics seen so far
+        bull_threshold, bear_threshold = regime_thresholds(self.returns_mean, self.returns_std(),
+                                                           self.recent_volatility())
+        if np.isnan(bull_threshold) or np.isnan(bear_threshold):
+            return MISSING  # No Volatility_20 yet, so the bar cannot be classified
+        state = int(classify_returns([ret], bull_threshold, bear_threshold)[0])
+
+        self.state_n[state] += 1
+        delta = ret - self.state_mean[state]
+        self.state_mean[state] += delta / self.state_n[state]
+        self.state_m2[state] += delta * (ret - self.state_mean[state])
+
+        if self.last_state != MISSING:
+            self.transition_counts[self.last_state, state] += 1
+        self.last_state = state
+        return state
+
+    def update_chunk(self, closes, bar_times=None):
+        """Absorb a block of new bars at once; equivalent to calling update() on each bar in order.
+
+        Running thresholds, rolling volatilities and Welford moments are evaluated for every bar of
+        the chunk with prefix sums, so the cost is vectorized per chunk. Bars are classified with the
+        thresholds known at that bar, not fit()'s full-sample ones, and bars before the first
+        Volatility_20 stay MISSING. Returns the state codes.
+        """
+        closes = np.asarray(closes, dtype=float)
+        if len(closes) and bar_times is not None:
+            self.last_bar_time = str(bar_times[-1])
+        if len(closes) and not self.closes:
+            self._push_close(float(closes[0]))
+            closes = closes[1:]
+        if len(closes) == 0:
+            return np.zeros(0, dtype=np.int8)
+
+        n = len(closes)
+        returns = closes / np.concatenate([[self.closes[-1]], closes[:-1]]) - 1
+
+        # Volatility_20 appended after every return once SHORT_WINDOW returns exist
+        prior_returns = np.array(self.recent_returns)[-(SHORT_WINDOW - 1):]
+        history = np.concatenate([prior_returns, returns])
+        new_vols = np.full(n, np.nan)
+        if len(history) >= SHORT_WINDOW:
+            windows = np.lib.stride_tricks.sliding_window_view(history, SHORT_WINDOW)
+            new_vols[SHORT_WINDOW - 1 - len(prior_returns):] = windows.std(axis=1, ddof=1)
+        appended = ~np.isnan(new_vols)
+
+        # Mean of the last SHORT_WINDOW volatilities after each step
+        vol_sequence = np.concatenate([np.array(self.recent_vols), new_vols[appended]])
+        vol_prefix = np.concatenate([[0.0], np.cumsum(vol_sequence)])
+        vol_end = len(self.recent_vols) + np.cumsum(appended)
+        vol_start = np.maximum(vol_end - SHORT_WINDOW, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            recent_volatility = (vol_prefix[vol_end] - vol_prefix[vol_start]) / (vol_end - vol_start)
+
+        # Running mean/std of all returns after each step (Chan's combination of prior and chunk prefix)
+        prior_n, prior_mean, prior_m2 = self.returns_n, self.returns_mean, self.returns_m2
+        shift = prior_mean if prior_n else returns[0]
+        centred = returns - shift
+        chunk_n = np.arange(1, n + 1)
+        chunk_sum = np.cumsum(centred)
+        chunk_mean = shift + chunk_sum / chunk_n
+        chunk_m2 = np.maximum(np.cumsum(centred * centred) - chunk_sum * chunk_sum / chunk_n, 0.0)
+        total_n = prior_n + chunk_n
+        delta = chunk_mean - prior_mean
+        running_mean = prior_mean + delta * chunk_n / total_n
+        running_m2 = prior_m2 + chunk_m2 + delta * delta * prior_n * chunk_n / total_n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            running_std = np.where(total_n > 1, np.sqrt(running_m2 / np.maximum(total_n - 1, 1)), 0.0)
+            bull_threshold, bear_threshold = regime_thresholds(running_mean, running_std, recent_volatility)
+        codes = classify_returns(returns[:, None], bull_threshold, bear_threshold)[:, 0]
+        codes[np.isnan(bull_threshold) | np.isnan(bear_threshold)] = MISSING  # Before the first Volatility_20
+
+        # Per-state Welford moments combined with the chunk's per-state groups
+        n_states = len(STATES)
+        counts, means, stds = state_return_stats(codes, returns, n_states)
+        m2 = np.nan_to_num(stds ** 2 * (counts - 1))
+        means = np.nan_to_num(means)
+        combined_n = self.state_n + counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = means - self.state_mean
+            self.state_mean = np.where(combined_n > 0, self.state_mean + delta * counts / combined_n, self.state_mean)
+            self.state_m2 = np.where(combined_n > 0,
+                                     self.state_m2 + m2 + delta * delta * self.state_n * counts / combined_n,
+                                     self.state_m2)
+        self.state_n = combined_n
+        self.transition_counts += count_transitions(np.concatenate([[self.last_state], codes]), n_states)
+        observed = codes[codes != MISSING]
+        if len(observed):
+            self.last_state = int(observed[-1])
+
+        self.returns_n = int(total_n[-1])
+        self.returns_mean = float(running_mean[-1])
+        self.returns_m2 = float(running_m2[-1])
+
+        # Rolling windows: extend the deques and rebuild their (at most 50-element) running sums
+        self.closes.extend(closes.tolist())
+        self.recent_returns.extend(returns.tolist())
+        self.recent_vols.extend(new_vols[appended].tolist())
+        self._rebuild_window_sums()
+        return codes
+
+    def _rebuild_window_sums(self):
+        closes = list(self.closes)
+        recent = list(self.recent_returns)
+        self.close_sum_short = float(sum(closes[-SHORT_WINDOW:]))
+        self.close_sum_long = float(sum(closes))
+        self.recent_return_sum = float(sum(recent))
+        self.return_sum_short = float(sum(recent[-SHORT_WINDOW:]))
+        self.return_sumsq_short = float(sum(r * r for r in recent[-SHORT_WINDOW:]))
+
+    # --- Derived statistics ---
+
+    def returns_std(self):
+        return math.sqrt(self.returns_m2 / (self.returns_n - 1)) if self.returns_n > 1 else 0.0
+
+    def short_volatility(self):
+        n = min(len(self.recent_returns), SHORT_WINDOW)
+        if n < 2:
+            return float('nan')
+        variance = (self.return_sumsq_short - self.return_sum_short ** 2 / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def recent_volatility(self):
+        return float(np.mean(self.recent_vols)) if self.recent_vols else float('nan')
+
+    def metrics(self):
+        """Return the same 11-tuple as get_enhanced_transition_matrix, or Nones if too little data."""
+        if self.returns_n < 30:
+            return None, None, None, None, None, None, None, None, None, None, None
+
+        states = list(STATES)
+        returns_std = self.returns_std()
+        transition_matrix = smoothed_transition_matrix(self.transition_counts, self.alpha)
+
+        state_returns = {}
+        state_volatility = {}
+        for i, state in enumerate(states):
+            n = self.state_n[i]
+            state_returns[state] = float(self.state_mean[i]) if n > 0 else 0.0
+            state_volatility[state] = math.sqrt(self.state_m2[i] / (n - 1)) if n > 1 else returns_std
+
+        sma_20 = self.close_sum_short / SHORT_WINDOW if len(self.closes) >= SHORT_WINDOW else np.nan
+        sma_50 = self.close_sum_long / LONG_WINDOW if len(self.closes) >= LONG_WINDOW else np.nan
+        trend = momentum_from_sma(sma_20, sma_50)
+
+        current_state_idx = self.last_state if self.last_state != MISSING else NEUTRAL
+        state_return_values = np.array([state_returns[state] for state in states])
+        expected_return_30d = expected_cumulative_return(transition_matrix, state_return_values, current_state_idx, 30)
+
+        _, expected_return_low, expected_return_high = expected_return_interval(
+            self.transition_counts, state_return_values, current_state_idx, 30, alpha=self.alpha)
+        confidence_score = transition_confidence(self.transition_counts)
+        risk_score = min(1.0, self.recent_volatility() / (returns_std * 2))
+        recent_returns = self.recent_return_sum / len(self.recent_returns)
+        relative_strength = recent_returns / abs(self.returns_mean) if self.returns_mean != 0 else 0.0
+
+        return (states, transition_matrix, states[current_state_idx], state_returns,
+                state_volatility, trend, confidence_score, expected_return_30d,
+                risk_score, relative_strength, (expected_return_low, expected_return_high))
+
+    # --- Serialization ---
+
+    def to_dict(self):
+        """JSON-friendly snapshot so agents can restart warm."""
+        return {
+            "alpha": self.alpha,
+            "transition_counts": self.transition_counts.tolist(),
+            "state_n": self.state_n.tolist(),
+            "state_mean": self.state_mean.tolist(),
+            "state_m2": self.state_m2.tolist(),
+            "returns_n": self.returns_n,
+            "returns_mean": self.returns_mean,
+            "returns_m2": self.returns_m2,
+            "closes": list(self.closes),
+            "recent_returns": list(self.recent_returns),
+            "recent_vols": list(self.recent_vols),
+            "last_state": self.last_state,
+            "last_bar_time": self.last_bar_time,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        model = cls(alpha=data["alpha"])
+        for close in data["closes"]:
+            model._push_close(close)
+        for ret in data["recent_returns"]:
+            model._push_return(ret)
+        model.recent_vols.extend(data["recent_vols"])
+        model.transition_counts = np.array(data["transition_counts"], dtype=float)
+        model.state_n = np.array(data["state_n"], dtype=float)
+        model.state_mean = np.array(data["state_mean"], dtype=float)
+        model.state_m2 = np.array(data["state_m2"], dtype=float)
+        model.returns_n = data["returns_n"]
+        model.returns_mean = data["returns_mean"]
+        model.returns_m2 = data["returns_m2"]
+        model.last_state = data["last_state"]
+        model.last_bar_time = data["last_bar_time"]
+        return model
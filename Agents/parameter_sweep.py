@@ -0,0 +1,162 @@
+"""
+Parallel grid or random search over the Markov and planner hyperparameters using the backtester.
+Prices are written once to a .npy file that every worker memory-maps, so only file paths and
+parameter dicts cross process boundaries. Every finished point is stored as JSON under a hash of its
+parameters and the price data, so an interrupted sweep resumes without recomputing finished points.
+Usage: python parameter_sweep.py [n_random_points] [TICKER ...]
+"""
+import os
+import sys
+import json
+import hashlib
+import itertools
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from backtest import DEFAULT_PARAMS, FEATURE_PARAMS, load_closes, markov_features, run_backtest
+
+SWEEP_VERSION = 1  # Bump when backtest semantics change so cached results are not reused
+SWEEP_DIR = os.getenv("SWEEP_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sweeps"))
+
+# Default search space: the planner's magic constants and the Markov model's smoothing / threshold clamp
+DEFAULT_SPACE = {
+    'min_volatility_multiplier': [0.25, 0.5, 0.75],
+    'max_volatility_multiplier': [1.5, 2.0, 3.0],
+    'alpha': [0.01, 0.1, 1.0],
+    'buy_momentum': [0.1, 0.2, 0.3, 0.4],
+    'buy_expected_return': [0.0, 0.01, 0.02, 0.04],
+    'concentrated_strength': [0.6, 0.7, 0.8],
+}
+REPORT_METRICS = ('total_return', 'max_drawdown', 'n_trades', 'turnover', 'signal_hit_rate', 'trade_hit_rate')
+
+# Worker state: the memory-mapped prices and features of the last feature-parameter set
+_closes = None
+_features_key = None
+_features = None
+
+
+def grid_points(space):
+    """Every combination of the listed values."""
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_points(space, n_points, seed=None):
+    """Sample points: lists are drawn uniformly, (low, high) tuples are drawn from the continuous range."""
+    rng = np.random.default_rng(seed)
+    points = []
+    for _ in range(n_points):
+        point = {}
+        for name in sorted(space):
+            choices = space[name]
+            if isinstance(choices, tuple):
+                point[name] = float(rng.uniform(*choices))
+            else:
+                point[name] = choices[int(rng.integers(len(choices)))]
+        points.append(point)
+    return points
+
+
+def data_fingerprint(closes):
+    """Content hash of the price array (shape, dtype and bytes)."""
+    digest = hashlib.sha256()
+    digest.update(str((closes.shape, closes.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(closes).tobytes())
+    return digest.hexdigest()
+
+
+def point_key(params, fingerprint):
+    """Content address of one sweep point: full parameter set, price data and sweep version."""
+    payload = json.dumps({'params': params, 'data': fingerprint, 'version': SWEEP_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def write_json_atomic(path, payload):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as handle:
+            json.dump(payload, handle)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _init_worker(prices_path):
+    global _closes
+    _closes = np.load(prices_path, mmap_mode='r')
+
+
+def evaluate_point(params, result_path):
+    """Worker entry point: backtest one parameter set and persist its summary before returning it."""
+    global _features_key, _features
+    features_key = tuple(params[name] for name in FEATURE_PARAMS)
+    if features_key != _features_key:
+        # Points are dispatched sorted by feature parameters, so consecutive points usually share the refit
+        _features = markov_features(np.asarray(_closes), params)
+        _features_key = features_key
+    report = run_backtest(_closes, params, features=_features)
+    result = {'params': params, **{metric: report[metric] for metric in REPORT_METRICS}}
+    write_json_atomic(result_path, result)
+    return result
+
+
+def run_sweep(closes, points, sweep_dir=SWEEP_DIR, n_workers=None):
+    """Evaluate every point (merged over DEFAULT_PARAMS) on a process pool, reusing cached results.
+
+    Returns the list of result dicts in the order of `points`.
+    """
+    closes = np.asarray(closes, dtype=float)
+    fingerprint = data_fingerprint(closes)
+    results_dir = os.path.join(sweep_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+
+    # Content-addressed price file: workers memory-map it instead of receiving the array
+    prices_path = os.path.join(sweep_dir, f"prices-{fingerprint[:16]}.npy")
+    if not os.path.exists(prices_path):
+        fd, tmp_path = tempfile.mkstemp(dir=sweep_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as handle:
+            np.save(handle, closes)
+        os.replace(tmp_path, prices_path)
+
+    full_points = [{**DEFAULT_PARAMS, **point} for point in points]
+    paths = [os.path.join(results_dir, f"{point_key(params, fingerprint)}.json") for params in full_points]
+    results = [None] * len(points)
+    pending = []
+    for i, path in enumerate(paths):
+        if os.path.exists(path):
+            with open(path) as handle:
+                results[i] = json.load(handle)
+        else:
+            pending.append(i)
+    print(f"Sweep: {len(points)} points, {len(points) - len(pending)} cached, {len(pending)} to run")
+
+    pending.sort(key=lambda i: tuple(full_points[i][name] for name in FEATURE_PARAMS))
+    if pending:
+        n_workers = n_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(prices_path,)) as pool:
+            futures = {pool.submit(evaluate_point, full_points[i], paths[i]): i for i in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if done % 10 == 0 or done == len(pending):
+                    print(f"  {done}/{len(pending)} points finished")
+    return results
+
+
+def print_leaderboard(results, metric='total_return', top=10):
+    swept = sorted({name for result in results for name, value in result['params'].items()
+                    if value != DEFAULT_PARAMS.get(name)})
+    print(f"\nTop {min(top, len(results))} points by {metric}:")
+    for result in sorted(results, key=lambda r: r[metric], reverse=True)[:top]:
+        settings = ", ".join(f"{name}={result['params'][name]}" for name in swept)
+        print(f"  {result[metric]:>9.4f}  dd {result['max_drawdown']:.2%}  trades {result['n_trades']:>5}  {settings}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    n_random = int(args.pop(0)) if args and args[0].isdigit() else 0
+    tickers = args or ['BTC-USD', 'ETH-USD', 'LTC-USD']
+    _, closes = load_closes(tickers, years=5)
+    points = random_points(DEFAULT_SPACE, n_random, seed=0) if n_random else grid_points(DEFAULT_SPACE)
+    print_leaderboard(run_sweep(closes, points))
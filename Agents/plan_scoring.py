@@ -0,0 +1,114 @@
+"""
+Batch scoring of trading plans for many assets at once.
+The strategic planner's rules are NumPy masks over a structured array with one row per asset, so
+a universe of thousands of assets is scored with flat per-asset cost. The planner's single-asset
+path, its batch path and the backtester all evaluate the rules defined here; hold durations come from
+a search over each asset's expected-return and risk curve.
+"""
+import numpy as np
+from horizon_engine import return_moments_curve
+
+# One row per asset: the EnhancedMatrixResponse metrics the rules read plus the requested horizon
+PLAN_DTYPE = np.dtype([
+    ('trend_momentum', 'f8'),
+    ('expected_return', 'f8'),
+    ('risk_score', 'f8'),
+    ('confidence', 'f8'),
+    ('time_horizon_days', 'i4'),
+    ('has_data', '?'),
+])
+
+PLANNER_RULES = {
+    'buy_momentum': 0.3,          # BUY needs momentum above this ...
+    'buy_expected_return': 0.02,  # ... and expected return above this
+    'sell_momentum': -0.3,        # SELL below this momentum
+    'risk_aversion': 1.0,         # BUY holds maximize mean - risk_aversion / 2 * variance (1 = log utility)
+    'other_hold_days': 14,        # Two weeks for non-buy signals
+}
+
+# Signal codes
+HOLD, BUY, SELL = 0, 1, 2
+SIGNAL_NAMES = ['HOLD', 'BUY', 'SELL']
+ACTION_NAMES = ['Hold', 'Invest', 'Sell']
+VOLATILITY_SCORE = 0.5  # Neutral score for volatility
+
+# Plan for assets without usable matrix data
+DEFAULT_PLAN = {'hold_duration': 30, 'projected_return': 1.02, 'confidence': 0.5, 'risk_adjusted_score': 0.5,
+                'momentum_factor': 0.0, 'signal_strength': 0.5}
+
+
+def planner_signals(momentum, expected_return, confidence, params=None):
+    """The planner's rules over arrays of any shape: returns (signal codes, signal strength, risk-adjusted score)."""
+    params = {**PLANNER_RULES, **(params or {})}
+    momentum_score = np.maximum(0.0, (momentum + 1.0) / 2.0)
+    expected_return_score = np.clip(expected_return * 5, 0.0, 1.0)
+    risk_adjusted_score = (momentum_score * 0.4 + expected_return_score * 0.4 + VOLATILITY_SCORE * 0.2) * confidence
+
+    buy = (momentum > params['buy_momentum']) & (expected_return > params['buy_expected_return'])
+    sell = ~buy & (momentum < params['sell_momentum'])
+    signal = np.select([buy, sell], [BUY, SELL], HOLD).astype(np.int8)
+    strength = np.select(
+        [buy, sell],
+        [np.minimum(1.0, momentum * 0.7 + expected_return * 15), np.minimum(1.0, np.abs(momentum) * 0.7)],
+        0.5
+    )
+    return signal, strength, risk_adjusted_score
+
+
+def score_plans(metrics, params=None, buy_hold_days=None, target_probability=None):
+    """Score a PLAN_DTYPE array; returns a dict of per-asset arrays (rows without data get DEFAULT_PLAN).
+
+    BUY signals hold for `buy_hold_days` (e.g. from hold_duration_search), else the requested horizon.
+    With `target_probability` (P(reaching the user's target within the horizon), e.g. from
+    hitting_probability), a BUY's strength is that probability instead of the momentum heuristic;
+    NaN entries keep the heuristic.
+    """
+    params = {**PLANNER_RULES, **(params or {})}
+    signal, strength, score = planner_signals(metrics['trend_momentum'], metrics['expected_return'],
+                                              metrics['confidence'], params)
+    if target_probability is not None:
+        strength = np.where((signal == BUY) & ~np.isnan(target_probability), target_probability, strength)
+    buy_hold_days = metrics['time_horizon_days'] if buy_hold_days is None else buy_hold_days
+    hold_duration = np.where(signal == BUY, buy_hold_days, params['other_hold_days'])
+
+    missing = ~metrics['has_data']
+    signal[missing] = HOLD
+    return {
+        'signal': signal,
+        'signal_strength': np.where(missing, DEFAULT_PLAN['signal_strength'], strength),
+        'risk_adjusted_score': np.where(missing, DEFAULT_PLAN['risk_adjusted_score'], score),
+        'confidence': np.where(missing, DEFAULT_PLAN['confidence'], metrics['confidence']),
+        'momentum_factor': np.where(missing, DEFAULT_PLAN['momentum_factor'], metrics['trend_momentum']),
+        'hold_duration': np.where(missing, DEFAULT_PLAN['hold_duration'], hold_duration).astype(int),
+    }
+
+
+def hold_duration_search(transition_matrices, state_returns, state_variances, start_states, max_horizons,
+                         n_horizons=1, params=None):
+    """Risk-adjusted hold duration per asset from its whole mean/variance curve.
+
+    Every horizon is evaluated in one pass; each asset picks the horizon within its own max_horizon that
+    maximizes mean - risk_aversion / 2 * variance of the cumulative return. Returns (best durations,
+    mean curve, variance curve), the curves shaped (assets, max(max_horizons, n_horizons)).
+    """
+    params = {**PLANNER_RULES, **(params or {})}
+    max_horizons = np.maximum(np.asarray(max_horizons), 1)
+    horizons = max(int(max_horizons.max()), n_horizons)
+    mean, variance = return_moments_curve(transition_matrices, state_returns, state_variances, start_states, horizons)
+    objective = mean - 0.5 * params['risk_aversion'] * variance
+    objective[np.arange(horizons) >= max_horizons[:, None]] = -np.inf
+    return objective.argmax(axis=1) + 1, mean, variance
+
+
+def curve_at(curve, durations):
+    """Each row of a (assets, horizons) curve read at its own duration in days."""
+    return np.take_along_axis(curve, (np.asarray(durations) - 1)[:, None], axis=1)[:, 0]
+
+
+def reasoning(signal, momentum, expected_return):
+    """Explanation of one asset's signal, as the planner reports it."""
+    if signal == BUY:
+        return f"Strong upward momentum ({momentum:.2f}) with good expected return ({expected_return:.2%})"
+    if signal == SELL:
+        return f"Downward momentum detected ({momentum:.2f})"
+    return "No strong signals detected"
@@ -0,0 +1,305 @@
+"""
+Persistent local OHLCV cache for the Markov model agent.
+Each ticker/interval pair is stored as one structured `.npy` file, with a small `.json` sidecar
+recording when the source was last checked and how far back it was asked for history. On every
+request only the missing tail since the last cached bar is downloaded from Yahoo Finance and appended.
+"""
+import os
+import re
+import json
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+# --- Storage Layout ---
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+BAR_DTYPE = np.dtype([('time', 'datetime64[s]')] + [(column, 'f8') for column in PRICE_COLUMNS])
+# A first bar this close after `start` covers it (weekends, holidays and a mid-day start time)
+HEAD_TOLERANCE = np.timedelta64(4, 'D')
+
+
+def normalize_download(frame, ticker=None):
+    """Flatten a yfinance download into tz-naive UTC bars with the standard OHLCV columns."""
+    if frame is None or frame.empty:
+        return pd.DataFrame(columns=PRICE_COLUMNS)
+
+    if isinstance(frame.columns, pd.MultiIndex):
+        # Newer yfinance versions add a ticker level even for single-ticker downloads
+        for level in range(frame.columns.nlevels):
+            if ticker is not None and ticker in frame.columns.get_level_values(level):
+                frame = frame.xs(ticker, axis=1, level=level)
+                break
+        else:
+            frame = frame.droplevel(-1, axis=1)
+
+    frame = frame.reindex(columns=PRICE_COLUMNS)
+    index = pd.DatetimeIndex(frame.index)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    frame.index = index
+    frame.index.name = 'Date'
+    return frame.dropna(subset=['Close'])
+
+
+def frame_to_bars(frame):
+    """Convert a normalized OHLCV DataFrame into the on-disk structured array."""
+    bars = np.empty(len(frame), dtype=BAR_DTYPE)
+    bars['time'] = frame.index.values.astype('datetime64[s]')
+    for column in PRICE_COLUMNS:
+        bars[column] = frame[column].to_numpy(dtype=float)
+    return bars
+
+
+def meta_path(path):
+    """Sidecar metadata file of a cached `.npy` file."""
+    return os.path.splitext(path)[0] + '.json'
+
+
+def bars_to_frame(bars):
+    """Convert cached bars back into the DataFrame layout returned by yf.download."""
+    frame = pd.DataFrame({column: bars[column] for column in PRICE_COLUMNS},
+                         index=pd.DatetimeIndex(bars['time'].astype('datetime64[ns]'), name='Date'))
+    return frame
+
+
+class PriceCache:
+    """On-disk OHLCV store that only fetches the bars it has not seen yet."""
+
+    def __init__(self, cache_dir, offline=False, refresh_seconds=900, max_tickers=None, max_age_days=None):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.refresh_seconds = refresh_seconds
+        self.max_tickers = max_tickers
+        self.max_age_days = max_age_days
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # --- File helpers ---
+
+    def path_for(self, ticker, interval='1d'):
+        safe_ticker = re.sub(r'[^A-Za-z0-9_.-]', '_', ticker)
+        return os.path.join(self.cache_dir, f"{safe_ticker}.{interval}.npy")
+
+    def load(self, ticker, interval='1d', mmap=False):
+        """Return all cached bars for a ticker (empty array if nothing is cached)."""
+        path = self.path_for(ticker, interval)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=BAR_DTYPE)
+        return np.load(path, mmap_mode='r' if mmap else None)
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                write(handle)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def store(self, ticker, bars, interval='1d'):
+        """Atomically replace the cached bars for a ticker."""
+        self._write_atomic(self.path_for(ticker, interval), lambda handle: np.save(handle, bars))
+
+    def load_meta(self, ticker, interval='1d'):
+        """Sidecar metadata: 'checked_at' (epoch seconds) and 'history_start' (earliest start backfilled)."""
+        try:
+            with open(meta_path(self.path_for(ticker, interval))) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    def save_meta(self, ticker, interval='1d', **updates):
+        meta = {**self.load_meta(ticker, interval), **updates}
+        self._write_atomic(meta_path(self.path_for(ticker, interval)),
+                           lambda handle: handle.write(json.dumps(meta).encode()))
+
+    def last_checked(self, path):
+        """When the source was last asked for this file's bars (file mtime for caches without a sidecar)."""
+        try:
+            with open(meta_path(path)) as handle:
+                return float(json.load(handle)['checked_at'])
+        except (OSError, ValueError, KeyError):
+            return os.path.getmtime(path)
+
+    def is_fresh(self, ticker, interval='1d'):
+        path = self.path_for(ticker, interval)
+        return os.path.exists(path) and time.time() - self.last_checked(path) < self.refresh_seconds
+
+    def missing_head(self, ticker, bars, start_ts, interval='1d'):
+        """True if the cached bars start after `start_ts` and the source was not yet asked for older ones."""
+        if len(bars) == 0 or bars['time'][0] <= start_ts + HEAD_TOLERANCE:
+            return False
+        backfilled = self.load_meta(ticker, interval).get('history_start')
+        return backfilled is None or np.datetime64(backfilled, 's') > start_ts
+
+    def checked(self, ticker, bars, changed, interval='1d', backfilled_to=None):
+        """Record a successful check of the source, rewriting the bars only if the check changed them.
+
+        `backfilled_to` is the start the head was backfilled from; it is kept so the (possibly
+        missing) older history is not asked for again, across restarts too.
+        """
+        if changed:
+            self.store(ticker, bars, interval)
+        updates = {'checked_at': time.time()}
+        if backfilled_to is not None:
+            previous = self.load_meta(ticker, interval).get('history_start')
+            if previous is not None:
+                backfilled_to = min(backfilled_to, np.datetime64(previous, 's'))
+            updates['history_start'] = str(backfilled_to)
+        self.save_meta(ticker, interval, **updates)
+
+    # --- Incremental refresh ---
+
+    def merge(self, cached, new_bars):
+        """Append new bars, letting freshly downloaded bars replace overlapping cached ones."""
+        if len(new_bars) == 0:
+            return cached
+        keep = cached[cached['time'] < new_bars['time'][0]] if len(cached) else cached
+        merged = np.concatenate([keep, new_bars])
+        _, unique_idx = np.unique(merged['time'][::-1], return_index=True)
+        return merged[len(merged) - 1 - unique_idx]
+
+    def download(self, ticker, start, end, interval='1d'):
+        import yfinance as yf
+        frame = yf.download(ticker, start=start, end=end, interval=interval, progress=False)
+        return frame_to_bars(normalize_download(frame, ticker))
+
+    def refresh(self, ticker, start, end, interval='1d'):
+        """Fetch whatever is missing between `start` and `end` and persist it."""
+        original = np.array(self.load(ticker, interval))
+        cached = original
+        start_ts = np.datetime64(pd.Timestamp(start).to_pydatetime(), 's')
+
+        backfilled_to = None
+        if self.missing_head(ticker, cached, start_ts, interval):
+            # Backfill history older than anything we have cached
+            older = self.download(ticker, start, pd.Timestamp(cached['time'][0]).to_pydatetime(), interval)
+            cached = self.merge(older[older['time'] < cached['time'][0]], cached)
+            backfilled_to = start_ts
+
+        # Re-download the last cached bar as well: it may still have been forming when stored
+        fetch_start = pd.Timestamp(cached['time'][-1]).to_pydatetime() if len(cached) else start
+        if fetch_start < end:
+            cached = self.merge(cached, self.download(ticker, fetch_start, end, interval))
+
+        self.checked(ticker, cached, not np.array_equal(cached, original), interval, backfilled_to)
+        self.evict()
+        return cached
+
+    def history(self, ticker, start, end, interval='1d'):
+        """Return OHLCV bars in [start, end) as a DataFrame, downloading only the missing head and tail."""
+        start_ts = np.datetime64(pd.Timestamp(start).to_pydatetime(), 's')
+        bars = self.load(ticker, interval)
+        covered = not self.missing_head(ticker, bars, start_ts, interval)
+        if self.offline or (self.is_fresh(ticker, interval) and covered):
+            if not covered:
+                print(f"Price cache for {ticker} starts at {bars['time'][0]}, after the requested {start_ts}")
+        else:
+            try:
+                bars = self.refresh(ticker, start, end, interval)
+            except Exception as e:
+                # Serve stale data rather than failing when Yahoo Finance is unreachable
+                print(f"Price cache refresh failed for {ticker}: {e}")
+                bars = self.load(ticker, interval)
+
+        end_ts = np.datetime64(pd.Timestamp(end).to_pydatetime(), 's')
+        window = bars[(bars['time'] >= start_ts) & (bars['time'] < end_ts)]
+        return bars_to_frame(window)
+
+    def download_many(self, tickers, start, end, interval='1d'):
+        """One multi-ticker yf.download call, split back into per-ticker bar arrays."""
+        import yfinance as yf
+        frame = yf.download(list(tickers), start=start, end=end, interval=interval,
+                            group_by='ticker', progress=False)
+        bars = {}
+        for ticker in tickers:
+            if isinstance(frame.columns, pd.MultiIndex) and ticker in frame.columns.get_level_values(0):
+                bars[ticker] = frame_to_bars(normalize_download(frame[ticker]))
+            elif len(tickers) == 1:
+                bars[ticker] = frame_to_bars(normalize_download(frame, ticker))
+            else:
+                bars[ticker] = np.empty(0, dtype=BAR_DTYPE)
+        return bars
+
+    def history_many(self, tickers, start, end, interval='1d'):
+        """Like history() for many tickers, refreshing every stale ticker with a single download."""
+        start_ts = np.datetime64(pd.Timestamp(start).to_pydatetime(), 's')
+        end_ts = np.datetime64(pd.Timestamp(end).to_pydatetime(), 's')
+        cached = {ticker: np.array(self.load(ticker, interval)) for ticker in tickers}
+
+        missing_head = {t: self.missing_head(t, cached[t], start_ts, interval) for t in tickers}
+        if self.offline:
+            stale = []
+            for ticker in tickers:
+                if missing_head[ticker]:
+                    print(f"Price cache for {ticker} starts at {cached[ticker]['time'][0]}, after the requested {start_ts}")
+        else:
+            stale = [t for t in tickers if missing_head[t] or not self.is_fresh(t, interval)]
+        if stale:
+            # Start the shared download at the earliest bar any stale ticker is missing
+            fetch_starts = []
+            for ticker in stale:
+                bars = cached[ticker]
+                if len(bars) == 0 or missing_head[ticker]:
+                    fetch_starts.append(pd.Timestamp(start).to_pydatetime())
+                else:
+                    fetch_starts.append(pd.Timestamp(bars['time'][-1]).to_pydatetime())
+            try:
+                downloaded = self.download_many(stale, min(fetch_starts), end, interval)
+                for ticker in stale:
+                    merged = self.merge(cached[ticker], downloaded[ticker])
+                    changed = not np.array_equal(merged, cached[ticker])
+                    cached[ticker] = merged
+                    self.checked(ticker, merged, changed, interval, start_ts if missing_head[ticker] else None)
+                self.evict()
+            except Exception as e:
+                print(f"Price cache batch refresh failed for {', '.join(stale)}: {e}")
+
+        frames = {}
+        for ticker, bars in cached.items():
+            window = bars[(bars['time'] >= start_ts) & (bars['time'] < end_ts)]
+            frames[ticker] = bars_to_frame(window)
+        return frames
+
+    # --- Eviction ---
+
+    def evict(self):
+        """Drop files not refreshed for `max_age_days`, then the least recently refreshed beyond `max_tickers`."""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.npy'):
+                path = os.path.join(self.cache_dir, filename)
+                entries.append((self.last_checked(path), path))
+
+        now = time.time()
+        if self.max_age_days is not None:
+            expired = [entry for entry in entries if now - entry[0] > self.max_age_days * 86400]
+            for _, path in expired:
+                self.remove(path)
+            entries = [entry for entry in entries if entry not in expired]
+
+        if self.max_tickers is not None and len(entries) > self.max_tickers:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_tickers]:
+                self.remove(path)
+
+    def remove(self, path):
+        os.remove(path)
+        if os.path.exists(meta_path(path)):
+            os.remove(meta_path(path))
+
+
+def cache_from_env():
+    """Build the agent's price cache from PRICE_CACHE_* environment variables."""
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.price_cache')
+    max_tickers = os.getenv("PRICE_CACHE_MAX_TICKERS")
+    max_age_days = os.getenv("PRICE_CACHE_MAX_AGE_DAYS")
+    return PriceCache(
+        cache_dir=os.getenv("PRICE_CACHE_DIR", default_dir),
+        offline=os.getenv("PRICE_CACHE_OFFLINE", "false").lower() == "true",
+        refresh_seconds=float(os.getenv("PRICE_CACHE_REFRESH_SECONDS", "900")),
+        max_tickers=int(max_tickers) if max_tickers else None,
+        max_age_days=float(max_age_days) if max_age_days else None,
+    )
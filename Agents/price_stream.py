@@ -0,0 +1,217 @@
+"""
+Tick sources for the Markov agent's streaming mode.
+A source is an async iterator of Tick(ticker, time, price). ReplayTickSource replays cached bars
+(for demos and tests), WebSocketTickSource reads JSON ticks from a websocket feed, and serve_ticks
+runs a local websocket stand-in that broadcasts replayed ticks. BarBuilder turns ticks into closed
+bars at the model's resolution, and material_change decides whether a new state is worth pushing.
+Usage: python price_stream.py [port] [TICKER ...]   (serves a replay of the cached daily bars)
+"""
+import json
+import asyncio
+import logging
+import numpy as np
+from typing import NamedTuple
+from bar_ingestion import interval_seconds, iter_cached_bars, ingest
+
+RECONNECT_SECONDS = (1, 2, 5, 10, 30)  # Websocket reconnect backoff schedule
+REPLAY_BARS = 250  # Bars replayed per ticker when no replay start is given
+
+
+class Tick(NamedTuple):
+    ticker: str
+    time: np.datetime64
+    price: float
+
+
+def parse_tick(payload):
+    """Tick from a JSON message {"ticker", "time", "price"}; time is epoch seconds or an ISO string."""
+    data = json.loads(payload) if isinstance(payload, (str, bytes)) else payload
+    raw_time = data['time']
+    if isinstance(raw_time, (int, float)):
+        tick_time = np.datetime64(int(raw_time), 's')
+    else:
+        tick_time = np.datetime64(str(raw_time).rstrip('Z'), 's')
+    return Tick(str(data['ticker']), tick_time, float(data['price']))
+
+
+def format_tick(tick):
+    return json.dumps({'ticker': tick.ticker, 'time': str(tick.time), 'price': tick.price})
+
+
+# --- Tick Sources ---
+
+class ReplayTickSource:
+    """Replays cached bars of several tickers in time order, one tick per bar close.
+
+    `start` skips earlier bars (the stream warm-starts from them instead) and `delay` is the pause
+    between ticks in seconds, so a replay can run as fast as possible or paced like a live feed.
+    """
+
+    def __init__(self, cache, tickers, interval='1d', start=None, delay=0.0):
+        self.cache = cache
+        self.tickers = list(tickers)
+        self.interval = interval
+        self.start = None if start is None else np.datetime64(start, 's')
+        self.delay = delay
+
+    def ticks(self):
+        """All replayed ticks, merged across tickers by bar time."""
+        times, prices, owners = [], [], []
+        for i, ticker in enumerate(self.tickers):
+            bars = self.cache.load(ticker, self.interval, mmap=True)
+            if self.start is not None:
+                bars = bars[bars['time'] >= self.start]
+            times.append(np.asarray(bars['time']))
+            prices.append(np.asarray(bars['Close']))
+            owners.append(np.full(len(bars), i))
+        if not times:
+            return []
+        times, prices, owners = np.concatenate(times), np.concatenate(prices), np.concatenate(owners)
+        order = np.lexsort((owners, times))
+        return [Tick(self.tickers[owners[j]], times[j], float(prices[j])) for j in order if not np.isnan(prices[j])]
+
+    async def __aiter__(self):
+        for tick in self.ticks():
+            yield tick
+            await asyncio.sleep(self.delay)
+
+
+class WebSocketTickSource:
+    """JSON ticks from a websocket feed, reconnecting with backoff when the connection drops.
+
+    On connect it sends {"type": "subscribe", "tickers": [...]}; feeds that ignore the message
+    are fine as long as every tick names its ticker. Disconnects are reported on `logger`
+    (the agent passes ctx.logger).
+    """
+
+    def __init__(self, url, tickers, logger=None):
+        self.url = url
+        self.tickers = list(tickers)
+        self.logger = logger or logging.getLogger(__name__)
+
+    async def __aiter__(self):
+        import websockets
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(self.url) as connection:
+                    attempt = 0
+                    await connection.send(json.dumps({'type': 'subscribe', 'tickers': self.tickers}))
+                    async for payload in connection:
+                        tick = parse_tick(payload)
+                        if tick.ticker in self.tickers:
+                            yield tick
+                reason = "closed by server"
+            except (OSError, websockets.ConnectionClosed) as e:
+                reason = e
+            wait = RECONNECT_SECONDS[min(attempt, len(RECONNECT_SECONDS) - 1)]
+            self.logger.warning(f"Tick feed {self.url} disconnected ({reason}); reconnecting in {wait}s")
+            attempt += 1
+            await asyncio.sleep(wait)
+
+
+def default_replay_start(cache, tickers, interval='1d', n_bars=REPLAY_BARS):
+    """Bar time `n_bars` before the end of the longest cached ticker, so the replay has bars left to stream.
+
+    Stream models warm-start on the bars before this time; without it they would absorb every cached
+    bar and drop the whole replay as already seen.
+    """
+    starts = []
+    for ticker in tickers:
+        times = cache.load(ticker, interval, mmap=True)['time']
+        if len(times):
+            starts.append(times[max(len(times) - n_bars, 0)])
+    return min(starts) if starts else None
+
+
+def open_tick_source(source, tickers, cache=None, interval='1d', replay_start=None, replay_delay=0.0, logger=None):
+    """'replay' replays cached bars; a ws:// or wss:// URL connects to a websocket feed."""
+    if source == 'replay':
+        return ReplayTickSource(cache, tickers, interval, replay_start, replay_delay)
+    if source.startswith(('ws://', 'wss://')):
+        return WebSocketTickSource(source, tickers, logger)
+    raise ValueError(f"Unknown tick source: {source!r}")
+
+
+async def serve_ticks(source, host='127.0.0.1', port=8765):
+    """Local websocket stand-in: every client receives the ticks of a fresh iteration of `source`."""
+    import websockets
+
+    async def handler(connection, *_):
+        async for tick in source:
+            await connection.send(format_tick(tick))
+
+    async with websockets.serve(handler, host, port):
+        await asyncio.Future()
+
+
+# --- Bars And Change Detection ---
+
+class BarBuilder:
+    """Closes one bar per ticker and bucket from a stream of ticks.
+
+    A bar is only complete once a tick from a later bucket arrives, so update() returns the
+    previous bucket's (bar time, close) at that moment and None otherwise.
+    """
+
+    def __init__(self, interval='1d'):
+        self.seconds = interval_seconds(interval)
+        self.open_bars = {}  # ticker -> (bucket, last price)
+
+    def update(self, tick):
+        bucket = int(tick.time.astype('datetime64[s]').astype(np.int64)) // self.seconds
+        current = self.open_bars.get(tick.ticker)
+        if current is not None and bucket < current[0]:
+            return None  # Late tick for a bar that is already closed
+        self.open_bars[tick.ticker] = (bucket, tick.price)
+        if current is None or bucket == current[0]:
+            return None
+        return np.datetime64(current[0] * self.seconds, 's'), current[1]
+
+    def bucket_time(self, ticker):
+        current = self.open_bars.get(ticker)
+        return None if current is None else np.datetime64(current[0] * self.seconds, 's')
+
+
+def state_snapshot(result):
+    """The parts of an analysis tuple that decide whether subscribers need an update."""
+    return {'state': result[2], 'matrix': np.asarray(result[1], dtype=float), 'expected_return': float(result[7])}
+
+
+def material_change(previous, current, matrix_tolerance=0.02, return_tolerance=0.005):
+    """Why `current` differs materially from the last pushed snapshot, or None if it does not."""
+    if previous is None:
+        return "initial state"
+    if current['state'] != previous['state']:
+        return f"state {previous['state']} -> {current['state']}"
+    drift = float(np.abs(current['matrix'] - previous['matrix']).max())
+    if drift > matrix_tolerance:
+        return f"transition probabilities moved {drift:.3f}"
+    change = current['expected_return'] - previous['expected_return']
+    if abs(change) > return_tolerance:
+        return f"expected 30d return moved {change:+.4f}"
+    return None
+
+
+def warm_start_model(cache, ticker, interval='1d', end=None):
+    """Online model fed chunk by chunk with the cached bars of `ticker` that close before `end`."""
+    chunks = iter_cached_bars(cache, ticker, interval)
+    if end is not None:
+        end = np.datetime64(end, 's')
+        chunks = (chunk[chunk['time'] < end] for chunk in chunks)
+    return ingest(chunks, interval, include_partial=True)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from price_cache import cache_from_env
+    args = sys.argv[1:]
+    port = int(args.pop(0)) if args and args[0].isdigit() else 8765
+    tickers = args or ['BTC-USD', 'ETH-USD', 'LTC-USD']
+    cache = cache_from_env()
+    start = os.getenv("MARKOV_STREAM_REPLAY_START") or default_replay_start(
+        cache, tickers, n_bars=int(os.getenv("MARKOV_STREAM_REPLAY_BARS", str(REPLAY_BARS))))
+    replay = ReplayTickSource(cache, tickers, start=start, delay=float(os.getenv("MARKOV_STREAM_REPLAY_DELAY", "0.1")))
+    print(f"Serving replayed ticks for {', '.join(tickers)} on ws://127.0.0.1:{port}")
+    asyncio.run(serve_ticks(replay, port=port))
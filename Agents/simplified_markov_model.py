@@ -1,17 +1,44 @@
 import os
+import time
+import asyncio
+import threading
 import numpy as np
-import yfinance as yf
+import pandas as pd
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
 from uagents import Agent, Context, Model, Protocol
 from uagents.setup import fund_agent_if_low
 from dotenv import load_dotenv
 import warnings
+from markov_kernels import (STATES, NEUTRAL, BEAR, MISSING, classify_returns, count_transitions,
+                            state_return_stats, smoothed_transition_matrix, regime_thresholds,
+                            momentum_from_sma, expected_cumulative_return, right_align,
+                            enhanced_metrics_block)
+from price_cache import cache_from_env
+from online_markov import OnlineMarkovModel
+from response_cache import TTLCache
+from monte_carlo import run_sharded_simulation, run_variance_reduced_simulation
+from higher_order_markov import SparseMarkovChain, classify_quantiles, quantile_state_labels
+from markov_uncertainty import transition_confidence, expected_return_interval
+from stationarity import StationarityService
+from price_stream import (BarBuilder, REPLAY_BARS, open_tick_source, default_replay_start, warm_start_model,
+                          state_snapshot, material_change)
+from model_store import ModelStore, AssetRow
+from joint_markov import JointMarkovChain, decode_joint
 
 warnings.filterwarnings('ignore')
+load_dotenv()
+
+# Local OHLCV store: only the bars missing since the last request are downloaded
+PRICE_CACHE = cache_from_env()
 
 class EnhancedMatrixRequest(Model):
     ticker: str
     name: str
+    n_states: int = 3  # 3 keeps the volatility-adjusted Bull/Neutral/Bear regimes; other values use return quantiles
+    order: int = 1     # Number of past states each transition is conditioned on
+    request_id: str = ""  # Echoed in the response so callers can match concurrent asks
 
 class EnhancedMatrixResponse(Model):
     asset_name: str
@@ -26,8 +53,99 @@ class EnhancedMatrixResponse(Model):
     expected_return_30d: float
     risk_score: float
     relative_strength: float
+    # 95% posterior interval of expected_return_30d under transition-matrix uncertainty
+    expected_return_30d_low: float = 0.0
+    expected_return_30d_high: float = 0.0
+    # ADF test on the daily returns behind the chain ("" method = not tested)
+    is_stationary: bool = True
+    adf_p_value: float = 0.0
+    stationarity_method: str = ""
+    request_id: str = ""
+    matrix_version: str = ""  # Last bar the chain was fitted on; a new version means the matrix may have changed
+    # Order of the chain behind expected_return_30d and its interval; transition_matrix is always first-order,
+    # so above 1 it cannot reproduce those fields
+    transition_order: int = 1
+
+class EnhancedBatchMatrixRequest(Model):
+    tickers: list[str]
+    names: list[str]
+    request_id: str = ""
+
+class EnhancedBatchMatrixResponse(Model):
+    request_id: str = ""
+    results: list[EnhancedMatrixResponse]
+    errors: dict[str, str]  # asset name -> reason, for assets whose analysis failed
+
+class MonteCarloRequest(Model):
+    ticker: str
+    name: str
+    horizon_days: int = 30
+    n_paths: int = 100000
+    target_return: float = 1.1  # Gross multiple, same convention as PlanRequest
+    seed: Optional[int] = None
+    variance_reduction: str = "none"  # none, plain, antithetic, control_variate or sobol
+    ci_width: Optional[float] = None  # Stop once the 95% CI of the expected return is this narrow (n_paths is the budget)
+
+class MonteCarloResponse(Model):
+    asset_name: str
+    horizon_days: int
+    n_paths: int
+    starting_state: str
+    expected_return: float
+    return_std: float
+    quantiles: dict[str, float]
+    var_95: float
+    cvar_95: float
+    target_return: float
+    prob_hit_target: float
+    seed_entropy: str = ""  # Pass back as `seed` to reproduce this run exactly
+    standard_error: float = 0.0  # Of expected_return; only reported for variance-reduced runs
+    error: Optional[str] = None
+
+class MarkovSubscribeRequest(Model):
+    ticker: str
+    name: str
+    subscribe: bool = True  # False cancels the subscription
+
+class MarkovStateUpdate(Model):
+    """Pushed by streaming mode when an asset's state or matrix changes materially"""
+    ticker: str
+    bar_time: str
+    previous_state: str
+    reason: str
+    matrix: EnhancedMatrixResponse
+
+class JointMarkovRequest(Model):
+    tickers: list[str]
+    names: list[str]
+    horizon_days: int = 1
+    # Optional query: P(target in target_state after horizon_days | given {asset name: state} today)
+    target: str = ""
+    target_state: str = "Bull"
+    given: dict[str, str] = {}
+
+class JointMarkovResponse(Model):
+    names: list[str]
+    states: list[str]
+    current_states: dict[str, str]
+    n_joint_states: int
+    n_observed_states: int
+    n_observed_transitions: int
+    # Per-asset marginals of the joint forecast from today's joint state
+    next_state_probabilities: dict[str, dict[str, float]]
+    # "A|B" -> P(A and B both Bear after horizon_days), and its ratio to the product of the marginals
+    both_bear_probabilities: dict[str, float]
+    both_bear_lift: dict[str, float]
+    conditional_probability: Optional[float] = None
+    error: Optional[str] = None
+
+class MarkovStatsRequest(Model):
+    pass
+
+class MarkovStatsResponse(Model):
+    response_cache: dict[str, float]
 
-def get_enhanced_transition_matrix(ticker, name, mock_mode=False):
+def get_enhanced_transition_matrix(ticker, name, mock_mode=False, n_states=3, order=1):
     """Enhanced version that provides more business-relevant metrics"""
     print(f"Fetching and analyzing comprehensive data for {name} ({ticker})...")
 
@@ -89,16 +207,16 @@ def get_enhanced_transition_matrix(ticker, name, mock_mode=False):
         
         return (states, transition_matrix, last_state, state_returns, 
                 state_volatility, trend_momentum, confidence_score, expected_return_30d, 
-                risk_score, relative_strength)
+                risk_score, relative_strength, (expected_return_30d, expected_return_30d))
     
     try:
         # Real data processing
         end_date = datetime.now()
         start_date = end_date - timedelta(days=365)
-        data = yf.download(ticker, start=start_date, end=end_date, progress=False)
+        data = PRICE_CACHE.history(ticker, start_date, end_date)
         
         if data.empty: 
-            return None, None, None, None, None, None, None, None, None, None
+            return None, None, None, None, None, None, None, None, None, None, None
         
         # Calculate returns and technical indicators
         data['Daily_Return'] = data['Close'].pct_change()
@@ -109,7 +227,7 @@ def get_enhanced_transition_matrix(ticker, name, mock_mode=False):
         returns_clean = data['Daily_Return'].dropna()
         
         if len(returns_clean) < 30: 
-            return None, None, None, None, None, None, None, None, None, None
+            return None, None, None, None, None, None, None, None, None, None, None
 
         # Enhanced state definition with volatility consideration
         returns_std = returns_clean.std()
@@ -117,43 +235,32 @@ def get_enhanced_transition_matrix(ticker, name, mock_mode=False):
         
         # Dynamic thresholds based on recent volatility
         recent_volatility = data['Volatility_20'].iloc[-20:].mean()
-        volatility_multiplier = max(0.5, min(2.0, recent_volatility / returns_std))
+        bull_threshold, bear_threshold = regime_thresholds(returns_mean, returns_std, recent_volatility)
         
-        bull_threshold = returns_mean + (returns_std * volatility_multiplier)
-        bear_threshold = returns_mean - (returns_std * volatility_multiplier)
-        
-        def assign_state(return_val):
-            if return_val > bull_threshold: return 'Bull'
-            elif return_val < bear_threshold: return 'Bear'
-            else: return 'Neutral'
-            
-        data['State'] = data['Daily_Return'].apply(assign_state)
-        state_sequence = data['State'].dropna().tolist()
-        states = ['Bull', 'Neutral', 'Bear']
-        state_map = {state: i for i, state in enumerate(states)}
+        # Classify every day and count transitions with the shared NumPy kernels
+        daily_returns = data['Daily_Return'].to_numpy(dtype=float)
+        if n_states == len(STATES):
+            state_codes = classify_returns(daily_returns, bull_threshold, bear_threshold)
+        else:
+            state_codes = classify_quantiles(daily_returns, n_states)
+        observed_codes = state_codes[state_codes != MISSING]
+        states = quantile_state_labels(n_states)
         
         # Build transition matrix with MLE
-        transition_counts = np.zeros((len(states), len(states)))
-        
-        for i in range(len(state_sequence) - 1):
-            from_state = state_map[state_sequence[i]]
-            to_state = state_map[state_sequence[i+1]]
-            transition_counts[from_state, to_state] += 1
+        transition_counts = count_transitions(state_codes, len(states))
         
         alpha = 0.1
-        row_sums = transition_counts.sum(axis=1, keepdims=True)
-        transition_matrix = (transition_counts + alpha) / (row_sums + alpha * len(states))
+        transition_matrix = smoothed_transition_matrix(transition_counts, alpha)
         
         # Calculate enhanced metrics
-        state_returns = data.groupby('State')['Daily_Return'].mean().to_dict()
-        state_volatility = data.groupby('State')['Daily_Return'].std().to_dict()
+        state_counts, state_means, state_stds = state_return_stats(state_codes, daily_returns, len(states))
         
         # Fill missing states
-        for state in states:
-            if state not in state_returns:
-                state_returns[state] = 0.0
-            if state not in state_volatility:
-                state_volatility[state] = returns_std
+        state_returns = {}
+        state_volatility = {}
+        for i, state in enumerate(states):
+            state_returns[state] = float(state_means[i]) if state_counts[i] > 0 else 0.0
+            state_volatility[state] = float(state_stds[i]) if state_counts[i] > 1 else float(returns_std)
         
         # Calculate business metrics
         current_price = data['Close'].iloc[-1]
@@ -161,31 +268,27 @@ def get_enhanced_transition_matrix(ticker, name, mock_mode=False):
         sma_50 = data['SMA_50'].iloc[-1]
         
         # Trend momentum (-1 to 1)
-        trend_momentum = 0.0
-        if not np.isnan(sma_20) and not np.isnan(sma_50):
-            if sma_20 > sma_50 * 1.02:  # Strong uptrend
-                trend_momentum = min(1.0, (sma_20 / sma_50 - 1) * 10)
-            elif sma_20 < sma_50 * 0.98:  # Strong downtrend
-                trend_momentum = max(-1.0, (sma_20 / sma_50 - 1) * 10)
-            else:  # Sideways
-                trend_momentum = (sma_20 / sma_50 - 1) * 5
+        trend = momentum_from_sma(sma_20, sma_50)
         
         # Expected 30-day return based on current state and transitions
-        current_state = state_sequence[-1] if state_sequence else 'Neutral'
-        current_state_idx = state_map[current_state]
+        current_state_idx = int(observed_codes[-1]) if len(observed_codes) else NEUTRAL
+        current_state = states[current_state_idx]
         
         # Simulate 30 days forward
-        expected_return_30d = 0.0
-        state_probs = np.array([0.0, 0.0, 0.0])
-        state_probs[current_state_idx] = 1.0
+        state_return_values = np.array([state_returns[state] for state in states])
+        if order == 1:
+            expected_return_30d = expected_cumulative_return(transition_matrix, state_return_values, current_state_idx, 30)
+            _, low_30d, high_30d = expected_return_interval(transition_counts, state_return_values,
+                                                            current_state_idx, 30, alpha=alpha)
+        else:
+            # Condition on the last `order` states; the returned matrix stays first-order (see transition_order)
+            chain = SparseMarkovChain(n_states, order, alpha).fit(state_codes)
+            expected_return_30d = chain.expected_return(state_return_values, 30)
+            _, low_30d, high_30d = chain.expected_return_interval(state_return_values, 30)
+            print(f"      Order-{order} chain: {chain.n_observed} of {chain.n_contexts} contexts observed")
         
-        for day in range(30):
-            state_probs = state_probs @ transition_matrix
-            daily_expected_return = sum(state_probs[i] * state_returns[states[i]] for i in range(len(states)))
-            expected_return_30d += daily_expected_return
-        
-        # Confidence score based on data quality and state stability
-        confidence_score = min(1.0, len(returns_clean) / 300)  # More data = higher confidence
+        # Confidence score from the width of the Wilson intervals of the transition probabilities
+        confidence_score = transition_confidence(transition_counts)
         
         # Risk score (0 = low risk, 1 = high risk)
         current_volatility = recent_volatility
@@ -197,26 +300,139 @@ def get_enhanced_transition_matrix(ticker, name, mock_mode=False):
         
         print(f"    Enhanced Analysis for {name}:")
         print(f"      Current State: {current_state}")
-        print(f"      Trend Momentum: {trend_momentum:.3f}")
-        print(f"      Expected 30d Return: {expected_return_30d:.4f}")
+        print(f"      Trend Momentum: {trend:.3f}")
+        print(f"      Expected 30d Return: {expected_return_30d:.4f} (95% interval {low_30d:.4f} to {high_30d:.4f})")
+        print(f"      Confidence Score: {confidence_score:.3f}")
         print(f"      Risk Score: {risk_score:.3f}")
         print(f"      Relative Strength: {relative_strength:.3f}")
         
-        return (states, transition_matrix, state_sequence[-1], state_returns, 
-                state_volatility, trend_momentum, confidence_score, expected_return_30d, 
-                risk_score, relative_strength)
+        return (states, transition_matrix, current_state, state_returns, 
+                state_volatility, trend, confidence_score, expected_return_30d, 
+                risk_score, relative_strength, (low_30d, high_30d))
                 
     except Exception as e:
         print(f"Error analyzing {name}: {e}")
-        return None, None, None, None, None, None, None, None, None, None
+        return None, None, None, None, None, None, None, None, None, None, None
+
+def get_enhanced_transition_matrices(tickers, names, mock_mode=False):
+    """Analyze many assets with one multi-ticker download and one vectorized block computation.
+
+    Returns (store, errors): store is a ModelStore indexed by ticker with one row per analyzed
+    asset, errors maps asset name -> reason.
+    """
+    errors = {}
+    if mock_mode:
+        store = ModelStore(len(tickers))
+        for ticker, name in zip(tickers, names):
+            store.add(ticker, name, get_enhanced_transition_matrix(ticker, name, mock_mode=True))
+        return store, errors
+    
+    try:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=365)
+        frames = PRICE_CACHE.history_many(list(tickers), start_date, end_date)
+    except Exception as e:
+        return ModelStore(0), {name: f"Download failed: {e}" for name in names}
+    
+    closes = [frames[ticker]['Close'].dropna().to_numpy(dtype=float) for ticker in tickers]
+    block = enhanced_metrics_block(right_align(closes))
+    
+    for row, name in enumerate(names):
+        if len(closes[row]) == 0:
+            errors[name] = "No price data"
+        elif not block['valid'][row]:
+            errors[name] = f"Only {len(closes[row])} bars of history"
+    store = ModelStore.from_block(list(tickers), list(names), block)
+    
+    print(f"Batch analysis: {len(store)} assets analyzed, {len(errors)} failed ({store.nbytes / 1024:.1f} KiB)")
+    return store, errors
+
+def mock_basket_closes(n_assets, length=366, seed=0):
+    """Synthetic closes driven by one common factor, so mock baskets show correlated regimes"""
+    rng = np.random.default_rng(seed)
+    common = rng.normal(0.001, 0.03, length)
+    returns = 0.8 * common + rng.normal(0.0, 0.015, (n_assets, length))
+    return 100 * np.exp(np.cumsum(returns, axis=1))
+
+def get_joint_markov_analysis(tickers, names, horizon_days=1, target="", target_state="Bull", given=None,
+                              mock_mode=False):
+    """Fit the joint regime chain of a basket and answer the forecast and conditional queries"""
+    if mock_mode:
+        closes = mock_basket_closes(len(tickers))
+    else:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=365)
+        frames = PRICE_CACHE.history_many(list(tickers), start_date, end_date)
+        # Inner-join on dates so every column of the joint chain is the same day for every asset
+        joined = pd.concat([frames[ticker]['Close'] for ticker in tickers], axis=1, join='inner').dropna()
+        closes = joined.to_numpy(dtype=float).T
+    
+    states = list(STATES)
+    chain = JointMarkovChain(len(tickers)).fit(enhanced_metrics_block(closes)['state_codes'])
+    if chain.last_state == MISSING:
+        raise ValueError("no bar where every asset has a state")
+    
+    forecast = chain.forecast(chain.last_state, horizon_days)
+    marginals = [chain.marginal(forecast, [i]) for i in range(len(names))]
+    both_bear, lift = {}, {}
+    for i in range(len(names)):
+        for j in range(i + 1, len(names)):
+            key = f"{names[i]}|{names[j]}"
+            both_bear[key] = float(chain.marginal(forecast, [i, j])[BEAR, BEAR])
+            independent = marginals[i][BEAR] * marginals[j][BEAR]
+            lift[key] = float(both_bear[key] / independent) if independent > 0 else 0.0
+    
+    conditional = None
+    if target:
+        conditional = chain.conditional_probability(
+            names.index(target), states.index(target_state),
+            {names.index(name): states.index(state) for name, state in (given or {}).items()}, horizon_days)
+    
+    current = decode_joint(chain.last_state, len(names), len(states))
+    print(f"Joint chain for {', '.join(names)}: {chain.n_observed_states} of {chain.n_joint} joint states observed")
+    return {
+        'current_states': {name: states[code] for name, code in zip(names, current)},
+        'n_joint_states': chain.n_joint,
+        'n_observed_states': chain.n_observed_states,
+        'n_observed_transitions': chain.n_observed_transitions,
+        'next_state_probabilities': {name: dict(zip(states, marginal.tolist())) for name, marginal in zip(names, marginals)},
+        'both_bear_probabilities': both_bear,
+        'both_bear_lift': lift,
+        'conditional_probability': conditional,
+    }
 
 # --- Enhanced Agent Setup ---
-load_dotenv()
 AGENT_PORT = 8000
 AGENT_SEED = os.getenv("MARKOV_MODEL_SEED", "markov_model_secret_seed_phrase")
 AGENT_NAME = "simplified_markov_model_agent"
 MOCK_MODE = os.getenv("MOCK_MODE", "false").lower() == "true"
 
+# Parameters that change the analysis output; part of every response cache key
+MODEL_PARAMS = ("1d", 365, 0.1, MOCK_MODE)
+RESPONSE_CACHE = TTLCache(
+    maxsize=int(os.getenv("MATRIX_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("MATRIX_CACHE_TTL_SECONDS", "900"))
+)
+
+# Blocking yfinance/pandas work runs in a worker pool so the event loop keeps serving messages
+MARKOV_EXECUTOR = os.getenv("MARKOV_EXECUTOR", "thread").lower()  # "thread" or "process"
+MARKOV_WORKERS = int(os.getenv("MARKOV_WORKERS", "4"))
+MARKOV_MAX_PENDING = int(os.getenv("MARKOV_MAX_PENDING", "32"))
+MARKOV_REQUEST_TIMEOUT = float(os.getenv("MARKOV_REQUEST_TIMEOUT", "60"))
+MC_MAX_PATHS = int(os.getenv("MC_MAX_PATHS", "5000000"))
+MC_WORKERS = int(os.getenv("MC_WORKERS", str(os.cpu_count() or 1)))
+STATIONARITY = StationarityService()  # ADF screen results cached per (ticker, last bar, length)
+
+# Streaming mode: "" (off), "replay" (cached bars) or a ws:// tick feed
+STREAM_SOURCE = os.getenv("MARKOV_STREAM_SOURCE", "")
+STREAM_TICKERS = [t.strip() for t in os.getenv("MARKOV_STREAM_TICKERS", "BTC-USD,ETH-USD,LTC-USD").split(",") if t.strip()]
+STREAM_INTERVAL = os.getenv("MARKOV_STREAM_INTERVAL", "1d")
+STREAM_REPLAY_START = os.getenv("MARKOV_STREAM_REPLAY_START") or None  # Replay bars from this date on
+STREAM_REPLAY_BARS = int(os.getenv("MARKOV_STREAM_REPLAY_BARS", str(REPLAY_BARS)))  # Else replay the last N bars
+STREAM_REPLAY_DELAY = float(os.getenv("MARKOV_STREAM_REPLAY_DELAY", "0"))
+STREAM_MATRIX_TOLERANCE = float(os.getenv("MARKOV_STREAM_MATRIX_TOLERANCE", "0.02"))
+STREAM_RETURN_TOLERANCE = float(os.getenv("MARKOV_STREAM_RETURN_TOLERANCE", "0.005"))
+
 agent = Agent(
     name=AGENT_NAME,
     port=AGENT_PORT,
@@ -224,17 +440,211 @@ agent = Agent(
     endpoint=[f"http://127.0.0.1:{AGENT_PORT}/submit"]
 )
 
-data_protocol = Protocol("EnhancedMarkovData")
+# --- Online Models ---
+# One incremental model per ticker; persisted in agent storage (one key per ticker) so restarts are warm
+ONLINE_MODELS = {}
+MODEL_LOCK = threading.Lock()
+STORAGE_LOCK = threading.Lock()  # Agent storage rewrites one JSON file per set, so writes must not overlap
 
-@data_protocol.on_message(model=EnhancedMatrixRequest, replies=EnhancedMatrixResponse)
-async def on_enhanced_matrix_request(ctx: Context, sender: str, msg: EnhancedMatrixRequest):
-    ctx.logger.info(f"Received enhanced matrix request for {msg.name} from {sender}")
+def get_online_model(ticker):
+    model = ONLINE_MODELS.get(ticker)
+    if model is None:
+        # Older versions kept every model under one "online_models" key
+        with STORAGE_LOCK:
+            saved = agent.storage.get(f"online_model:{ticker}") or (agent.storage.get("online_models") or {}).get(ticker)
+        if saved:
+            model = OnlineMarkovModel.from_dict(saved)
+            ONLINE_MODELS[ticker] = model
+    return model
+
+def save_online_model(ticker, state):
+    with STORAGE_LOCK:
+        agent.storage.set(f"online_model:{ticker}", state)
+
+def analyze_asset(ticker, name):
+    """Serve metrics from the ticker's online model, feeding it only bars it has not seen yet"""
+    if MOCK_MODE:
+        return get_enhanced_transition_matrix(ticker, name, mock_mode=True)
     
-    result = get_enhanced_transition_matrix(msg.ticker, msg.name, mock_mode=MOCK_MODE)
+    try:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=365)
+        data = PRICE_CACHE.history(ticker, start_date, end_date)
+        
+        # Today's bar is still forming, so the model only absorbs closed bars
+        bar_times = data.index.values
+        closed = bar_times < np.datetime64(end_date.date())
+        closes = data['Close'].to_numpy(dtype=float)[closed]
+        bar_times = bar_times[closed]
+        
+        state = None
+        with MODEL_LOCK:
+            model = get_online_model(ticker)
+            if model is None or model.last_bar_time is None:
+                model = OnlineMarkovModel().fit(closes, bar_times)
+                ONLINE_MODELS[ticker] = model
+                state = model.to_dict()
+            else:
+                new_bars = bar_times > np.datetime64(model.last_bar_time)
+                if new_bars.any():
+                    model.update_chunk(closes[new_bars], bar_times[new_bars])
+                    state = model.to_dict()
+            result = model.metrics()
+        
+        # Only this ticker's model changed, and only when it absorbed new bars
+        if state is not None:
+            try:
+                save_online_model(ticker, state)
+            except Exception as e:
+                # The in-memory model is updated either way; only the warm restart is lost
+                print(f"Saving the online model for {name} failed: {e}")
+        
+        if result[0] is not None:
+            print(f"    Online model for {name}: state {result[2]}, expected 30d return {result[7]:.4f}")
+        return result
+    except Exception as e:
+        print(f"Error analyzing {name}: {e}")
+        return None, None, None, None, None, None, None, None, None, None, None
+
+# --- Worker Pool ---
+_executor = None
+_pending_jobs = 0
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if MARKOV_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=MARKOV_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=MARKOV_WORKERS, thread_name_prefix="markov")
+    return _executor
+
+def _job_finished(future):
+    global _pending_jobs
+    _pending_jobs -= 1
+
+def analysis_method(n_states=len(STATES), order=1):
+    """'online' for the incremental per-ticker models, 'full_sample' for the stateless fit.
+
+    Worker processes cannot share the online models, and the online models only track the
+    default 3-state first-order chain, so everything else runs the full-sample analysis.
+    """
+    if MARKOV_EXECUTOR == "process" or (n_states, order) != (len(STATES), 1):
+        return "full_sample"
+    return "online"
+
+def analysis_cache_key(ticker, name, n_states=len(STATES), order=1, method="full_sample"):
+    # The online models classify with running thresholds, so their results never share a key with full-sample fits
+    return (ticker, name, datetime.now().date().isoformat(), MODEL_PARAMS, n_states, order, method)
+
+async def submit_job(func, *args):
+    """Run a blocking job in the worker pool, bounded by MARKOV_MAX_PENDING and MARKOV_REQUEST_TIMEOUT"""
+    global _pending_jobs
+    if _pending_jobs >= MARKOV_MAX_PENDING:
+        raise RuntimeError(f"analysis queue is full ({_pending_jobs} jobs pending)")
     
+    future = asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+    _pending_jobs += 1
+    future.add_done_callback(_job_finished)
+    
+    # shield() keeps the job counted until the worker actually finishes, even after a timeout
+    return await asyncio.wait_for(asyncio.shield(future), timeout=MARKOV_REQUEST_TIMEOUT)
+
+async def run_analysis(ticker, name, n_states=len(STATES), order=1):
+    """Serve from the response cache or run the analysis in the worker pool with a timeout"""
+    method = analysis_method(n_states, order)
+    key = analysis_cache_key(ticker, name, n_states, order, method)
+    result = RESPONSE_CACHE.get(key)
+    if isinstance(result, AssetRow):  # Cached by the batch path
+        return result.result()
+    if result is not None:
+        return result
+    
+    if method == "full_sample":
+        result = await submit_job(get_enhanced_transition_matrix, ticker, name, MOCK_MODE, n_states, order)
+    else:
+        result = await submit_job(analyze_asset, ticker, name)
+    
+    if result[0] is not None:  # Never cache failures
+        RESPONSE_CACHE.set(key, result)
+    return result
+
+async def run_batch_analysis(tickers, names):
+    """Serve cached assets directly and analyze the rest together in one full-sample worker job"""
+    results, errors = {}, {}
+    missing_tickers, missing_names = [], []
+    for ticker, name in zip(tickers, names):
+        cached = RESPONSE_CACHE.get(analysis_cache_key(ticker, name, method="full_sample"))
+        if cached is not None:
+            results[name] = cached
+        else:
+            missing_tickers.append(ticker)
+            missing_names.append(name)
+    
+    if missing_tickers:
+        store, errors = await submit_job(get_enhanced_transition_matrices, missing_tickers, missing_names, MOCK_MODE)
+        for ticker, name in zip(missing_tickers, missing_names):
+            if ticker in store:
+                # The cache keeps row references into the store, not per-asset copies
+                RESPONSE_CACHE.set(analysis_cache_key(ticker, name, method="full_sample"), store[ticker])
+                results[name] = store[ticker]
+            elif name not in errors:
+                errors[name] = "No data"
+    return results, errors
+
+def simulate_from_analysis(result, horizon_days, n_paths, target_return, seed=None,
+                           variance_reduction="none", ci_width=None):
+    """Run the Monte Carlo engine on a fitted chain (an analysis tuple)"""
+    states, matrix, last_state, state_returns, state_volatility = result[:5]
+    state_means = np.array([state_returns[state] for state in states])
+    state_vols = np.array([state_volatility[state] for state in states])
+    if variance_reduction != "none" or ci_width is not None:
+        strategy = "plain" if variance_reduction == "none" else variance_reduction
+        return run_variance_reduced_simulation(matrix, state_means, state_vols, states.index(last_state),
+                                               horizon_days, n_paths, target_wealth=target_return,
+                                               strategy=strategy, ci_width=ci_width, seed=seed)
+    # A process-executor job already runs in a worker, which must not start a pool of its own
+    n_workers = 1 if MARKOV_EXECUTOR == "process" else MC_WORKERS
+    return run_sharded_simulation(matrix, state_means, state_vols, states.index(last_state),
+                                  horizon_days, n_paths, target_wealth=target_return, seed=seed,
+                                  n_workers=n_workers)
+
+def check_stationarity(tickers):
+    """ADF screen of the last year of daily returns for every ticker in one batched regression"""
+    if MOCK_MODE:
+        return {}
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=365)
+    frames = PRICE_CACHE.history_many(list(tickers), start_date, end_date)
+    series, window_ends = {}, {}
+    for ticker in tickers:
+        closes = frames[ticker]['Close'].dropna()
+        if len(closes):
+            series[ticker] = closes.pct_change().to_numpy(dtype=float)[1:]
+            window_ends[ticker] = closes.index[-1]
+    return STATIONARITY.check_many(series, window_ends)
+
+async def run_stationarity(ctx, tickers):
+    """Stationarity results keyed by ticker; a failed screen only drops the fields from the response"""
+    try:
+        return await submit_job(check_stationarity, tickers)
+    except Exception as e:
+        ctx.logger.warning(f"Stationarity screen failed: {e}")
+        return {}
+
+def matrix_version(ticker):
+    """Last closed bar absorbed by the ticker's online model, or the analysis day if none tracks it"""
+    model = ONLINE_MODELS.get(ticker)
+    bar_time = model.last_bar_time if model is not None and model.last_bar_time else datetime.now().date()
+    return str(np.datetime64(bar_time, 's'))
+
+def build_matrix_response(name, result, stationarity=None, request_id="", version="", order=1):
+    """Convert an analysis tuple or store row into the EnhancedMatrixResponse message"""
+    if isinstance(result, AssetRow):
+        result = result.result()
     if result[0] is None:  # No data
-        await ctx.send(sender, EnhancedMatrixResponse(
-            asset_name=msg.name, 
+        return EnhancedMatrixResponse(
+            asset_name=name, 
             transition_matrix=[], 
             states=[], 
             last_known_state="Error", 
@@ -244,16 +654,24 @@ async def on_enhanced_matrix_request(ctx: Context, sender: str, msg: EnhancedMat
             confidence_score=0.0,
             expected_return_30d=0.0,
             risk_score=1.0,
-            relative_strength=0.0
-        ))
-        return
+            relative_strength=0.0,
+            request_id=request_id,
+            matrix_version=version,
+            transition_order=order
+        )
     
     (states, matrix, last_state, state_returns, state_volatility, 
      trend_momentum, confidence_score, expected_return_30d, 
-     risk_score, relative_strength) = result
+     risk_score, relative_strength, (low_30d, high_30d)) = result
     
-    await ctx.send(sender, EnhancedMatrixResponse(
-        asset_name=msg.name,
+    stationarity_fields = {}
+    if stationarity:
+        stationarity_fields = dict(is_stationary=stationarity['is_stationary'],
+                                   adf_p_value=stationarity['p_value'],
+                                   stationarity_method=stationarity['method'])
+    
+    return EnhancedMatrixResponse(
+        asset_name=name,
         transition_matrix=matrix.tolist(),
         states=states,
         last_known_state=last_state,
@@ -263,9 +681,252 @@ async def on_enhanced_matrix_request(ctx: Context, sender: str, msg: EnhancedMat
         confidence_score=confidence_score,
         expected_return_30d=expected_return_30d,
         risk_score=risk_score,
-        relative_strength=relative_strength
+        relative_strength=relative_strength,
+        expected_return_30d_low=low_30d,
+        expected_return_30d_high=high_30d,
+        request_id=request_id,
+        matrix_version=version,
+        transition_order=order,
+        **stationarity_fields
+    )
+
+# --- Streaming Mode ---
+# Stream models are separate from the request path's so replays never touch the persisted models
+STREAM_MODELS = {}
+STREAM_SNAPSHOTS = {}    # Last pushed (or warm-start) snapshot per ticker
+STREAM_SUBSCRIBERS = {}  # ticker -> {subscriber address: asset name}
+_stream_task = None
+
+def warm_start_stream_models(tickers, end):
+    """Fit every stream model on the cached bars that close before the first streamed bar"""
+    for ticker in tickers:
+        model = warm_start_model(PRICE_CACHE, ticker, STREAM_INTERVAL, end)
+        STREAM_MODELS[ticker] = model
+        result = model.metrics()
+        if result[0] is not None:
+            STREAM_SNAPSHOTS[ticker] = state_snapshot(result)
+        print(f"    Stream model for {ticker}: last bar {model.last_bar_time}")
+
+def absorb_bar(ticker, close, bar_time):
+    """Add one closed bar to the ticker's stream model.
+
+    Returns (analysis tuple, previous snapshot, reason); reason is None unless the change is material.
+    """
+    model = STREAM_MODELS.setdefault(ticker, OnlineMarkovModel())
+    if model.last_bar_time is not None and bar_time <= np.datetime64(model.last_bar_time):
+        return None, None, None
+    model.update(close, bar_time)
+    result = model.metrics()
+    if result[0] is None:
+        return result, None, None
+    previous = STREAM_SNAPSHOTS.get(ticker)
+    snapshot = state_snapshot(result)
+    reason = material_change(previous, snapshot, STREAM_MATRIX_TOLERANCE, STREAM_RETURN_TOLERANCE)
+    if reason is not None:
+        STREAM_SNAPSHOTS[ticker] = snapshot
+    return result, previous, reason
+
+async def push_state_update(ctx, ticker, bar_time, previous, reason, result, subscribers=None):
+    subscribers = STREAM_SUBSCRIBERS.get(ticker, {}) if subscribers is None else subscribers
+    for address, name in subscribers.items():
+        await ctx.send(address, MarkovStateUpdate(
+            ticker=ticker,
+            bar_time=str(bar_time),
+            previous_state=previous['state'] if previous else "",
+            reason=reason,
+            matrix=build_matrix_response(name, result, version=str(np.datetime64(bar_time, 's')))
+        ))
+
+async def run_stream(ctx):
+    """Consume the tick source, close bars and push material state changes to subscribers"""
+    bars = BarBuilder(STREAM_INTERVAL)
+    replay_start = None
+    if STREAM_SOURCE == "replay":
+        # Warm-start and replay split at the same bar, so every replayed bar is new to the stream models
+        replay_start = STREAM_REPLAY_START or await asyncio.to_thread(
+            default_replay_start, PRICE_CACHE, STREAM_TICKERS, STREAM_INTERVAL, STREAM_REPLAY_BARS)
+        warm_end = replay_start
+    else:
+        # Live: the current bar is still forming, so warm-start on the bars before it
+        bucket = int(time.time()) // bars.seconds * bars.seconds
+        warm_end = np.datetime64(bucket, 's')
+    await asyncio.to_thread(warm_start_stream_models, STREAM_TICKERS, warm_end)
+    
+    source = open_tick_source(STREAM_SOURCE, STREAM_TICKERS, PRICE_CACHE, STREAM_INTERVAL,
+                              replay_start, STREAM_REPLAY_DELAY, ctx.logger)
+    ctx.logger.info(f"Streaming {STREAM_INTERVAL} bars for {', '.join(STREAM_TICKERS)} from {STREAM_SOURCE}")
+    n_bars = n_pushed = 0
+    async for tick in source:
+        closed = bars.update(tick)
+        if closed is None:
+            continue
+        received = time.perf_counter()
+        bar_time, close = closed
+        result, previous, reason = absorb_bar(tick.ticker, close, bar_time)
+        n_bars += 1
+        subscribers = STREAM_SUBSCRIBERS.get(tick.ticker)
+        if reason is None or not subscribers:
+            continue
+        await push_state_update(ctx, tick.ticker, bar_time, previous, reason, result)
+        n_pushed += 1
+        ctx.logger.info(f"{tick.ticker} {bar_time}: {reason}; pushed to {len(subscribers)} subscribers in "
+                        f"{(time.perf_counter() - received) * 1000:.1f} ms ({n_pushed} updates over {n_bars} bars)")
+    ctx.logger.info(f"Tick source finished after {n_bars} bars, {n_pushed} updates")
+
+async def run_stream_logged(ctx):
+    try:
+        await run_stream(ctx)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        ctx.logger.error(f"Streaming mode stopped: {e}")
+
+data_protocol = Protocol("EnhancedMarkovData")
+
+@data_protocol.on_message(model=EnhancedMatrixRequest, replies=EnhancedMatrixResponse)
+async def on_enhanced_matrix_request(ctx: Context, sender: str, msg: EnhancedMatrixRequest):
+    ctx.logger.info(f"Received enhanced matrix request for {msg.name} from {sender}")
+    
+    try:
+        SparseMarkovChain(msg.n_states, msg.order)  # Validates the requested state space
+        result = await run_analysis(msg.ticker, msg.name, msg.n_states, msg.order)
+    except asyncio.TimeoutError:
+        ctx.logger.error(f"Analysis for {msg.name} timed out after {MARKOV_REQUEST_TIMEOUT:.0f}s")
+        result = (None,) * 11
+    except Exception as e:
+        ctx.logger.error(f"Analysis for {msg.name} failed: {e}")
+        result = (None,) * 11
+    
+    stationarity = await run_stationarity(ctx, [msg.ticker]) if result[0] is not None else {}
+    await ctx.send(sender, build_matrix_response(msg.name, result, stationarity.get(msg.ticker), msg.request_id,
+                                                 matrix_version(msg.ticker), msg.order))
+
+@data_protocol.on_message(model=EnhancedBatchMatrixRequest, replies=EnhancedBatchMatrixResponse)
+async def on_enhanced_batch_matrix_request(ctx: Context, sender: str, msg: EnhancedBatchMatrixRequest):
+    ctx.logger.info(f"Received batch matrix request for {len(msg.tickers)} assets from {sender}")
+    
+    if len(msg.tickers) != len(msg.names):
+        await ctx.send(sender, EnhancedBatchMatrixResponse(
+            request_id=msg.request_id, results=[], errors={"request": "tickers and names differ in length"}
+        ))
+        return
+    
+    try:
+        results, errors = await run_batch_analysis(msg.tickers, msg.names)
+    except asyncio.TimeoutError:
+        results, errors = {}, {name: f"Timed out after {MARKOV_REQUEST_TIMEOUT:.0f}s" for name in msg.names}
+    except Exception as e:
+        results, errors = {}, {name: str(e) for name in msg.names}
+    
+    stationarity = await run_stationarity(ctx, [t for t, n in zip(msg.tickers, msg.names) if n in results])
+    responses = [build_matrix_response(name, results[name], stationarity.get(ticker), version=matrix_version(ticker))
+                 for ticker, name in zip(msg.tickers, msg.names) if name in results]
+    await ctx.send(sender, EnhancedBatchMatrixResponse(request_id=msg.request_id, results=responses, errors=errors))
+
+@data_protocol.on_message(model=MonteCarloRequest, replies=MonteCarloResponse)
+async def on_monte_carlo_request(ctx: Context, sender: str, msg: MonteCarloRequest):
+    ctx.logger.info(f"Received Monte Carlo request for {msg.name} ({msg.n_paths} paths, {msg.horizon_days}d) from {sender}")
+    n_paths = max(1, min(msg.n_paths, MC_MAX_PATHS))
+    
+    def failure(reason):
+        return MonteCarloResponse(
+            asset_name=msg.name, horizon_days=msg.horizon_days, n_paths=0, starting_state="Error",
+            expected_return=0.0, return_std=0.0, quantiles={}, var_95=0.0, cvar_95=0.0,
+            target_return=msg.target_return, prob_hit_target=0.0, error=reason
+        )
+    
+    try:
+        result = await run_analysis(msg.ticker, msg.name)
+        if result[0] is None:
+            await ctx.send(sender, failure("No data"))
+            return
+        summary = await submit_job(simulate_from_analysis, result, msg.horizon_days, n_paths,
+                                   msg.target_return, msg.seed, msg.variance_reduction, msg.ci_width)
+    except asyncio.TimeoutError:
+        await ctx.send(sender, failure(f"Timed out after {MARKOV_REQUEST_TIMEOUT:.0f}s"))
+        return
+    except Exception as e:
+        await ctx.send(sender, failure(str(e)))
+        return
+    
+    ctx.logger.info(f"Monte Carlo for {msg.name}: mean {summary['expected_return']:.2%}, "
+                    f"VaR95 {summary['var']:.2%}, P(hit {msg.target_return}) {summary['prob_hit_target']:.1%}")
+    await ctx.send(sender, MonteCarloResponse(
+        asset_name=msg.name,
+        horizon_days=msg.horizon_days,
+        n_paths=summary['n_paths'],
+        starting_state=result[2],
+        expected_return=summary['expected_return'],
+        return_std=summary['return_std'],
+        quantiles=summary['quantiles'],
+        var_95=summary['var'],
+        cvar_95=summary['cvar'],
+        target_return=msg.target_return,
+        prob_hit_target=summary['prob_hit_target'],
+        seed_entropy=summary['seed_entropy'],
+        standard_error=summary.get('standard_errors', {}).get('expected_return', 0.0)
     ))
 
+@data_protocol.on_message(model=JointMarkovRequest, replies=JointMarkovResponse)
+async def on_joint_markov_request(ctx: Context, sender: str, msg: JointMarkovRequest):
+    ctx.logger.info(f"Received joint chain request for {', '.join(msg.names)} from {sender}")
+    
+    def failure(reason):
+        return JointMarkovResponse(
+            names=msg.names, states=list(STATES), current_states={}, n_joint_states=0, n_observed_states=0,
+            n_observed_transitions=0, next_state_probabilities={}, both_bear_probabilities={}, both_bear_lift={},
+            error=reason
+        )
+    
+    unknown = [name for name in [msg.target, *msg.given] if name and name not in msg.names]
+    unknown_states = [state for state in [msg.target_state, *msg.given.values()] if state not in STATES]
+    if len(msg.tickers) != len(msg.names) or not msg.tickers:
+        await ctx.send(sender, failure("tickers and names must be non-empty and of equal length"))
+        return
+    if unknown or unknown_states:
+        await ctx.send(sender, failure(f"unknown assets or states: {unknown + unknown_states}"))
+        return
+    
+    try:
+        JointMarkovChain(len(msg.tickers))  # Validates the basket size
+        analysis = await submit_job(get_joint_markov_analysis, msg.tickers, msg.names, msg.horizon_days,
+                                    msg.target, msg.target_state, msg.given, MOCK_MODE)
+    except asyncio.TimeoutError:
+        await ctx.send(sender, failure(f"Timed out after {MARKOV_REQUEST_TIMEOUT:.0f}s"))
+        return
+    except Exception as e:
+        await ctx.send(sender, failure(str(e)))
+        return
+    
+    await ctx.send(sender, JointMarkovResponse(names=msg.names, states=list(STATES), **analysis))
+
+@data_protocol.on_message(model=MarkovSubscribeRequest)
+async def on_markov_subscribe_request(ctx: Context, sender: str, msg: MarkovSubscribeRequest):
+    subscribers = STREAM_SUBSCRIBERS.setdefault(msg.ticker, {})
+    if not msg.subscribe:
+        subscribers.pop(sender, None)
+        ctx.logger.info(f"{sender} unsubscribed from {msg.ticker}")
+        return
+    is_new = sender not in subscribers
+    subscribers[sender] = msg.name
+    if not is_new:
+        return
+    ctx.logger.info(f"{sender} subscribed to {msg.ticker} updates"
+                    + ("" if STREAM_SOURCE else " (streaming mode is off)"))
+    
+    # New subscribers get the current stream state as their baseline
+    model = STREAM_MODELS.get(msg.ticker)
+    result = model.metrics() if model is not None else (None,)
+    if result[0] is not None:
+        await push_state_update(ctx, msg.ticker, model.last_bar_time, None, "subscribed", result,
+                                {sender: msg.name})
+
+@data_protocol.on_message(model=MarkovStatsRequest, replies=MarkovStatsResponse)
+async def on_markov_stats_request(ctx: Context, sender: str, msg: MarkovStatsRequest):
+    stats = RESPONSE_CACHE.stats()
+    ctx.logger.info(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+    await ctx.send(sender, MarkovStatsResponse(response_cache={k: float(v) for k, v in stats.items()}))
+
 agent.include(data_protocol)
 
 @agent.on_event("startup")
@@ -278,6 +939,17 @@ async def startup(ctx: Context):
         ctx.logger.info("⚠️ Running in MOCK MODE - will generate synthetic data")
     else:
         ctx.logger.info("Running with real data from Yahoo Finance")
+    
+    global _stream_task
+    if STREAM_SOURCE:
+        _stream_task = asyncio.ensure_future(run_stream_logged(ctx))
+
+@agent.on_event("shutdown")
+async def shutdown(ctx: Context):
+    if _stream_task is not None:
+        _stream_task.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
     print(f"Starting {AGENT_NAME} on http://127.0.0.1:{AGENT_PORT}")
@@ -25,6 +25,10 @@ class EnhancedPlanResponse(Model):
     trading_signal: str
     signal_strength: float
     reasoning: str
+    # Expected cumulative return and its standard deviation for holds of 1..time_horizon_days days
+    expected_return_curve: List[float] = []
+    risk_curve: List[float] = []
+    target_probability: float = 0.0  # P(reaching target_return within time_horizon_days)
 
 # Model for sending commands to the Blockchain Agent
 class BlockchainCommand(Model):
@@ -107,22 +111,34 @@ async def start_enhanced_planning_cycle(ctx: Context):
             )
         )
 
+# Latest plan per asset, including plans the planner pushes between cycles on streamed state changes
+LATEST_PLANS = {}
+
 @agent.on_message(model=EnhancedPlanResponse)
 async def handle_enhanced_plan_response(ctx: Context, sender: str, msg: EnhancedPlanResponse):
+    previous = LATEST_PLANS.get(msg.asset_name)
+    LATEST_PLANS[msg.asset_name] = msg
+    
     cycle_running = agent.storage.get("cycle_running")
     if not cycle_running:
+        # A pushed plan only triggers a decision when its signal changed and every asset has a plan
+        if previous is not None and previous.trading_signal != msg.trading_signal \
+                and all(name in LATEST_PLANS for name in ASSETS_TO_ANALYZE):
+            ctx.logger.info(f"Pushed plan for {msg.asset_name}: {previous.trading_signal} -> {msg.trading_signal}")
+            plans = [LATEST_PLANS[name] for name in ASSETS_TO_ANALYZE]
+            await execute_portfolio_decision(make_portfolio_allocation_decision(plans, ctx), plans, ctx)
         return
 
     ctx.logger.info(f"Received enhanced plan for {msg.asset_name} from {sender}.")
     
-    all_plans = agent.storage.get("all_plans") or []
+    # A plan pushed mid-cycle for an asset that already replied replaces it instead of counting as another reply
+    all_plans = [plan for plan in agent.storage.get("all_plans") or [] if plan.asset_name != msg.asset_name]
     all_plans.append(msg)
     agent.storage.set("all_plans", all_plans)
     
-    pending_count = agent.storage.get("pending_responses") or 0
-    if pending_count > 0:
-        pending_count -= 1
-        agent.storage.set("pending_responses", pending_count)
+    received = {plan.asset_name for plan in all_plans}
+    pending_count = sum(1 for name in ASSETS_TO_ANALYZE if name not in received)
+    agent.storage.set("pending_responses", pending_count)
 
     if pending_count == 0:
         await make_enhanced_portfolio_decision(ctx)
@@ -1,9 +1,16 @@
 import os
+import time
+import uuid
 import numpy as np
 from typing import List, Dict, Any, Optional
 from uagents import Agent, Context, Model, Protocol
 from uagents.setup import fund_agent_if_low
 from dotenv import load_dotenv
+from horizon_engine import expected_return_for_state
+from hitting_probability import target_hit_probability
+from response_cache import TTLCache
+from plan_scoring import (PLAN_DTYPE, PLANNER_RULES, SIGNAL_NAMES, ACTION_NAMES, DEFAULT_PLAN, VOLATILITY_SCORE,
+                          score_plans, hold_duration_search, curve_at, reasoning)
 
 # --- Load environment ---
 load_dotenv()
@@ -13,6 +20,9 @@ load_dotenv()
 class EnhancedMatrixRequest(Model):
     ticker: str
     name: str
+    n_states: int = 3  # 3 keeps the volatility-adjusted Bull/Neutral/Bear regimes; other values use return quantiles
+    order: int = 1     # Number of past states each transition is conditioned on
+    request_id: str = ""  # Echoed in the response so callers can match concurrent asks
 
 class EnhancedMatrixResponse(Model):
     asset_name: str
@@ -26,6 +36,41 @@ class EnhancedMatrixResponse(Model):
     expected_return_30d: float
     risk_score: float
     relative_strength: float
+    # 95% posterior interval of expected_return_30d under transition-matrix uncertainty
+    expected_return_30d_low: float = 0.0
+    expected_return_30d_high: float = 0.0
+    # ADF test on the daily returns behind the chain ("" method = not tested)
+    is_stationary: bool = True
+    adf_p_value: float = 0.0
+    stationarity_method: str = ""
+    request_id: str = ""
+    matrix_version: str = ""  # Last bar the chain was fitted on; a new version means the matrix may have changed
+    # Order of the chain behind expected_return_30d and its interval; transition_matrix is always first-order,
+    # so above 1 it cannot reproduce those fields
+    transition_order: int = 1
+
+class EnhancedBatchMatrixRequest(Model):
+    tickers: List[str]
+    names: List[str]
+    request_id: str = ""
+
+class EnhancedBatchMatrixResponse(Model):
+    request_id: str = ""
+    results: List[EnhancedMatrixResponse]
+    errors: Dict[str, str]  # asset name -> reason, for assets whose analysis failed
+
+class MarkovSubscribeRequest(Model):
+    ticker: str
+    name: str
+    subscribe: bool = True  # False cancels the subscription
+
+class MarkovStateUpdate(Model):
+    """Pushed by the Markov agent's streaming mode when an asset's state or matrix changes materially"""
+    ticker: str
+    bar_time: str
+    previous_state: str
+    reason: str
+    matrix: EnhancedMatrixResponse
 
 class PlanRequest(Model):
     ticker: str
@@ -45,12 +90,44 @@ class EnhancedPlanResponse(Model):
     trading_signal: str
     signal_strength: float
     reasoning: str
+    # Expected cumulative return and its standard deviation for holds of 1..time_horizon_days days
+    expected_return_curve: List[float] = []
+    risk_curve: List[float] = []
+    target_probability: float = 0.0  # P(reaching target_return within time_horizon_days)
+
+class BatchPlanRequest(Model):
+    """Plans for a whole universe in one round-trip; every asset shares the goal"""
+    tickers: List[str]
+    names: List[str]
+    target_return: float
+    time_horizon_days: int
+    request_id: str = ""
+
+class BatchPlanResponse(Model):
+    request_id: str
+    plans: List[EnhancedPlanResponse]
+    errors: Dict[str, str]
+
+class PlannerStatsRequest(Model):
+    pass
+
+class PlannerStatsResponse(Model):
+    plan_cache: Dict[str, float]
+    requests: Dict[str, float]
 
 # --- Agent Configuration ---
 AGENT_PORT = 8002
 AGENT_SEED = os.getenv("STRATEGIC_PLANNER_SEED", "strategic_planner_secret_seed")
 AGENT_NAME = "simplified_strategic_planner_agent"
 ENHANCED_MARKOV_AGENT_ADDRESS = os.getenv("MARKOV_MODEL_ADDRESS", "agent1qgvwcpjdcdn87rmynn6y93ny6mgez5mgwvywr8u4sc36kqg70hktxqt7ufr")
+# Waiters still unanswered after this long get the default plan; a later ask re-requests the matrix
+PLAN_REQUEST_TIMEOUT = float(os.getenv("PLAN_REQUEST_TIMEOUT", "90"))
+# Plans keyed by (asset, target_return, time_horizon_days, matrix version); the TTL bounds how long a
+# version is trusted without hearing from the Markov agent, like its own response cache
+PLAN_CACHE = TTLCache(
+    maxsize=int(os.getenv("PLAN_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("PLAN_CACHE_TTL_SECONDS", "900"))
+)
 
 agent = Agent(
     name=AGENT_NAME,
@@ -60,7 +137,16 @@ agent = Agent(
 )
 
 # --- Agent Memory ---
+# Correlation ID -> upstream matrix request with its deadline and every requester waiting on it
 agent.storage.set("pending_requests", {})
+# "ticker_name" -> correlation ID of the matrix request in flight for that asset
+agent.storage.set("in_flight", {})
+REQUEST_STATS = {"upstream": 0, "coalesced": 0, "expired": 0}
+MATRIX_VERSIONS = {}  # Asset name -> latest matrix version seen in a response or streamed update
+ROUND_TRIPS = {"count": 0, "seconds": 0.0, "saved_seconds": 0.0}  # Matrix round-trips and latency saved by cache hits
+# Latest goal and requester per asset; streamed Markov updates are re-planned for them
+agent.storage.set("stream_subscriptions", {})
+agent.storage.set("pending_batches", {})
 
 @agent.on_event("startup")
 async def startup(ctx: Context):
@@ -72,154 +158,384 @@ async def startup(ctx: Context):
 async def handle_enhanced_plan_request(ctx: Context, sender: str, msg: PlanRequest):
     """Handle requests for asset analysis"""
     ctx.logger.info(f"Received plan request for {msg.name} from {sender}")
-
-    # Store the sender to respond later
-    pending_requests = agent.storage.get("pending_requests") or {}
-    request_id = f"{msg.ticker}_{msg.name}"
-    pending_requests[request_id] = {
+    await expire_pending_requests(ctx)
+    
+    waiter = {
         "sender": sender,
         "ticker": msg.ticker,
         "name": msg.name,
         "target_return": msg.target_return,
         "time_horizon_days": msg.time_horizon_days
     }
+    
+    # Subscribe once per asset so state changes are pushed instead of waiting for the next poll;
+    # every requester of the asset keeps its own goal
+    subscriptions = agent.storage.get("stream_subscriptions") or {}
+    if msg.name not in subscriptions:
+        await ctx.send(ENHANCED_MARKOV_AGENT_ADDRESS, MarkovSubscribeRequest(ticker=msg.ticker, name=msg.name))
+    subscriptions.setdefault(msg.name, {})[sender] = {
+        "target_return": msg.target_return,
+        "time_horizon_days": msg.time_horizon_days
+    }
+    agent.storage.set("stream_subscriptions", subscriptions)
+    
+    # A plan for the same goal on the current matrix version needs no downstream round-trip
+    version = MATRIX_VERSIONS.get(msg.name)
+    cached = PLAN_CACHE.get(plan_cache_key(msg.name, msg.target_return, msg.time_horizon_days, version)) \
+        if version else None
+    if cached is not None:
+        saved = ROUND_TRIPS["seconds"] / ROUND_TRIPS["count"] if ROUND_TRIPS["count"] else 0.0
+        ROUND_TRIPS["saved_seconds"] += saved
+        await ctx.send(sender, cached)
+        ctx.logger.info(f"Served cached plan for {msg.name} (matrix {version}, saved ~{saved:.2f}s; "
+                        f"hit rate {PLAN_CACHE.stats()['hit_rate']:.0%})")
+        return
+    
+    # An identical ask already in flight answers this requester too
+    pending_requests = agent.storage.get("pending_requests") or {}
+    in_flight = agent.storage.get("in_flight") or {}
+    asset_key = f"{msg.ticker}_{msg.name}"
+    request_id = in_flight.get(asset_key)
+    if request_id in pending_requests:
+        pending_requests[request_id]["waiters"].append(waiter)
+        agent.storage.set("pending_requests", pending_requests)
+        REQUEST_STATS["coalesced"] += 1
+        ctx.logger.info(f"Joined in-flight request {request_id} for {msg.name} "
+                        f"({len(pending_requests[request_id]['waiters'])} waiters; {REQUEST_STATS['coalesced']} "
+                        f"coalesced vs {REQUEST_STATS['upstream']} sent upstream)")
+        return
+    
+    request_id = uuid.uuid4().hex
+    pending_requests[request_id] = {
+        "ticker": msg.ticker,
+        "name": msg.name,
+        "sent_at": time.time(),
+        "deadline": time.time() + PLAN_REQUEST_TIMEOUT,
+        "waiters": [waiter]
+    }
+    in_flight[asset_key] = request_id
     agent.storage.set("pending_requests", pending_requests)
+    agent.storage.set("in_flight", in_flight)
+    REQUEST_STATS["upstream"] += 1
     
     # Request data from Markov model agent
-    ctx.logger.info(f"Requesting transition matrix for {msg.name}...")
+    ctx.logger.info(f"Requesting transition matrix for {msg.name} ({request_id})...")
     await ctx.send(
         ENHANCED_MARKOV_AGENT_ADDRESS,
-        EnhancedMatrixRequest(ticker=msg.ticker, name=msg.name)
+        EnhancedMatrixRequest(ticker=msg.ticker, name=msg.name, request_id=request_id)
     )
 
 @agent.on_message(model=EnhancedMatrixResponse)
 async def handle_enhanced_matrix_response(ctx: Context, sender: str, msg: EnhancedMatrixResponse):
-    """Process Markov model data and generate trading plan"""
+    """Process Markov model data and generate a trading plan for every waiting requester"""
     ctx.logger.info(f"Received matrix data for {msg.asset_name}")
     
-    # Get original request details
     pending_requests = agent.storage.get("pending_requests") or {}
-    request_id = f"{msg.asset_name}-USD_{msg.asset_name}"
+    request_id = msg.request_id
+    if not request_id:
+        # Markov agents that do not echo request IDs: match the oldest pending ask for the asset
+        request_id = next((rid for rid, request in pending_requests.items() if request["name"] == msg.asset_name), "")
     
-    if request_id not in pending_requests:
-        ctx.logger.warning(f"No pending request found for {msg.asset_name}")
+    request = pending_requests.pop(request_id, None)
+    if request is None:
+        ctx.logger.warning(f"No pending request found for {msg.asset_name} ({msg.request_id or 'no id'})")
         return
+    release_request(request_id, request, pending_requests)
+    ROUND_TRIPS["count"] += 1
+    ROUND_TRIPS["seconds"] += time.time() - request["sent_at"]
+    observe_matrix_version(ctx, msg)
+    
+    for waiter in request["waiters"]:
+        user_goal = {
+            "target_return": waiter["target_return"],
+            "time_horizon_days": waiter["time_horizon_days"]
+        }
+        await send_plan(ctx, msg, waiter["sender"], user_goal)
+
+
+def plan_cache_key(name: str, target_return: float, time_horizon_days: int, version: str):
+    return (name, float(target_return), int(time_horizon_days), version)
+
+
+def observe_matrix_version(ctx: Context, data: EnhancedMatrixResponse):
+    """Track the asset's latest matrix version, dropping its cached plans when the version changes"""
+    if not data.matrix_version or MATRIX_VERSIONS.get(data.asset_name) == data.matrix_version:
+        return
+    previous = MATRIX_VERSIONS.get(data.asset_name)
+    MATRIX_VERSIONS[data.asset_name] = data.matrix_version
+    if previous is not None:
+        dropped = PLAN_CACHE.invalidate(lambda key: key[0] == data.asset_name)
+        ctx.logger.info(f"Matrix for {data.asset_name} moved {previous} -> {data.matrix_version}; "
+                        f"dropped {dropped} cached plans")
+
+
+def release_request(request_id: str, request: dict, pending_requests: dict):
+    """Store the table without a finished request and free its asset for new upstream asks"""
+    agent.storage.set("pending_requests", pending_requests)
+    in_flight = agent.storage.get("in_flight") or {}
+    asset_key = f"{request['ticker']}_{request['name']}"
+    if in_flight.get(asset_key) == request_id:
+        del in_flight[asset_key]
+        agent.storage.set("in_flight", in_flight)
+
+
+async def expire_pending_requests(ctx: Context):
+    """Answer waiters whose matrix request outlived its deadline with the default plan"""
+    pending_requests = agent.storage.get("pending_requests") or {}
+    now = time.time()
+    expired = [rid for rid, request in pending_requests.items() if request["deadline"] <= now]
+    for request_id in expired:
+        request = pending_requests.pop(request_id)
+        release_request(request_id, request, pending_requests)
+        REQUEST_STATS["expired"] += 1
+        ctx.logger.warning(f"Matrix request {request_id} for {request['name']} expired with "
+                           f"{len(request['waiters'])} waiters")
+        for waiter in request["waiters"]:
+            reason = f"Markov agent did not answer within {PLAN_REQUEST_TIMEOUT:.0f}s"
+            await ctx.send(waiter["sender"], create_default_analysis(request["name"], reason))
+
+
+@agent.on_interval(period=10.0)
+async def check_pending_requests(ctx: Context):
+    await expire_pending_requests(ctx)
+
+
+@agent.on_message(model=MarkovStateUpdate)
+async def handle_markov_state_update(ctx: Context, sender: str, msg: MarkovStateUpdate):
+    """Re-plan a streamed state change for every requester of the asset without waiting for a poll"""
+    subscribers = (agent.storage.get("stream_subscriptions") or {}).get(msg.matrix.asset_name)
+    if not subscribers:
+        ctx.logger.warning(f"Update for {msg.matrix.asset_name} without a subscription")
+        return
+    
+    ctx.logger.info(f"Streamed update for {msg.matrix.asset_name} at {msg.bar_time}: {msg.reason}; "
+                    f"re-planning for {len(subscribers)} subscribers")
+    observe_matrix_version(ctx, msg.matrix)
+    for subscriber, user_goal in subscribers.items():
+        await send_plan(ctx, msg.matrix, subscriber, dict(user_goal))
+
+
+@agent.on_message(model=BatchPlanRequest)
+async def handle_batch_plan_request(ctx: Context, sender: str, msg: BatchPlanRequest):
+    """Plan a whole universe from one batch matrix request"""
+    ctx.logger.info(f"Received batch plan request for {len(msg.names)} assets from {sender}")
+    request_id = msg.request_id or uuid.uuid4().hex
+    pending_batches = agent.storage.get("pending_batches") or {}
+    pending_batches[request_id] = {
+        "sender": sender,
+        "request_id": msg.request_id,
+        "target_return": msg.target_return,
+        "time_horizon_days": msg.time_horizon_days
+    }
+    agent.storage.set("pending_batches", pending_batches)
+    await ctx.send(
+        ENHANCED_MARKOV_AGENT_ADDRESS,
+        EnhancedBatchMatrixRequest(tickers=msg.tickers, names=msg.names, request_id=request_id)
+    )
+
+
+@agent.on_message(model=EnhancedBatchMatrixResponse)
+async def handle_enhanced_batch_matrix_response(ctx: Context, sender: str, msg: EnhancedBatchMatrixResponse):
+    pending_batches = agent.storage.get("pending_batches") or {}
+    request = pending_batches.pop(msg.request_id, None)
+    if request is None:
+        ctx.logger.warning(f"No pending batch request {msg.request_id}")
+        return
+    agent.storage.set("pending_batches", pending_batches)
     
-    request = pending_requests[request_id]
     user_goal = {
         "target_return": request["target_return"],
         "time_horizon_days": request["time_horizon_days"]
     }
+    try:
+        analyses = perform_batch_analysis(msg.results, user_goal)
+        plans = [plan_response(data.asset_name, analysis) for data, analysis in zip(msg.results, analyses)]
+    except Exception as e:
+        ctx.logger.error(f"Error scoring batch {msg.request_id}: {e}")
+        plans = [create_default_analysis(data.asset_name, str(e)) for data in msg.results]
     
-    # Generate analysis
-    ctx.logger.info(f"Generating enhanced analysis for {msg.asset_name}")
+    n_buy = sum(plan.trading_signal == "BUY" for plan in plans)
+    ctx.logger.info(f"Scored {len(plans)} assets ({n_buy} BUY, {len(msg.errors)} failed) for batch {msg.request_id}")
+    await ctx.send(request["sender"], BatchPlanResponse(request_id=request["request_id"], plans=plans, errors=msg.errors))
+
+
+async def send_plan(ctx: Context, data: EnhancedMatrixResponse, recipient: str, user_goal: dict):
+    """Generate the plan for one asset and send it, falling back to the default analysis on errors"""
+    ctx.logger.info(f"Generating enhanced analysis for {data.asset_name}")
     try:
-        analysis_result = perform_enhanced_analysis(msg, user_goal, ctx)
-        
-        # Create response
-        response = EnhancedPlanResponse(
-            asset_name=msg.asset_name,
-            action=analysis_result["action"],
-            hold_duration_days=analysis_result["hold_duration"],
-            projected_return=analysis_result["projected_return"],
-            confidence=analysis_result["confidence"],
-            risk_adjusted_score=analysis_result["risk_adjusted_score"],
-            momentum_factor=analysis_result["momentum_factor"],
-            volatility_opportunity=analysis_result["volatility_opportunity"],
-            trading_signal=analysis_result["trading_signal"],
-            signal_strength=analysis_result["signal_strength"],
-            reasoning=analysis_result["reasoning"]
-        )
+        response = plan_response(data.asset_name, perform_enhanced_analysis(data, user_goal, ctx))
+        if data.states and data.matrix_version == MATRIX_VERSIONS.get(data.asset_name):
+            key = plan_cache_key(data.asset_name, user_goal["target_return"], user_goal["time_horizon_days"],
+                                 data.matrix_version)
+            PLAN_CACHE.set(key, response)
         
         # Send response back to original requestor
-        await ctx.send(request["sender"], response)
-        ctx.logger.info(f"Sent analysis for {msg.asset_name} to {request['sender']}")
+        await ctx.send(recipient, response)
+        ctx.logger.info(f"Sent analysis for {data.asset_name} to {recipient}")
     except Exception as e:
-        ctx.logger.error(f"Error processing {msg.asset_name}: {e}")
+        ctx.logger.error(f"Error processing {data.asset_name}: {e}")
         
         # Send default analysis if something went wrong
-        default = create_default_analysis(msg.asset_name, str(e))
-        await ctx.send(request["sender"], default)
-        
-    # Clean up the pending request
-    del pending_requests[request_id]
-    agent.storage.set("pending_requests", pending_requests)
+        default = create_default_analysis(data.asset_name, str(e))
+        await ctx.send(recipient, default)
 
 
-def perform_enhanced_analysis(data: EnhancedMatrixResponse, user_goal: dict, ctx):
-    """Sophisticated analysis that goes beyond just state predictions"""
+def plan_metrics(responses: List[EnhancedMatrixResponse], time_horizon_days: int):
+    """Structured PLAN_DTYPE array with one row per Markov response"""
+    metrics = np.zeros(len(responses), dtype=PLAN_DTYPE)
+    metrics['trend_momentum'] = [data.trend_momentum for data in responses]
+    metrics['expected_return'] = [data.expected_return_30d for data in responses]
+    metrics['risk_score'] = [data.risk_score for data in responses]
+    metrics['confidence'] = [data.confidence_score for data in responses]
+    metrics['time_horizon_days'] = time_horizon_days
+    metrics['has_data'] = [bool(data.states and data.transition_matrix) for data in responses]
+    return metrics
+
+
+def propagates(data: EnhancedMatrixResponse):
+    """True if the response's first-order matrix is the chain behind its expected return"""
+    return bool(data.states and data.transition_matrix) and data.transition_order == 1
+
+
+def chain_groups(responses: List[EnhancedMatrixResponse]):
+    """(rows, matrices, state returns, state volatilities, start states) for each chain size among the responses.
+
+    Higher-order responses are left out: their first-order matrix would give curves that disagree
+    with the order-m expected return they carry.
+    """
+    by_size = {}
+    for i, data in enumerate(responses):
+        if propagates(data):
+            by_size.setdefault(len(data.states), []).append(i)
+    for rows in by_size.values():
+        chains = [responses[i] for i in rows]
+        matrices = np.array([data.transition_matrix for data in chains], dtype=float)
+        state_returns = np.array([[data.state_returns.get(state, 0.0) for state in data.states] for data in chains])
+        state_vols = np.array([[data.state_volatility.get(state, 0.0) for state in data.states] for data in chains])
+        start_states = np.array([data.states.index(data.last_known_state) if data.last_known_state in data.states
+                                 else len(data.states) // 2 for data in chains])
+        yield rows, matrices, state_returns, state_vols, start_states
+
+
+def batch_hold_curves(responses: List[EnhancedMatrixResponse], time_horizon_days: int):
+    """Best BUY hold and the mean/variance curves over 1..horizon days, chains of equal size stacked together.
+
+    Higher-order chains get no curves and hold for the whole horizon.
+    """
+    horizon = max(time_horizon_days, PLANNER_RULES["other_hold_days"], 1)
+    best = np.full(len(responses), DEFAULT_PLAN["hold_duration"])
+    best[[data.transition_order > 1 for data in responses]] = max(time_horizon_days, 1)
+    mean = np.zeros((len(responses), horizon))
+    variance = np.zeros((len(responses), horizon))
+    for rows, matrices, state_returns, state_vols, start_states in chain_groups(responses):
+        best[rows], mean[rows], variance[rows] = hold_duration_search(
+            matrices, state_returns, state_vols ** 2, start_states, np.full(len(rows), time_horizon_days), horizon
+        )
+    return best, mean, variance
+
+
+def batch_target_probabilities(responses: List[EnhancedMatrixResponse], target_return: float, time_horizon_days: int):
+    """P(wealth reaches target_return within the horizon) per asset; 0 without data, NaN for higher-order chains"""
+    probabilities = np.where([data.transition_order > 1 for data in responses], np.nan, 0.0)
+    for rows, matrices, state_returns, state_vols, start_states in chain_groups(responses):
+        probabilities[rows] = target_hit_probability(matrices, state_returns, state_vols, start_states,
+                                                     max(time_horizon_days, 1), target_return)[:, -1]
+    return probabilities
+
+
+def perform_batch_analysis(responses: List[EnhancedMatrixResponse], user_goal: dict):
+    """Score every asset with the vectorized planner rules; returns one analysis dict per response"""
+    time_horizon_days = user_goal.get("time_horizon_days", 30)
+    metrics = plan_metrics(responses, time_horizon_days)
+    target_return = user_goal.get("target_return", 1.0)
+    best_hold, mean, variance = batch_hold_curves(responses, time_horizon_days)
+    probabilities = batch_target_probabilities(responses, target_return, time_horizon_days)
+    scored = score_plans(metrics, buy_hold_days=best_hold, target_probability=probabilities)
     
-    # Simplified analysis for hackathon
+    has_data = metrics["has_data"]
+    has_curve = np.array([propagates(data) for data in responses], dtype=bool)
+    projected = np.full(len(responses), DEFAULT_PLAN["projected_return"])
+    projected[has_data] = 1.0 + metrics["expected_return"][has_data]
+    projected[has_curve] = 1.0 + curve_at(mean[has_curve], scored["hold_duration"][has_curve])
+    n_curve = max(time_horizon_days, 1)
     
-    # If no data is available, provide a default response
+    analyses = []
+    for i, data in enumerate(responses):
+        signal = int(scored["signal"][i])
+        if has_curve[i]:
+            text = (f"{reasoning(signal, data.trend_momentum, data.expected_return_30d)}; "
+                    f"{probabilities[i]:.0%} chance of reaching {target_return:.2f}x within {time_horizon_days}d")
+        elif has_data[i]:
+            text = reasoning(signal, data.trend_momentum, data.expected_return_30d)
+        else:
+            text = "Insufficient data for reliable analysis. Taking a cautious approach."
+        analyses.append({
+            "action": ACTION_NAMES[signal],
+            "hold_duration": int(scored["hold_duration"][i]),
+            "projected_return": float(projected[i]),
+            "confidence": float(scored["confidence"][i]),
+            "risk_adjusted_score": float(scored["risk_adjusted_score"][i]),
+            "momentum_factor": float(scored["momentum_factor"][i]),
+            "volatility_opportunity": VOLATILITY_SCORE,
+            "trading_signal": SIGNAL_NAMES[signal],
+            "signal_strength": float(scored["signal_strength"][i]),
+            "reasoning": text,
+            "expected_return_curve": mean[i, :n_curve].tolist() if has_curve[i] else [],
+            "risk_curve": np.sqrt(variance[i, :n_curve]).tolist() if has_curve[i] else [],
+            "target_probability": float(probabilities[i]) if has_curve[i] else 0.0
+        })
+    return analyses
+
+
+def plan_response(asset_name: str, analysis_result: dict):
+    return EnhancedPlanResponse(
+        asset_name=asset_name,
+        action=analysis_result["action"],
+        hold_duration_days=analysis_result["hold_duration"],
+        projected_return=analysis_result["projected_return"],
+        confidence=analysis_result["confidence"],
+        risk_adjusted_score=analysis_result["risk_adjusted_score"],
+        momentum_factor=analysis_result["momentum_factor"],
+        volatility_opportunity=analysis_result["volatility_opportunity"],
+        trading_signal=analysis_result["trading_signal"],
+        signal_strength=analysis_result["signal_strength"],
+        reasoning=analysis_result["reasoning"],
+        expected_return_curve=analysis_result["expected_return_curve"],
+        risk_curve=analysis_result["risk_curve"],
+        target_probability=analysis_result["target_probability"]
+    )
+
+
+def perform_enhanced_analysis(data: EnhancedMatrixResponse, user_goal: dict, ctx):
+    """Plan for one asset: the batch scorer on a single row, plus a log of the reasoning"""
     if not data.states or not data.transition_matrix:
         ctx.logger.warning(f"No valid matrix data for {data.asset_name}")
-        return {
-            "action": "Hold",
-            "hold_duration": 30,
-            "projected_return": 1.02,
-            "confidence": 0.5,
-            "risk_adjusted_score": 0.5,
-            "momentum_factor": 0.0,
-            "volatility_opportunity": 0.5,
-            "trading_signal": "HOLD",
-            "signal_strength": 0.5,
-            "reasoning": "Insufficient data for reliable analysis. Taking a cautious approach."
-        }
-    
-    # Extract data and calculate scores
-    trend_momentum = data.trend_momentum
-    expected_return = data.expected_return_30d
-    risk_score = data.risk_score
-    confidence = data.confidence_score
-    
-    # Simplified scoring
-    momentum_score = max(0.0, (trend_momentum + 1.0) / 2.0)
-    expected_return_score = min(1.0, max(0.0, expected_return * 5))  # Scale to 0-1
-    volatility_score = 0.5  # Neutral score for volatility
-    
-    # Determine risk-adjusted score
-    risk_adjusted_score = (momentum_score * 0.4 + expected_return_score * 0.4 + volatility_score * 0.2) * confidence
-    
-    # Trading decision logic - simplified
-    if trend_momentum > 0.3 and expected_return > 0.02:
-        trading_signal = "BUY"
-        signal_strength = min(1.0, trend_momentum * 0.7 + expected_return * 15)
-        reasoning = f"Strong upward momentum ({trend_momentum:.2f}) with good expected return ({expected_return:.2%})"
-    elif trend_momentum < -0.3:
-        trading_signal = "SELL"
-        signal_strength = min(1.0, abs(trend_momentum) * 0.7)
-        reasoning = f"Downward momentum detected ({trend_momentum:.2f})"
-    else:
-        trading_signal = "HOLD"
-        signal_strength = 0.5
-        reasoning = "No strong signals detected"
-    
-    # Optimal holding period
-    if trading_signal == "BUY":
-        hold_duration = min(60, user_goal.get("time_horizon_days", 30))
-    else:
-        hold_duration = 14  # Two weeks for non-buy signals
-    
-    projected_return = 1.0 + (expected_return * (hold_duration / 30))
+    analysis = perform_batch_analysis([data], user_goal)[0]
+    if not propagates(data):
+        return analysis
     
+    horizon_return = markov_expected_return(data, user_goal.get("time_horizon_days", 30))
     ctx.logger.info(f"Enhanced analysis for {data.asset_name}:")
-    ctx.logger.info(f"  Risk-adjusted score: {risk_adjusted_score:.3f}")
-    ctx.logger.info(f"  Trading signal: {trading_signal} (strength: {signal_strength:.3f})")
-    ctx.logger.info(f"  Reasoning: {reasoning}")
-    
-    return {
-        "action": "Invest" if trading_signal == "BUY" else ("Sell" if trading_signal == "SELL" else "Hold"),
-        "hold_duration": hold_duration,
-        "projected_return": projected_return,
-        "confidence": confidence,
-        "risk_adjusted_score": risk_adjusted_score,
-        "momentum_factor": trend_momentum,
-        "volatility_opportunity": volatility_score,
-        "trading_signal": trading_signal,
-        "signal_strength": signal_strength,
-        "reasoning": reasoning
-    }
+    ctx.logger.info(f"  Expected return over {user_goal.get('time_horizon_days', 30)}d horizon: {horizon_return:.2%}")
+    curve = analysis["expected_return_curve"]
+    peak = int(np.argmax(curve))
+    ctx.logger.info(f"  Expected return peaks at {curve[peak]:.2%} after {peak + 1}d; "
+                    f"hold {analysis['hold_duration']}d for {analysis['projected_return'] - 1:.2%}")
+    ctx.logger.info(f"  Risk-adjusted score: {analysis['risk_adjusted_score']:.3f}")
+    ctx.logger.info(f"  Trading signal: {analysis['trading_signal']} (strength: {analysis['signal_strength']:.3f})")
+    ctx.logger.info(f"  Reasoning: {analysis['reasoning']}")
+    return analysis
+
+
+def markov_expected_return(data: EnhancedMatrixResponse, horizon_days: int):
+    """Expected cumulative return over any horizon from the Markov chain in the response (closed form)"""
+    matrix = np.array(data.transition_matrix, dtype=float)
+    state_return_values = np.array([data.state_returns.get(state, 0.0) for state in data.states])
+    if data.last_known_state in data.states:
+        start_state = data.states.index(data.last_known_state)
+    else:
+        start_state = len(data.states) // 2
+    return float(expected_return_for_state(matrix, state_return_values, start_state, horizon_days))
 
 
 def create_default_analysis(asset_name, reason):
@@ -239,6 +555,17 @@ def create_default_analysis(asset_name, reason):
     )
 
 
+@agent.on_message(model=PlannerStatsRequest)
+async def handle_planner_stats_request(ctx: Context, sender: str, msg: PlannerStatsRequest):
+    stats = dict(PLAN_CACHE.stats(), saved_seconds=ROUND_TRIPS["saved_seconds"])
+    requests = dict(REQUEST_STATS, round_trips=ROUND_TRIPS["count"],
+                    mean_round_trip_seconds=ROUND_TRIPS["seconds"] / ROUND_TRIPS["count"] if ROUND_TRIPS["count"] else 0.0)
+    ctx.logger.info(f"Plan cache: {stats['hits']} hits, {stats['misses']} misses, "
+                    f"{stats['saved_seconds']:.1f}s of matrix round-trips saved")
+    await ctx.send(sender, PlannerStatsResponse(plan_cache={k: float(v) for k, v in stats.items()},
+                                                requests={k: float(v) for k, v in requests.items()}))
+
+
 if __name__ == "__main__":
     print(f"Starting {AGENT_NAME} on http://127.0.0.1:{AGENT_PORT}")
     print(f"My address is: {agent.address}")
@@ -0,0 +1,138 @@
+"""
+Fast stationarity screening for return series.
+A fixed-lag Augmented Dickey-Fuller regression (with constant) is solved for a whole block of series
+at once with batched normal equations and scored against MacKinnon's critical values and p-value
+approximation. Only series whose screen lands in the inconclusive band get statsmodels' full
+autolag adfuller, and every result is cached per (ticker, window end, length).
+"""
+import threading
+import numpy as np
+from scipy.special import ndtr
+from response_cache import TTLCache
+
+SIGNIFICANCE = 0.05
+INCONCLUSIVE_BAND = (0.01, 0.10)  # Screen p-values inside this band are confirmed with the full test
+
+# MacKinnon (2010) critical value surface for the constant-only case: c0 + c1/T + c2/T^2 + c3/T^3
+CRITICAL_VALUE_COEFFICIENTS = {
+    '1%': (-3.43035, -6.5393, -16.786, -79.433),
+    '5%': (-2.86154, -2.8903, -4.234, -40.040),
+    '10%': (-2.56677, -1.5384, -2.809, 0.0),
+}
+# MacKinnon (1994) p-value polynomials for the constant-only case, N = 1
+P_SMALL = (2.1659, 1.4412, 0.038269)
+P_LARGE = (1.7339, 0.93202, -0.12745, -0.010368)
+TAU_STAR, TAU_MIN, TAU_MAX = -1.61, -18.83, 2.74
+
+
+def fixed_lag(n_obs):
+    """Said-Dickey rule of thumb: about the cube root of the sample size."""
+    return max(1, int(np.floor((n_obs - 1) ** (1 / 3))))
+
+
+def critical_values(n_obs):
+    return {level: float(np.polyval(coefficients[::-1], 1.0 / n_obs))
+            for level, coefficients in CRITICAL_VALUE_COEFFICIENTS.items()}
+
+
+def mackinnon_pvalue(statistic):
+    """Approximate p-values for ADF statistics (scalar or array)."""
+    statistic = np.asarray(statistic, dtype=float)
+    small = np.polyval(P_SMALL[::-1], statistic)
+    large = np.polyval(P_LARGE[::-1], statistic)
+    pvalue = ndtr(np.where(statistic <= TAU_STAR, small, large))
+    pvalue = np.where(statistic > TAU_MAX, 1.0, np.where(statistic < TAU_MIN, 0.0, pvalue))
+    return float(pvalue) if pvalue.ndim == 0 else pvalue
+
+
+def adf_statistic_block(series, lags=None):
+    """ADF t-statistics of an (assets, time) block of equal-length, NaN-free series at a fixed lag.
+
+    Regresses dy_t on [y_{t-1}, dy_{t-1} .. dy_{t-p}, 1] for every row at once, the same regression
+    as adfuller(x, maxlag=p, autolag=None). Returns (statistics, lags, n_obs).
+    """
+    series = np.atleast_2d(np.asarray(series, dtype=float))
+    n_assets, length = series.shape
+    lags = fixed_lag(length) if lags is None else lags
+    diffs = np.diff(series, axis=1)
+    n_obs = diffs.shape[1] - lags
+
+    lagged_diffs = [diffs[:, lags - i:lags - i + n_obs] for i in range(1, lags + 1)]
+    columns = [series[:, lags:lags + n_obs]] + lagged_diffs + [np.ones((n_assets, n_obs))]
+    X = np.stack(columns, axis=-1)                      # (assets, n_obs, lags + 2)
+    y = diffs[:, lags:]                                 # (assets, n_obs)
+
+    XtX = np.einsum('aij,aik->ajk', X, X)
+    Xty = np.einsum('aij,ai->aj', X, y)
+    XtX_inv = np.linalg.inv(XtX)
+    beta = np.einsum('ajk,ak->aj', XtX_inv, Xty)
+    residuals = y - np.einsum('aij,aj->ai', X, beta)
+    sigma2 = (residuals ** 2).sum(axis=1) / (n_obs - X.shape[-1])
+    statistics = beta[:, 0] / np.sqrt(sigma2 * XtX_inv[:, 0, 0])
+    return statistics, lags, n_obs
+
+
+def full_adf(values):
+    """statsmodels' adfuller with AIC lag selection (imported only when a screen is inconclusive)."""
+    from statsmodels.tsa.stattools import adfuller
+    statistic, pvalue, used_lag, n_obs, crit, _ = adfuller(values, autolag='AIC')
+    return {'adf_statistic': float(statistic), 'p_value': float(pvalue), 'lags': int(used_lag),
+            'n_obs': int(n_obs), 'critical_values': {k: float(v) for k, v in crit.items()}}
+
+
+class StationarityService:
+    """Screens many series per call and caches results by (key, window end, length); safe to share across threads."""
+
+    def __init__(self, cache=None, significance=SIGNIFICANCE, inconclusive_band=INCONCLUSIVE_BAND):
+        self.cache = cache if cache is not None else TTLCache(maxsize=1024, ttl_seconds=86400.0)
+        self.significance = significance
+        self.inconclusive_band = inconclusive_band
+        self.full_tests = 0
+        self.lock = threading.Lock()
+
+    def check_many(self, series_by_key, window_ends=None):
+        """Stationarity results for {key: 1-D series}; `window_ends` maps key -> last bar label for caching.
+
+        Each result has adf_statistic, p_value, lags, n_obs, critical_values, is_stationary and
+        method ('screen' or 'adfuller').
+        """
+        window_ends = window_ends or {}
+        results, todo = {}, {}
+        for key, values in series_by_key.items():
+            values = np.asarray(values, dtype=float)
+            values = values[~np.isnan(values)]
+            cache_key = (key, str(window_ends.get(key)), len(values))
+            with self.lock:
+                cached = self.cache.get(cache_key) if key in window_ends else None
+            if cached is not None:
+                results[key] = cached
+            elif len(values) < 10:
+                results[key] = None
+            else:
+                todo[key] = (cache_key, values)
+
+        # Series of equal length share one batched regression
+        by_length = {}
+        for key, (_, values) in todo.items():
+            by_length.setdefault(len(values), []).append(key)
+        for length, keys in by_length.items():
+            statistics, lags, n_obs = adf_statistic_block(np.stack([todo[key][1] for key in keys]))
+            pvalues = mackinnon_pvalue(statistics)
+            crit = critical_values(n_obs)
+            for key, statistic, pvalue in zip(keys, statistics, np.atleast_1d(pvalues)):
+                result = {'adf_statistic': float(statistic), 'p_value': float(pvalue), 'lags': lags,
+                          'n_obs': n_obs, 'critical_values': crit, 'method': 'screen'}
+                low, high = self.inconclusive_band
+                if low <= pvalue <= high:
+                    result = {**full_adf(todo[key][1]), 'method': 'adfuller'}
+                    self.full_tests += 1
+                result['is_stationary'] = result['p_value'] < self.significance
+                if key in window_ends:
+                    with self.lock:
+                        self.cache.set(todo[key][0], result)
+                results[key] = result
+        return results
+
+    def check(self, key, values, window_end=None):
+        window_ends = {key: window_end} if window_end is not None else None
+        return self.check_many({key: values}, window_ends)[key]
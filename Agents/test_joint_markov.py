@@ -0,0 +1,22 @@
+import numpy as np
+from joint_markov import JointMarkovChain
+
+
+def test_sparse_forecast_matches_dense_transition_matrix():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 3, (2, 200))
+    codes[0, 50] = -1  # A bar missing for one asset breaks its joint transitions
+    chain = JointMarkovChain(2).fit(codes)
+
+    dense = np.array([[chain.transition_probability(i, j) for j in range(chain.n_joint)]
+                      for i in range(chain.n_joint)])
+    assert np.allclose(dense.sum(axis=1), 1.0)
+
+    start = np.zeros(chain.n_joint)
+    start[chain.last_state] = 1.0
+    assert np.allclose(chain.forecast(chain.last_state, 5), start @ np.linalg.matrix_power(dense, 5))
+
+    for asset in range(2):
+        marginal = chain.marginal(chain.forecast(chain.last_state, 1), [asset])
+        expected = (start @ dense).reshape(3, 3).sum(axis=1 - asset)
+        assert np.allclose(marginal, expected)
@@ -0,0 +1,70 @@
+import numpy as np
+from markov_kernels import (STATES, BULL, NEUTRAL, BEAR, MISSING, classify_returns, count_transitions,
+                            state_return_stats, expected_cumulative_return)
+
+
+def random_chain(k, rng):
+    matrix = rng.random((k, k)) + 0.05
+    return matrix / matrix.sum(axis=1, keepdims=True)
+
+
+def test_classify_returns_matches_per_day_rule():
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0, 0.02, 500)
+    returns[[0, 17]] = np.nan
+    returns[[5, 6]] = 0.01, -0.01  # Exactly on the thresholds
+    codes = classify_returns(returns, 0.01, -0.01)
+
+    def assign_state(value):
+        if np.isnan(value):
+            return MISSING
+        if value > 0.01:
+            return BULL
+        if value < -0.01:
+            return BEAR
+        return NEUTRAL
+
+    assert codes.tolist() == [assign_state(value) for value in returns]
+
+
+def test_count_transitions_matches_loop_for_series_and_blocks():
+    rng = np.random.default_rng(1)
+    block = rng.integers(-1, len(STATES), (4, 300))
+
+    for row, counts in zip(block, count_transitions(block)):
+        expected = np.zeros((len(STATES), len(STATES)))
+        for a, b in zip(row[:-1], row[1:]):
+            if a >= 0 and b >= 0:
+                expected[a, b] += 1
+        assert np.array_equal(counts, expected)
+        assert np.array_equal(count_transitions(row), expected)
+
+
+def test_state_return_stats_matches_per_state_moments():
+    rng = np.random.default_rng(2)
+    returns = rng.normal(0, 0.02, 400)
+    codes = rng.integers(-1, len(STATES), 400)
+    counts, means, stds = state_return_stats(codes, returns)
+
+    for state in range(len(STATES)):
+        values = returns[codes == state]
+        assert counts[state] == len(values)
+        assert np.isclose(means[state], values.mean())
+        assert np.isclose(stds[state], values.std(ddof=1))
+
+
+def test_expected_cumulative_return_matches_step_by_step_propagation():
+    rng = np.random.default_rng(3)
+    matrices = np.stack([random_chain(3, rng) for _ in range(5)])
+    returns = rng.normal(0, 0.01, (5, 3))
+    starts = rng.integers(0, 3, 5)
+
+    probabilities = np.zeros((5, 3))
+    probabilities[np.arange(5), starts] = 1.0
+    expected = np.zeros(5)
+    for _ in range(30):
+        probabilities = np.einsum('ai,aij->aj', probabilities, matrices)
+        expected += (probabilities * returns).sum(axis=-1)
+
+    assert np.allclose(expected_cumulative_return(matrices, returns, starts, 30), expected)
+    assert np.isclose(expected_cumulative_return(matrices[0], returns[0], starts[0], 30), expected[0])
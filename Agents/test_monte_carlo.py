@@ -0,0 +1,22 @@
+import numpy as np
+from monte_carlo import MIN_BATCHES, VARIANCE_REDUCTION, run_sharded_simulation, run_variance_reduced_simulation
+
+TRANSITIONS = np.array([[0.8, 0.15, 0.05], [0.1, 0.8, 0.1], [0.05, 0.15, 0.8]])
+MEANS, VOLS = [0.002, 0.0, -0.002], [0.01, 0.01, 0.02]
+
+
+def test_sharded_results_are_identical_for_any_worker_count():
+    kwargs = dict(target_wealth=1.05, seed=42, shard_paths=2_000)
+    serial = run_sharded_simulation(TRANSITIONS, MEANS, VOLS, 0, 20, 9_000, n_workers=1, **kwargs)
+    parallel = run_sharded_simulation(TRANSITIONS, MEANS, VOLS, 0, 20, 9_000, n_workers=2, **kwargs)
+
+    assert serial['n_shards'] == 5
+    assert serial == parallel
+
+
+def test_adaptive_run_stays_within_a_small_path_budget():
+    for strategy in VARIANCE_REDUCTION:
+        summary = run_variance_reduced_simulation(TRANSITIONS, MEANS, VOLS, 0, 20, 1_000, target_wealth=1.05,
+                                                  strategy=strategy, ci_width=1e-9, seed=0)
+        assert summary['n_paths'] <= 1_000
+        assert summary['n_batches'] >= MIN_BATCHES
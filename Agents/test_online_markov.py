@@ -0,0 +1,38 @@
+import numpy as np
+from markov_kernels import BEAR, MISSING
+from online_markov import OnlineMarkovModel, SHORT_WINDOW
+
+
+def synthetic_closes(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 100 * np.cumprod(1 + rng.normal(0.001, 0.02, n))
+
+
+def test_update_leaves_bars_before_threshold_window_unclassified():
+    model = OnlineMarkovModel()
+    closes = synthetic_closes(SHORT_WINDOW + 1)
+    codes = [model.update(close) for close in closes[:SHORT_WINDOW]]
+
+    # SHORT_WINDOW closes give SHORT_WINDOW - 1 returns, one short of the first Volatility_20
+    assert all(code == MISSING for code in codes)
+    assert model.state_n[BEAR] == 0
+    assert model.transition_counts.sum() == 0
+    assert model.last_state == MISSING
+
+    assert model.update(closes[SHORT_WINDOW]) != MISSING
+    assert model.state_n.sum() == 1
+
+
+def test_update_chunk_matches_bar_by_bar_updates_from_cold_start():
+    closes = synthetic_closes(120, seed=1)
+    by_bar = OnlineMarkovModel()
+    codes = [by_bar.update(close) for close in closes]
+    chunked = OnlineMarkovModel()
+    chunk_codes = np.concatenate([chunked.update_chunk(closes[:70]), chunked.update_chunk(closes[70:])])
+
+    assert np.array_equal(chunk_codes, codes[1:])
+    assert np.all(chunk_codes[:SHORT_WINDOW - 1] == MISSING)
+    assert np.array_equal(chunked.transition_counts, by_bar.transition_counts)
+    assert np.array_equal(chunked.state_n, by_bar.state_n)
+    assert np.allclose(chunked.state_mean, by_bar.state_mean)
+    assert chunked.last_state == by_bar.last_state
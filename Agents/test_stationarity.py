@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from statsmodels.tsa.stattools import adfuller
+from stationarity import adf_statistic_block, fixed_lag
+
+
+@pytest.mark.filterwarnings("ignore::FutureWarning")  # adfuller's tuple return
+def test_adf_block_matches_fixed_lag_adfuller():
+    rng = np.random.default_rng(0)
+    series = np.stack([
+        rng.normal(0, 1, 300),                 # Stationary noise
+        np.cumsum(rng.normal(0, 1, 300)),      # Random walk
+        np.cumsum(rng.normal(0.01, 0.02, 300)),
+    ])
+    statistics, lags, n_obs = adf_statistic_block(series)
+    assert lags == fixed_lag(series.shape[1])
+
+    for row, statistic in zip(series, statistics):
+        expected, _, used_lag, expected_obs, _ = adfuller(row, maxlag=lags, autolag=None, regression='c')
+        assert used_lag == lags and expected_obs == n_obs
+        assert np.isclose(statistic, expected)
@@ -0,0 +1,23 @@
+import numpy as np
+from markov_kernels import STATES, count_transitions, state_return_stats
+from walk_forward import rolling_transition_counts, rolling_state_stats
+
+
+def test_rolling_window_stats_match_per_slice_kernels():
+    rng = np.random.default_rng(0)
+    window = 60
+    codes = rng.integers(-1, len(STATES), 250)
+    returns = rng.normal(0.001, 0.02, 250)
+    returns[rng.random(250) < 0.02] = np.nan
+
+    counts = rolling_transition_counts(codes, window)
+    state_counts, means, stds = rolling_state_stats(codes, returns, window)
+    assert len(counts) == len(state_counts) == len(codes) - window + 1
+
+    for i in range(len(counts)):
+        window_codes, window_returns = codes[i:i + window], returns[i:i + window]
+        assert np.array_equal(counts[i], count_transitions(window_codes))
+        expected_counts, expected_means, expected_stds = state_return_stats(window_codes, window_returns)
+        assert np.array_equal(state_counts[i], expected_counts)
+        assert np.allclose(means[i], expected_means, equal_nan=True)
+        assert np.allclose(stds[i], expected_stds, equal_nan=True)
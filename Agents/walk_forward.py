@@ -0,0 +1,164 @@
+"""
+Walk-forward Markov statistics for every rolling window of a long history in O(N).
+Bars are classified once with causal (trailing-window) thresholds, then one-hot transition counts
+and per-state return sums are accumulated into prefix sums. Each window's statistics are the
+difference of two prefix rows, so the cost does not depend on the window length.
+"""
+import numpy as np
+from markov_kernels import (STATES, NEUTRAL, MISSING, classify_returns, smoothed_transition_matrix,
+                            regime_thresholds)
+from horizon_engine import expected_return_for_state
+from markov_uncertainty import transition_confidence
+
+SHORT_WINDOW = 20  # Volatility_20, averaged over the last 20 bars like the agent's recent volatility
+MIN_RETURNS = 30   # Same minimum history the agent requires before classifying
+
+
+def _prefix(values):
+    """Prefix sums along axis 0 with a leading zero row: prefix[j] = sum(values[:j])."""
+    prefix = np.zeros((len(values) + 1,) + values.shape[1:], dtype=values.dtype)
+    np.cumsum(values, axis=0, out=prefix[1:])
+    return prefix
+
+
+def _rolling_mean_std(values, window, min_periods=None):
+    """Trailing mean and sample std of the non-NaN values among the last `window` entries at each index.
+
+    Windows with fewer than `min_periods` values (default: `window`) are NaN, like pandas rolling.
+    """
+    min_periods = window if min_periods is None else min_periods
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    n = _prefix(valid.astype(np.int64))
+    s1 = _prefix(filled)
+    s2 = _prefix(filled * filled)
+    count = (n[end] - n[start]).astype(float)
+    total = s1[end] - s1[start]
+    total_sq = s2[end] - s2[start]
+    count[count < min_periods] = np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        variance = np.maximum(total_sq - total * mean, 0.0) / (count - 1)
+    return mean, np.sqrt(variance)
+
+
+def causal_state_codes(returns, window, min_multiplier=0.5, max_multiplier=2.0):
+    """Classify every return with the regime thresholds of the trailing `window` returns up to that bar.
+
+    Unlike classifying a whole history with its own full-sample thresholds, no bar's state depends
+    on later data, so the codes can be shared by every walk-forward window. Thresholds use an
+    expanding window until `window` returns exist and need at least MIN_RETURNS of them.
+    """
+    returns = np.asarray(returns, dtype=float)
+    returns_mean, returns_std = _rolling_mean_std(returns, window, MIN_RETURNS)
+    _, volatility_20 = _rolling_mean_std(returns, SHORT_WINDOW)
+    recent_volatility, _ = _rolling_mean_std(volatility_20, SHORT_WINDOW, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bull_threshold, bear_threshold = regime_thresholds(returns_mean, returns_std, recent_volatility,
+                                                           min_multiplier, max_multiplier)
+    # One row per bar so every return is ranked against its own thresholds
+    codes = classify_returns(returns[:, None], bull_threshold, bear_threshold)[:, 0]
+    codes[np.isnan(bull_threshold) | np.isnan(bear_threshold)] = MISSING
+    return codes
+
+
+def rolling_transition_counts(codes, window, n_states=len(STATES)):
+    """Transition counts for every window of `window` consecutive bars, shape (N, k, k) with N = T - window + 1.
+
+    Row i covers bars i .. i + window - 1 (the transitions between them).
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    from_states, to_states = codes[:-1], codes[1:]
+    valid = (from_states >= 0) & (to_states >= 0)
+    one_hot = np.zeros((len(from_states), n_states * n_states), dtype=np.int64)
+    one_hot[np.flatnonzero(valid), (from_states * n_states + to_states)[valid]] = 1
+    prefix = _prefix(one_hot)
+    # Transitions between bars i .. i + W - 1 are pair indices i .. i + W - 2
+    counts = prefix[window - 1:] - prefix[:len(prefix) - window + 1]
+    return counts.reshape(-1, n_states, n_states).astype(float)
+
+
+def rolling_state_stats(codes, returns, window, n_states=len(STATES)):
+    """Per-state count, mean and sample std of returns for every window; each shaped (N, k).
+
+    Returns are centred on their overall mean before accumulation to limit cancellation in the
+    sum-of-squares difference. States with too few samples get NaN, like state_return_stats.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    returns = np.asarray(returns, dtype=float)
+    valid = (codes >= 0) & ~np.isnan(returns)
+    centre = float(returns[valid].mean()) if valid.any() else 0.0
+    rows = np.flatnonzero(valid)
+    one_hot = np.zeros((len(codes), n_states))
+    one_hot[rows, codes[valid]] = 1.0
+    centred = np.where(valid, returns - centre, 0.0)[:, None] * one_hot
+
+    def windowed(values):
+        prefix = _prefix(values)
+        return prefix[window:] - prefix[:len(prefix) - window]
+
+    counts = windowed(one_hot)
+    sums = windowed(centred)
+    sums_sq = windowed(centred * centred)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(sums_sq - sums * means, 0.0) / (counts - 1))
+    stds[counts < 2] = np.nan
+    return counts, means + centre, stds
+
+
+def _last_valid_per_window(codes, window):
+    """Last non-missing code inside each window (MISSING if the window has none)."""
+    positions = np.where(np.asarray(codes) >= 0, np.arange(len(codes)), -1)
+    last_position = np.maximum.accumulate(positions)[window - 1:]
+    window_start = np.arange(len(last_position))
+    inside = last_position >= window_start
+    return np.where(inside, np.asarray(codes)[np.maximum(last_position, 0)], MISSING)
+
+
+def walk_forward(closes, window=365, alpha=0.1, horizon_days=30, min_multiplier=0.5, max_multiplier=2.0):
+    """Refit the regime chain at every bar on the trailing `window` bars.
+
+    Returns a dict of arrays indexed by window (the window ending at bar end_index[i]):
+    transition counts/matrices (N, k, k), per-state returns and volatility (N, k), last state,
+    expected cumulative return over `horizon_days` and the Wilson confidence score.
+    """
+    closes = np.asarray(closes, dtype=float)
+    returns = np.full(len(closes), np.nan)
+    returns[1:] = closes[1:] / closes[:-1] - 1
+    n_states = len(STATES)
+
+    codes = causal_state_codes(returns, window, min_multiplier, max_multiplier)
+    transition_counts = rolling_transition_counts(codes, window, n_states)
+    transition_matrix = smoothed_transition_matrix(transition_counts, alpha)
+    state_counts, state_means, state_stds = rolling_state_stats(codes, returns, window, n_states)
+    _, window_std = _rolling_mean_std(returns, window, 2)
+    window_std = window_std[window - 1:]
+
+    state_returns = np.where(state_counts > 0, state_means, 0.0)
+    state_volatility = np.where(state_counts > 1, state_stds, window_std[:, None])
+    last_state = _last_valid_per_window(codes, window)
+    start_state = np.where(last_state == MISSING, NEUTRAL, last_state)
+
+    return {
+        'end_index': np.arange(window - 1, len(closes)),
+        'state_codes': codes,
+        'transition_counts': transition_counts,
+        'transition_matrix': transition_matrix,
+        'state_returns': state_returns,
+        'state_volatility': state_volatility,
+        'last_state': start_state,
+        'expected_return': expected_return_for_state(transition_matrix, state_returns, start_state, horizon_days),
+        'confidence_score': transition_confidence(transition_counts),
+    }
+
+
+def matrix_drift(transition_matrices, lag=1):
+    """Frobenius distance between each window's matrix and the one `lag` windows earlier (NaN for the first `lag`)."""
+    matrices = np.asarray(transition_matrices, dtype=float)
+    drift = np.full(len(matrices), np.nan)
+    if len(matrices) > lag:
+        drift[lag:] = np.linalg.norm(matrices[lag:] - matrices[:-lag], axis=(1, 2))
+    return drift
@@ -1,12 +1,20 @@
+import os
+import sys
 import yfinance as yf
 import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
-from scipy import stats
-from statsmodels.tsa.stattools import adfuller
 import warnings
 warnings.filterwarnings('ignore')
 
+# The state kernels live next to the agents so both code paths count transitions the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Agents'))
+from markov_kernels import STATES, classify_returns, count_transitions
+from markov_uncertainty import wilson_intervals
+from stationarity import StationarityService
+
+# Fixed-lag ADF screen; statsmodels' autolag adfuller only runs when the screen is inconclusive
+STATIONARITY = StationarityService()
+
 def get_transition_matrix(ticker, name):
     """
     Fetches historical data for a given cryptocurrency ticker,
@@ -50,63 +58,28 @@ def get_transition_matrix(ticker, name):
     print(f"    Return std deviation: {returns_std:.4f}")
     
     # Test for stationarity using Augmented Dickey-Fuller test
-    adf_statistic, adf_pvalue, adf_usedlag, adf_nobs, adf_critical_values, adf_icbest = adfuller(returns_clean)
-    is_stationary = adf_pvalue < 0.05
-    print(f"  Stationarity test (ADF): {'Stationary' if is_stationary else 'Non-stationary'} (p-value: {adf_pvalue:.4f})")
+    adf = STATIONARITY.check(ticker, returns_clean.to_numpy(dtype=float), returns_clean.index[-1])
+    is_stationary = adf['is_stationary']
+    print(f"  Stationarity test (ADF {adf['method']}): {'Stationary' if is_stationary else 'Non-stationary'} (p-value: {adf['p_value']:.4f})")
     if not is_stationary:
         print(f"    Warning: Time series may not be stationary. Markov assumption may be violated.")
     
-    def assign_state(return_val):
-        if return_val > bull_threshold:
-            return 'Bull'
-        elif return_val < bear_threshold:
-            return 'Bear'
-        else:
-            return 'Neutral'
-            
-    # Assign a state to each day
-    data['State'] = data['Daily_Return'].apply(assign_state)
-    
-    # Drop the first row as it has no return value
-    state_sequence = data['State'].dropna().tolist()
+    # Assign a state code to each day (the first day has no return and is skipped)
+    state_codes = classify_returns(data['Daily_Return'].to_numpy(dtype=float), bull_threshold, bear_threshold)
     
     # Define the possible states
-    states = ['Bull', 'Neutral', 'Bear']
-    state_map = {state: i for i, state in enumerate(states)}
+    states = list(STATES)
     
     # Create a transition count matrix
-    transition_counts = np.zeros((len(states), len(states)))
-    
-    for i in range(len(state_sequence) - 1):
-        from_state = state_map[state_sequence[i]]
-        to_state = state_map[state_sequence[i+1]]
-        transition_counts[from_state, to_state] += 1
+    transition_counts = count_transitions(state_codes, len(states))
         
     # Normalize the counts to get probabilities
     # Add a small epsilon to avoid division by zero if a state never occurs
     row_sums = transition_counts.sum(axis=1, keepdims=True)
     transition_matrix = transition_counts / (row_sums + 1e-9)
     
-    # Calculate confidence intervals for transition probabilities
-    confidence_intervals = np.zeros((len(states), len(states), 2))
-    alpha = 0.05  # 95% confidence interval
-    
-    for i in range(len(states)):
-        n = int(row_sums[i, 0])  # Total transitions from state i
-        if n > 0:
-            for j in range(len(states)):
-                k = int(transition_counts[i, j])  # Successes (transitions to state j)
-                if k > 0 and n > k:
-                    # Use Wilson score interval for binomial proportions
-                    z = stats.norm.ppf(1 - alpha/2)
-                    p = k / n
-                    denominator = 1 + z**2/n
-                    centre = (p + z**2/(2*n)) / denominator
-                    delta = z * np.sqrt((p*(1-p) + z**2/(4*n))/n) / denominator
-                    confidence_intervals[i, j, 0] = max(0, centre - delta)
-                    confidence_intervals[i, j, 1] = min(1, centre + delta)
-                else:
-                    confidence_intervals[i, j, :] = [0, 0]
+    # 95% Wilson score intervals for every transition probability in one array expression
+    confidence_intervals = wilson_intervals(transition_counts, confidence=0.95)
     
     return states, transition_matrix, confidence_intervals
 